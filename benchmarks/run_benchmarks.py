@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+'''
+Benchmarks of the hot path of nginx-log-monitor.
+
+Usage:
+
+    pip install -e .
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --compare results.json
+
+The results are printed as JSON, so that results of different commits
+can be compared (--compare prints the speed ratio against older results).
+'''
+
+from argparse import ArgumentParser
+from asyncio import sleep, wait_for
+import json
+from pathlib import Path
+import platform
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+from time import monotonic as monotime
+
+from nginx_log_monitor.access_log_parser import AccessLogParser, parse_access_log_line, parse_log_line, InvalidLogLineError
+from nginx_log_monitor.access_log_parser import parse_date_utc
+from nginx_log_monitor.columnar import parse_batch
+from nginx_log_monitor.configuration import Configuration
+from nginx_log_monitor.file_reader import FileReader, tail_files
+from nginx_log_monitor.main import process_log_lines, update_stats
+from nginx_log_monitor.latency_stats import LatencyStats
+from nginx_log_monitor.overwatch import generate_report
+from nginx_log_monitor.path_stats import PathStats, unify_path
+from nginx_log_monitor.space_saving import SpaceSaving
+from nginx_log_monitor.status_stats import StatusStats
+from nginx_log_monitor.util import asyncio_run, create_task, PubSub
+
+from synthetic_log import generate_lines
+
+
+benchmarks = [] # [( name, function )]
+
+
+def benchmark(f):
+    benchmarks.append((f.__name__[len('bench_'):], f))
+    return f
+
+
+def _parse_all(lines):
+    records = []
+    for line in lines:
+        try:
+            records.append(parse_access_log_line(line))
+        except InvalidLogLineError:
+            pass
+    return records
+
+
+@benchmark
+def bench_parse_access_log_line(lines):
+    t0 = monotime()
+    _parse_all(lines)
+    return len(lines), monotime() - t0
+
+
+@benchmark
+def bench_parse_date(lines):
+    date_strs = [r.date_str for r in _parse_all(lines)]
+    t0 = monotime()
+    for date_str in date_strs:
+        parse_date_utc(date_str)
+    return len(date_strs), monotime() - t0
+
+
+@benchmark
+def bench_unify_path(lines):
+    paths = [r.path for r in _parse_all(lines)]
+    t0 = monotime()
+    for path in paths:
+        unify_path(path)
+    return len(paths), monotime() - t0
+
+
+@benchmark
+def bench_space_saving_scan(lines):
+    '''
+    Every key is new, so every insert evicts the key with the smallest count
+    '''
+    keys = ['/scan/{}'.format(i) for i in range(len(lines))]
+    c = SpaceSaving(10000)
+    t0 = monotime()
+    for key in keys:
+        c[key] += 1
+    return len(keys), monotime() - t0
+
+
+@benchmark
+def bench_status_stats_update(lines):
+    records = _parse_all(lines)
+    stats = StatusStats()
+    t0 = monotime()
+    for r in records:
+        stats.update(r)
+    return len(records), monotime() - t0
+
+
+@benchmark
+def bench_path_stats_update(lines):
+    records = _parse_all(lines)
+    stats = PathStats()
+    t0 = monotime()
+    for r in records:
+        stats.update(r)
+    return len(records), monotime() - t0
+
+
+@benchmark
+def bench_latency_stats_update(lines):
+    records = _parse_all(lines)
+    stats = LatencyStats()
+    t0 = monotime()
+    for r in records:
+        stats.update(r)
+    return len(records), monotime() - t0
+
+
+@benchmark
+def bench_generate_report(lines):
+    records = _parse_all(lines)
+    conf = Configuration(cfg_path=None)
+    status_stats, path_stats, latency_stats = StatusStats(), PathStats(), LatencyStats()
+    status_stats.update_many(records)
+    path_stats.update_many(records)
+    latency_stats.update_many(records)
+    count = 100
+    t0 = monotime()
+    for i in range(count):
+        generate_report(conf, status_stats, path_stats, latency_stats)
+    return count, monotime() - t0
+
+
+def _read_log_file(lines, read):
+    '''
+    Writes the lines to a file and returns (line count, duration) of read(FileReader)
+    '''
+    with TemporaryDirectory() as tmp_dir:
+        log_path = Path(tmp_dir) / 'access.log'
+        log_path.write_text('')
+        with FileReader(log_path) as fr:
+            read(fr)
+            with log_path.open('a') as f:
+                f.write(''.join(line + '\n' for line in lines))
+            t0 = monotime()
+            count = read(fr)
+            return count, monotime() - t0
+
+
+@benchmark
+def bench_file_reader_read_lines(lines):
+    return _read_log_file(lines, lambda fr: sum(1 for line in fr.read_lines()))
+
+
+@benchmark
+def bench_file_reader_line_batches(lines):
+    return _read_log_file(lines, lambda fr: sum(len(batch) for batch in fr.read_line_batches()))
+
+
+def _chunks(lines, chunk_lines=10000):
+    lines = [line.encode() for line in lines]
+    return [lines[i:i + chunk_lines] for i in range(0, len(lines), chunk_lines)]
+
+
+@benchmark
+def bench_per_record_stats(lines):
+    '''
+    bytes lines -> AccessLogRecords -> StatusStats, PathStats & LatencyStats update_many()
+    '''
+    chunks = _chunks(lines)
+    parser = AccessLogParser()
+    stats_objs = [StatusStats(), PathStats(), LatencyStats()]
+    t0 = monotime()
+    for chunk in chunks:
+        records = [r for r in (parse_log_line(parser, line) for line in chunk) if r is not None]
+        for stats_obj in stats_objs:
+            stats_obj.update_many(records)
+    return len(lines), monotime() - t0
+
+
+@benchmark
+def bench_columnar_stats(lines):
+    '''
+    bytes lines -> RecordBatch columns -> StatusStats, PathStats & LatencyStats update_batch()
+    '''
+    chunks = _chunks(lines)
+    parser = AccessLogParser()
+    stats_objs = [StatusStats(), PathStats(), LatencyStats()]
+    t0 = monotime()
+    for chunk in chunks:
+        record_batch = parse_batch(parser, chunk)
+        for stats_obj in stats_objs:
+            stats_obj.update_batch(record_batch)
+    return len(lines), monotime() - t0
+
+
+@benchmark
+def bench_pipeline(lines):
+    '''
+    tail_files -> parsing -> PubSub -> StatusStats & PathStats
+    '''
+    expected_count = len(_parse_all(lines))
+
+    async def run(log_path):
+        pubsub = PubSub(1000)
+        parser = AccessLogParser()
+        status_stats, path_stats = StatusStats(), PathStats()
+
+        async def process_lines(path, lines):
+            await process_log_lines(pubsub, parser, lines)
+
+        tasks = [
+            create_task(update_stats(pubsub.subscribe(), [status_stats, path_stats])),
+            create_task(tail_files(lambda: [log_path], process_lines=process_lines, sleep_interval=0.01)),
+        ]
+        try:
+            await sleep(0.1)
+            t0 = monotime()
+            with log_path.open('a') as f:
+                f.write(''.join(line + '\n' for line in lines))
+
+            async def wait_for_all():
+                while sum(status_stats.total_status_count.values()) < expected_count:
+                    await sleep(0.001)
+
+            await wait_for(wait_for_all(), 300)
+            return len(lines), monotime() - t0
+        finally:
+            for t in tasks:
+                t.cancel()
+
+    with TemporaryDirectory() as tmp_dir:
+        log_path = Path(tmp_dir) / 'access.log'
+        log_path.write_text('')
+        return asyncio_run(run(log_path))
+
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=str(Path(__file__).parent), stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def main():
+    p = ArgumentParser()
+    p.add_argument('--lines', type=int, default=100000, help='number of generated log lines')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--only', metavar='NAME', action='append', help='run only given benchmark(s)')
+    p.add_argument('--output', metavar='FILE', help='write results to file')
+    p.add_argument('--compare', metavar='FILE', help='compare with results from previous run')
+    args = p.parse_args()
+    lines = list(generate_lines(args.lines, seed=args.seed))
+    results = {
+        'commit': get_git_commit(),
+        'python': platform.python_version(),
+        'lines': args.lines,
+        'seed': args.seed,
+        'benchmarks': {},
+    }
+    for name, f in benchmarks:
+        if args.only and name not in args.only:
+            continue
+        count, duration = f(lines)
+        results['benchmarks'][name] = {
+            'count': count,
+            'duration_s': round(duration, 6),
+            'ops_per_s': round(count / duration, 1),
+        }
+        print('{:30} {:12.0f} ops/s'.format(name, count / duration), file=sys.stderr)
+    if args.compare:
+        previous = json.loads(Path(args.compare).read_text())
+        for name, r in results['benchmarks'].items():
+            prev = previous['benchmarks'].get(name)
+            if prev:
+                r['speedup'] = round(r['ops_per_s'] / prev['ops_per_s'], 3)
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
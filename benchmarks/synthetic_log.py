@@ -0,0 +1,114 @@
+'''
+Deterministic generator of synthetic nginx access log lines.
+
+The same seed always produces the same lines, so benchmark results of
+different commits are comparable.
+'''
+
+from random import Random
+
+from nginx_log_monitor.access_log_parser import nginx_log_formats
+
+
+hosts = ['example.com', 'www.example.com', 'api.example.com', 'static.example.net']
+
+# (weight, path template); {n} is a number, {uuid} a hex uuid, {UUID} dashed upper-case uuid
+path_templates = [
+    (300, '/'),
+    (200, '/static/app.{n}.js'),
+    (150, '/api/items/{n}'),
+    (100, '/api/items/{n}/comments?page={n}'),
+    (80, '/campaigns/{uuid}/templates'),
+    (50, '/users/{UUID}/avatar.png'),
+    (40, '/login'),
+    (30, '/search?q=foo{n}'),
+    (20, '/feed.xml'),
+    (10, '/wp-login.php'),
+    (10, '/scan/{uuid}/{n}'),
+]
+
+status_weights = [
+    (850, 200), (50, 304), (20, 301), (40, 404), (10, 400),
+    (5, 500), (10, 502), (5, 503), (10, 504),
+]
+
+methods = [(80, 'GET'), (15, 'POST'), (3, 'PUT'), (2, 'DELETE')]
+
+user_agents = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/80.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_3) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/13.0.5 Safari/605.1.15',
+    'curl/7.68.0',
+    'Mozilla/5.0 zgrab/0.x',
+]
+
+bogus_lines = [
+    '185.1.2.3 - - [{time_local}] "\\x03\\x00\\x00/*\\xE0\\x00\\x00\\x00\\x00\\x00Cookie: mstshash=Administr" 400 157 "-" "-"',
+    '185.1.2.3 - - [{time_local}] "\\x16\\x03\\x01\\x00\\xCA\\x01\\x00\\x00\\xC6\\x03\\x03" 400 157 "-" "-"',
+    'this is not an access log line',
+]
+
+
+def _weighted(rnd, choices):
+    total = sum(w for w, v in choices)
+    x = rnd.random() * total
+    for w, v in choices:
+        x -= w
+        if x < 0:
+            return v
+    return choices[-1][1]
+
+
+def _path(rnd):
+    template = _weighted(rnd, path_templates)
+    return template.format(
+        n=int(rnd.paretovariate(1.2)),
+        uuid='{:032x}'.format(rnd.getrandbits(128)),
+        UUID='{:08X}-{:04X}-{:04X}-{:04X}-{:012X}'.format(
+            rnd.getrandbits(32), rnd.getrandbits(16), rnd.getrandbits(16), rnd.getrandbits(16), rnd.getrandbits(48)))
+
+
+def _time_local(t):
+    # t is seconds since 04/Feb/2020:00:00:00 +0100
+    return '04/Feb/2020:{:02d}:{:02d}:{:02d} +0100'.format(t // 3600 % 24, t // 60 % 60, t % 60)
+
+
+def generate_line(rnd, log_format_index, t):
+    log_format = nginx_log_formats[log_format_index]
+    status = _weighted(rnd, status_weights)
+    line = log_format
+    values = [
+        ('$host', rnd.choice(hosts)),
+        ('$remote_addr', '{}.{}.{}.{}'.format(rnd.randint(1, 223), rnd.randint(0, 255), rnd.randint(0, 255), rnd.randint(1, 254))),
+        ('$remote_user', '-'),
+        ('$time_local', _time_local(t)),
+        ('$status', str(status)),
+        ('$body_bytes_sent', str(rnd.randint(0, 50000))),
+        ('$http_referer', '-' if rnd.random() < 0.7 else 'https://example.com/'),
+        ('$http_user_agent', rnd.choice(user_agents)),
+        ('$gzip_ratio', '{:.2f}'.format(rnd.uniform(1, 5))),
+        ('$request_time', '{:.3f}'.format(rnd.expovariate(20))),
+        ('$upstream_response_time', '-' if status == 304 else '{:.3f}'.format(rnd.expovariate(25))),
+        ('$pipe', '.' if rnd.random() < 0.95 else 'p'),
+        # after $request_time
+        ('$request', '{} {} HTTP/1.1'.format(_weighted(rnd, methods), _path(rnd))),
+    ]
+    for name, value in values:
+        line = line.replace(name, value)
+    return line
+
+
+def generate_lines(count, seed=0, log_format_indexes=None, bogus_ratio=0.005, lines_per_second=1000):
+    '''
+    Yields count lines (str, without newline). Every line uses one of the
+    formats from nginx_log_formats (all of them by default); bogus_ratio
+    of lines are bogus or garbage.
+    '''
+    rnd = Random(seed)
+    if log_format_indexes is None:
+        log_format_indexes = list(range(len(nginx_log_formats)))
+    for i in range(count):
+        t = i // lines_per_second
+        if rnd.random() < bogus_ratio:
+            yield rnd.choice(bogus_lines).format(time_local=_time_local(t))
+        else:
+            yield generate_line(rnd, rnd.choice(log_format_indexes), t)
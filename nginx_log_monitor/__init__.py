@@ -1,2 +1,2 @@
 from .main import nginx_log_monitor_main
-from .access_log_parser import parse_access_log_line
+from .access_log_parser import parse_access_log_line, AccessLogParser
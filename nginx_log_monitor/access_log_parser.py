@@ -2,10 +2,10 @@
 The main function in this module is parse_access_log_line().
 '''
 
+from collections import OrderedDict
 from datetime import datetime, timezone, timedelta
 from functools import lru_cache
 from logging import getLogger
-import pytz
 import re
 
 
@@ -53,7 +53,10 @@ log_format_parts_to_regex = {
     '-': '-',
     '$remote_addr': r'(?P<remote_addr>{ipv4_regex})'.format(ipv4_regex=ipv4_regex),
     '$remote_user': r'(?P<remote_user>[^ ]+)',
-    '[$time_local]': r'\[(?P<time_local>[^]]+)\]',
+    # the date is parsed lazily, so its format is validated here already
+    '[$time_local]': (
+        r'\[(?P<time_local>[0-3][0-9]/(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)/[12][0-9]{3}'
+        r':[0-2][0-9]:[0-5][0-9]:[0-6][0-9] [+-][0-9]{4})\]'),
     '"$request"': r'"(?P<method>[A-Z]+) (?P<path>/[^ "]*) (?P<protocol>HTTP/[0-9.]+)"',
     '$status': r'(?P<status>[0-9]{3})',
     '$body_bytes_sent': r'(?P<body_bytes_sent>[0-9]+)',
@@ -62,6 +65,7 @@ log_format_parts_to_regex = {
     '"$gzip_ratio"': r'"(?P<gzip_ratio>[0-9]+[,.][0-9]+)"',
     '$request_time': r'(?P<request_time>[0-9]+[,.][0-9]+)',
     '$upstream_response_time': r'(?P<upstream_response_time>-|[0-9]+[,.][0-9]+)',
+    '$upstream_addr': r'(?P<upstream_addr>-|[^ ]+)',
     '$pipe': r'(?P<pipe_flag>[.p])',
     '$host': r'(?P<host>[^ ]+)',
 }
@@ -85,7 +89,7 @@ def log_format_to_regex(log_format):
 
 
 def _re_compile(regex):
-    assert isinstance(regex, str)
+    assert isinstance(regex, (str, bytes))
     try:
         return re.compile(regex)
     except Exception as e:
@@ -97,6 +101,26 @@ def get_nginx_log_format_compiled_regexes():
     return [_re_compile(log_format_to_regex(s)) for s in nginx_log_formats]
 
 
+@lru_cache()
+def compile_log_format(log_format):
+    return _re_compile(log_format_to_regex(log_format))
+
+
+# The regexes for matching raw lines (bytes) are compiled from the same regex strings.
+# The regex parts are ASCII-only, so they match the same lines; [^ ] etc. match any
+# byte, so invalid UTF-8 in for example the user agent does not make the line fail.
+
+
+@lru_cache()
+def get_nginx_log_format_compiled_bytes_regexes():
+    return [_re_compile(log_format_to_regex(s).encode('ascii')) for s in nginx_log_formats]
+
+
+@lru_cache()
+def compile_log_format_bytes(log_format):
+    return _re_compile(log_format_to_regex(log_format).encode('ascii'))
+
+
 # code before this line prepares the regexes for log line parsing
 # -----------------------------------------------------------------------------------------------
 # code after this line does the log line parsing (executing regexes & postprocessing)
@@ -115,13 +139,168 @@ def parse_access_log_line(line):
         #logger.debug('regex: %r line: %r -> %r', regex, line, m)
         if m:
             return AccessLogRecord(m.groupdict().get)
+    raise _unrecognized_line_error(line)
+
+
+class AccessLogParser:
+    '''
+    Parser for lines of one particular access log file.
+
+    If log_format (the nginx log_format string) is given, it is compiled once
+    and every line is matched only against it. Otherwise the format is
+    auto-detected from nginx_log_formats and the format that matched last
+    time is tried first.
+
+    Lines can be str or bytes; bytes lines are matched without decoding and
+    only the fields that are accessed get decoded (see AccessLogRecord).
+    '''
+
+    def __init__(self, log_format=None):
+        if log_format:
+            self._formats = [(log_format, compile_log_format(log_format), compile_log_format_bytes(log_format))]
+        else:
+            self._formats = list(zip(
+                nginx_log_formats,
+                get_nginx_log_format_compiled_regexes(),
+                get_nginx_log_format_compiled_bytes_regexes()))
+
+    @property
+    def log_format(self):
+        return self._formats[0][0]
+
+    def parse(self, line):
+        '''
+        Same as parse_access_log_line()
+        '''
+        m = self.match(line)
+        if isinstance(line, bytes):
+            return AccessLogRecord(_BytesGroupGetter(m.groupdict()))
+        return AccessLogRecord(m.groupdict().get)
+
+    def match(self, line):
+        '''
+        Returns regex match object of the line (without trailing newline).
+        The match groups are bytes if the line is bytes.
+        '''
+        if isinstance(line, bytes):
+            line = line.rstrip(b'\r\n')
+            regex_index = 2
+        else:
+            assert isinstance(line, str)
+            line = line.rstrip('\r\n')
+            regex_index = 1
+        formats = self._formats
+        m = formats[0][regex_index].match(line)
+        if m:
+            return m
+        for n in range(1, len(formats)):
+            m = formats[n][regex_index].match(line)
+            if m:
+                logger.debug('Detected log format: %s', formats[n][0])
+                formats.insert(0, formats.pop(n))
+                return m
+        raise _unrecognized_line_error(line)
+
+
+def parse_log_line(parser, line, error_count=None):
+    '''
+    Parse line (bytes) using given AccessLogParser.
+    Returns AccessLogRecord, or None if the line could not be parsed.
+    If error_count (Counter) is given, failures are counted in it by
+    error class: BogusLogLineError, InvalidLogLineError or other.
+    '''
+    assert isinstance(line, bytes)
+    try:
+        return parser.parse(line)
+    except Exception as e:
+        handle_parse_error(e, error_count)
+    return None
+
+
+def handle_parse_error(e, error_count=None):
+    '''
+    Log exception raised when parsing a line and count it in error_count (Counter)
+    '''
+    if isinstance(e, BogusLogLineError):
+        logger.debug('Failed to parse line: %s', e)
+        error_name = 'BogusLogLineError'
+    elif isinstance(e, InvalidLogLineError):
+        logger.info('Failed to parse line: %s', e)
+        error_name = 'InvalidLogLineError'
+    else:
+        logger.warning('Failed to parse line: %s', e)
+        error_name = 'other'
+    if error_count is not None:
+        error_count[error_name] += 1
+
+
+class _BytesGroupGetter:
+    '''
+    The get function for AccessLogRecord of a bytes line - a match group is
+    decoded only when the field is accessed. It is a class (not a closure)
+    so that the records can be pickled (see worker_pool).
+    '''
+
+    __slots__ = ['groups']
+
+    def __init__(self, groups):
+        self.groups = groups
+
+    def __call__(self, name):
+        value = self.groups.get(name)
+        return None if value is None else value.decode('utf-8', 'replace')
+
+
+def _unrecognized_line_error(line):
+    if isinstance(line, bytes):
+        # only for the error message
+        line = line.decode('utf-8', 'replace')
     if ' 400 ' in line:
         # 400 means even nginx did not understand the request
         if 'Cookie: mstshash=Administr' in line:
-            raise BogusLogLineError('Bogus log line (probably RDP hacking): {!r}'.format(line))
+            return BogusLogLineError('Bogus log line (probably RDP hacking): {!r}'.format(line))
         if re.search(r' "(\\x[0-9a-f][0-9a-f]){3}', line):
-            raise BogusLogLineError('Bogus log line (binary data): {!r}'.format(line))
-    raise InvalidLogLineError('Could not recognize log format: {!r}'.format(line))
+            return BogusLogLineError('Bogus log line (binary data): {!r}'.format(line))
+    return InvalidLogLineError('Could not recognize log format: {!r}'.format(line))
+
+
+def _lazy_field(name, convert):
+    '''
+    Property that calls convert(record) on the first access and stores
+    the result in the slot '_' + name.
+    '''
+    slot = '_' + name
+
+    def fget(self):
+        try:
+            return getattr(self, slot)
+        except AttributeError:
+            value = convert(self)
+            setattr(self, slot, value)
+            return value
+
+    def fset(self, value):
+        setattr(self, slot, value)
+
+    return property(fget, fset)
+
+
+def _date_local(record):
+    return parse_date(record.date_str) if record.date_str else None
+
+
+def _date_utc(record):
+    return parse_date_utc(record.date_str) if record.date_str else None
+
+
+def _pipelined(record):
+    pipe_flag = record._get('pipe_flag')
+    if pipe_flag == 'p':
+        return True
+    elif pipe_flag == '.':
+        return False
+    else:
+        return None
 
 
 class AccessLogRecord:
@@ -129,39 +308,46 @@ class AccessLogRecord:
     # This could be namedtuple, but we want to keep it mutable to make any
     # eventual postprocessing easier.
 
+    # The record only keeps the regex match groups (the get function) and
+    # the fields are converted when accessed for the first time - most
+    # consumers need just a few of them (status, path, host).
+
+    _fields = OrderedDict([
+        ('host', lambda r: r._get('host')),
+        ('remote_addr', lambda r: r._get('remote_addr')),
+        ('remote_user', lambda r: dash_to_none(r._get('remote_user'))),
+        ('date_str', lambda r: r._get('time_local') or None),
+        ('date_local', _date_local),
+        ('date_utc', _date_utc),
+        ('method', lambda r: r._get('method')),
+        ('path', lambda r: r._get('path')),
+        ('protocol', lambda r: r._get('protocol')),
+        ('status', lambda r: _int(r._get('status'))),
+        ('body_bytes_sent', lambda r: _int(r._get('body_bytes_sent'))),
+        ('referer', lambda r: dash_to_none(r._get('referer'))),
+        ('user_agent_str', lambda r: r._get('user_agent')),
+        ('request_time', lambda r: _float(r._get('request_time'))),
+        ('upstream_response_time', lambda r: _float(r._get('upstream_response_time'))),
+        ('upstream_addr', lambda r: dash_to_none(r._get('upstream_addr'))),
+        ('pipelined', _pipelined),
+    ])
+
+    __slots__ = ['_get'] + ['_' + name for name in _fields]
+
     def __init__(self, get):
-        self.host = get('host')
-        self.remote_addr = get('remote_addr')
-        self.remote_user = dash_to_none(get('remote_user'))
-        time_local = get('time_local')
-        if time_local:
-            self.date_str = time_local
-            self.date_local = parse_date(time_local)
-            self.date_utc = date_to_utc(self.date_local)
-        else:
-            self.date_str = None
-            self.date_local = None
-            self.date_utc = None
-        self.method = get('method')
-        self.path = get('path')
-        self.protocol = get('protocol')
-        self.status = _int(get('status'))
-        self.body_bytes_sent = _int(get('body_bytes_sent'))
-        self.referer = dash_to_none(get('referer'))
-        self.user_agent_str = get('user_agent')
-        self.request_time = _float(get('request_time'))
-        self.upstream_response_time = _float(get('upstream_response_time'))
-        pipe_flag = get('pipe_flag')
-        if pipe_flag == 'p':
-            self.pipelined = True
-        elif pipe_flag == '.':
-            self.pipelined = False
-        else:
-            self.pipelined = None
+        self._get = get
 
     def __repr__(self):
         return '<{cls} method={s.method!r} path={s.path!r} status={s.status!r}>'.format(cls=self.__class__.__name__, s=self)
 
+    def as_dict(self):
+        return OrderedDict((name, getattr(self, name)) for name in self._fields)
+
+
+for _name, _convert in AccessLogRecord._fields.items():
+    setattr(AccessLogRecord, _name, _lazy_field(_name, _convert))
+del _name, _convert
+
 
 def _int(v):
     if v is None or v == '-':
@@ -192,19 +378,45 @@ month_name_to_number = {m: n for n, m in enumerate(month_names, start=1)}
 assert len(month_name_to_number) == 12
 
 
+date_cache_size = 256
+
+
+@lru_cache(maxsize=date_cache_size)
 def parse_date(date_str):
+    '''
+    Lines written in the same second share the same $time_local string,
+    so the results are cached.
+    '''
     m = re_time_local.match(date_str)
     if m:
         d, m, y, H, M, S, ts, tH, tM = m.groups()
-        tz_offset = timedelta(hours=int(tH), minutes=int(tM))
-        if ts == '-':
-            tz_offset = - tz_offset
         return datetime(
             int(y), month_name_to_number[m], int(d),
             int(H), int(M), int(S),
-            tzinfo=timezone(tz_offset))
+            tzinfo=_get_timezone(ts, tH, tM))
     raise InvalidLogLineError('Unknown date format: {!r}'.format(date_str))
 
 
+@lru_cache()
+def _get_timezone(sign, hours, minutes):
+    tz_offset = timedelta(hours=int(hours), minutes=int(minutes))
+    if sign == '-':
+        tz_offset = - tz_offset
+    return timezone(tz_offset)
+
+
+@lru_cache(maxsize=date_cache_size)
+def parse_date_utc(date_str):
+    return date_to_utc(parse_date(date_str))
+
+
+@lru_cache(maxsize=date_cache_size)
+def parse_timestamp(date_str):
+    '''
+    Returns POSIX timestamp (float) of $time_local string
+    '''
+    return parse_date(date_str).timestamp()
+
+
 def date_to_utc(dt):
-    return pytz.utc.normalize(dt)
+    return dt.astimezone(timezone.utc)
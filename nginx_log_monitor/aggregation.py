@@ -0,0 +1,229 @@
+'''
+Generic multi-dimensional aggregation of the access log records.
+
+Views are declared in the configuration as lists of dimensions, for example
+`host_status: [host, status_class]`. For every view the number of requests
+and the sum of body_bytes_sent are counted per tuple of dimension values,
+in total and in the last 5 minutes.
+
+All views are updated in a single pass over the records. The number of
+distinct values of every dimension is capped (max_cardinality); values
+over the cap are counted as `<other>`, so the memory stays bounded.
+Which values get their own rows is decided by frequency: while there is
+room, every new value is admitted, and every readmit_interval_s the
+admitted values are replaced by the most frequent values of the last
+interval. Rows of the values that were dropped are folded into `<other>`
+in the totals (the last 5 minutes keep them until they expire), so a
+scan at startup does not push the real values into `<other>` forever.
+'''
+
+from collections import OrderedDict, Counter, defaultdict
+from logging import getLogger
+from sys import intern
+from time import monotonic as monotime
+
+from .path_stats import unify_path
+from .rolling_counter import RollingCounter
+from .space_saving import SpaceSaving
+
+
+logger = getLogger(__name__)
+
+other_value = '<other>'
+
+metric_names = ('requests', 'body_bytes_sent')
+
+
+def _status_class(access_log_record):
+    status = access_log_record.status
+    return '{}xx'.format(status // 100) if status else None
+
+
+def _unified_path(access_log_record):
+    path = access_log_record.path
+    return unify_path(path) if path else None
+
+
+dimension_getters = OrderedDict([
+    ('host', lambda r: r.host),
+    ('method', lambda r: r.method),
+    ('status', lambda r: r.status),
+    ('status_class', _status_class),
+    ('path', _unified_path),
+    ('upstream', lambda r: r.upstream_addr),
+])
+
+default_max_cardinality = {
+    'host': 1000,
+    'method': 50,
+    'status': 100,
+    'status_class': 10,
+    'path': 1000,
+    'upstream': 200,
+}
+
+
+def check_dimensions(dimensions):
+    for dimension in dimensions:
+        if dimension not in dimension_getters:
+            raise ValueError('Unknown aggregation dimension: {!r} (supported: {})'.format(
+                dimension, ', '.join(dimension_getters)))
+
+
+def count_aggregations(access_log_records, views):
+    '''
+    views: list of tuples of dimension names
+    Returns list of Counters (metric, key) -> value, one for every view;
+    metric is "requests" or "body_bytes_sent", key is tuple of dimension values.
+    '''
+    dimensions = sorted(set(d for view in views for d in view))
+    getters = [(d, dimension_getters[d]) for d in dimensions]
+    view_counts = [Counter() for view in views]
+    views_and_counts = list(zip(views, view_counts))
+    for access_log_record in access_log_records:
+        values = {}
+        for dimension, get_value in getters:
+            value = get_value(access_log_record)
+            values[dimension] = '-' if value is None else intern(str(value))
+        body_bytes_sent = access_log_record.body_bytes_sent or 0
+        for view, counts in views_and_counts:
+            key = tuple(values[d] for d in view)
+            counts[('requests', key)] += 1
+            counts[('body_bytes_sent', key)] += body_bytes_sent
+    return view_counts
+
+
+class AggregationStats:
+    '''
+    views: dict view name -> list of dimension names
+    max_cardinality: dict dimension name -> max. number of distinct values
+    '''
+
+    report_top = 20
+    readmit_interval_s = 300
+
+    def __init__(self, views, granularity_s=1, max_cardinality=None, clock=monotime):
+        self.clock = clock
+        for dimensions in views.values():
+            check_dimensions(dimensions)
+        self.view_names = list(views.keys())
+        self.views = [tuple(views[name]) for name in self.view_names]
+        self.max_cardinality = dict(default_max_cardinality)
+        self.max_cardinality.update(max_cardinality or {})
+        self._admitted_values = defaultdict(set) # dimension -> values counted under their own name
+        self._value_counts = {} # dimension -> SpaceSaving value -> requests in the current interval
+        self._readmit_mt = None
+        # the frequency of the values of a dimension is taken from the first view that has it
+        self._frequency_dimensions = [] # for every view: [(index in key, dimension)]
+        for view in self.views:
+            view_dimensions = []
+            for i, dimension in enumerate(view):
+                if dimension not in self._value_counts:
+                    self._value_counts[dimension] = self._new_value_counter(dimension)
+                    view_dimensions.append((i, dimension))
+            self._frequency_dimensions.append(view_dimensions)
+        self.total_counts = [Counter() for view in self.views] # (metric, key) -> value
+        self.rolling_5min = [RollingCounter(window_s=300, granularity_s=granularity_s) for view in self.views]
+
+    def update(self, access_log_record, now=None):
+        self.update_many([access_log_record], now=now)
+
+    def update_many(self, access_log_records, now=None):
+        self.merge(count_aggregations(access_log_records, self.views), now=now)
+
+    def merge(self, view_counts, now=None):
+        '''
+        Add counts pre-aggregated by count_aggregations() (for example in a worker process)
+        '''
+        now = self.clock() if now is None else now
+        if self._readmit_mt is None:
+            self._readmit_mt = now
+        elif now >= self._readmit_mt + self.readmit_interval_s:
+            self._readmit()
+            self._readmit_mt = now
+        for frequency_dimensions, counts in zip(self._frequency_dimensions, view_counts):
+            for i, dimension in frequency_dimensions:
+                value_counts = self._value_counts[dimension]
+                for (metric, key), value in counts.items():
+                    if metric == 'requests':
+                        value_counts[key[i]] += value
+        for view, counts, total_counts, rolling in zip(self.views, view_counts, self.total_counts, self.rolling_5min):
+            capped_counts = Counter()
+            for (metric, key), value in counts.items():
+                capped_counts[(metric, self._cap_key(view, key))] += value
+            total_counts.update(capped_counts)
+            rolling.add_counts(capped_counts, now)
+        self._roll(now)
+
+    def _new_value_counter(self, dimension):
+        # twice the cap, so that the top values are estimated well
+        return SpaceSaving(2 * self.max_cardinality[dimension])
+
+    def _cap_key(self, view, key):
+        capped = None
+        for i, (dimension, value) in enumerate(zip(view, key)):
+            admitted = self._admitted_values[dimension]
+            if value in admitted:
+                continue
+            if len(admitted) < self.max_cardinality[dimension]:
+                admitted.add(value)
+                continue
+            if capped is None:
+                capped = list(key)
+            capped[i] = other_value
+        return key if capped is None else tuple(capped)
+
+    def _readmit(self):
+        '''
+        Admit the most frequent values of the last interval instead of the current ones
+        '''
+        dropped = {}
+        for dimension, value_counts in self._value_counts.items():
+            top = set(value for value, count in value_counts.most_common(self.max_cardinality[dimension]))
+            dropped[dimension] = self._admitted_values[dimension] - top
+            self._admitted_values[dimension] = top
+            self._value_counts[dimension] = self._new_value_counter(dimension)
+        for view, total_counts in zip(self.views, self.total_counts):
+            if not any(dropped[d] for d in view):
+                continue
+            folded = Counter()
+            for (metric, key), value in total_counts.items():
+                key = tuple(other_value if v in dropped[d] else v for d, v in zip(view, key))
+                folded[(metric, key)] += value
+            total_counts.clear()
+            total_counts.update(folded)
+
+    def _roll(self, now):
+        for rolling in self.rolling_5min:
+            rolling.roll(now)
+
+    def get_version(self, now=None):
+        '''
+        Returns number that changes whenever the counts change
+        '''
+        now = self.clock() if now is None else now
+        self._roll(now)
+        return sum(rolling.version for rolling in self.rolling_5min)
+
+    def get_report(self, now=None):
+        now = self.clock() if now is None else now
+        self._roll(now)
+        report = OrderedDict()
+        report['aggregations'] = OrderedDict()
+        for name, view, total_counts, rolling in zip(self.view_names, self.views, self.total_counts, self.rolling_5min):
+            view_report = report['aggregations'][name] = OrderedDict()
+            view_report['dimensions'] = list(view)
+            view_report['total'] = self._top_rows(view, total_counts)
+            view_report['last_5_min'] = self._top_rows(view, rolling.counts)
+        return report
+
+    def _top_rows(self, view, counts):
+        request_counts = [(key, value) for (metric, key), value in counts.items() if metric == 'requests' and value > 0]
+        request_counts.sort(key=lambda item: (-item[1], item[0]))
+        rows = []
+        for key, value in request_counts[:self.report_top]:
+            row = OrderedDict(zip(view, key))
+            row['requests'] = value
+            row['body_bytes_sent'] = counts.get(('body_bytes_sent', key), 0)
+            rows.append(row)
+        return rows
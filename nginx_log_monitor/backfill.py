@@ -0,0 +1,122 @@
+'''
+Backfill mode - process historical (rotated, possibly gzipped) access logs
+as fast as possible and feed them to the same stats as live tailing.
+'''
+
+import gzip
+from logging import getLogger
+import mmap
+from pathlib import Path
+import re
+from time import monotonic as monotime
+
+from .access_log_parser import AccessLogParser, parse_log_line
+from .columnar import parse_batch
+from .file_reader import default_chunk_size
+
+
+logger = getLogger(__name__)
+
+# access.log.1, access.log.2.gz, access.log-20200204, access.log.2020-02-04.gz
+rotation_suffix_regex = re.compile(r'^(\.[0-9]+|[.-][0-9]{8}|[.-][0-9]{4}-[0-9]{2}-[0-9]{2})(\.gz)?$')
+
+
+def find_backfill_paths(path):
+    '''
+    Returns the access log and its rotated versions (access.log.1,
+    access.log.2.gz, access.log-20200204...), oldest first.
+    Other files next to it (access.log.bak...) are ignored.
+    '''
+    path = Path(path)
+    paths = [
+        p for p in path.parent.glob(path.name + '*')
+        if rotation_suffix_regex.match(p.name[len(path.name):]) and p.is_file()]
+    if path.is_file():
+        paths.append(path)
+    return sorted(paths, key=lambda p: (p.stat().st_mtime, p != path))
+
+
+def read_line_batches(path, chunk_size=default_chunk_size):
+    '''
+    Yields lists of lines (without trailing newlines) of the whole file.
+    Plain files are read via mmap, *.gz files are decompressed on the fly.
+    '''
+    path = Path(path)
+    if path.name.endswith('.gz'):
+        with gzip.open(str(path), 'rb') as f:
+            yield from _split_chunks(iter(lambda: f.read(chunk_size), b''))
+    else:
+        with path.open('rb') as f:
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty file cannot be mmaped
+                return
+            with mm:
+                size = len(mm)
+                yield from _split_chunks(mm[pos:pos + chunk_size] for pos in range(0, size, chunk_size))
+
+
+def _split_chunks(chunks):
+    partial = b''
+    for chunk in chunks:
+        lines = chunk.split(b'\n')
+        lines[0] = partial + lines[0]
+        partial = lines.pop()
+        if lines:
+            yield lines
+    if partial:
+        yield [partial]
+
+
+class BackfillResult:
+
+    def __init__(self):
+        self.file_count = 0
+        self.line_count = 0
+        self.record_count = 0
+        self.byte_count = 0
+        self.duration_s = 0
+
+    def __str__(self):
+        duration_s = self.duration_s or 1e-9
+        return (
+            'Processed {s.line_count} lines ({s.record_count} parsed) from {s.file_count} files '
+            'in {s.duration_s:.2f} s: {lps:.0f} lines/s, {mbps:.1f} MB/s').format(
+                s=self, lps=self.line_count / duration_s, mbps=self.byte_count / duration_s / 2**20)
+
+
+def backfill(paths, get_log_format, stats_objs):
+    '''
+    Parse all lines of given files and update stats_objs (StatusStats, PathStats, LatencyStats...)
+    via their update_many(). Returns BackfillResult with the achieved throughput.
+
+    If all stats objects support update_batch(), the lines are parsed into
+    columns (see columnar.parse_batch()) instead of AccessLogRecords.
+    '''
+    columnar = all(hasattr(stats_obj, 'update_batch') for stats_obj in stats_objs)
+    result = BackfillResult()
+    t0 = monotime()
+    for path in paths:
+        logger.info('Backfilling %s', path)
+        parser = AccessLogParser(get_log_format(path))
+        result.file_count += 1
+        for lines in read_line_batches(path):
+            result.byte_count += sum(map(len, lines)) + len(lines)
+            result.line_count += len(lines)
+            if columnar:
+                record_batch = parse_batch(parser, lines)
+                result.record_count += len(record_batch)
+                for stats_obj in stats_objs:
+                    stats_obj.update_batch(record_batch)
+                continue
+            access_log_records = []
+            for line in lines:
+                access_log_record = parse_log_line(parser, line)
+                if access_log_record is not None:
+                    access_log_records.append(access_log_record)
+            result.record_count += len(access_log_records)
+            for stats_obj in stats_objs:
+                stats_obj.update_many(access_log_records)
+    result.duration_s = monotime() - t0
+    return result
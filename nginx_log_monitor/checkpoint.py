@@ -0,0 +1,72 @@
+'''
+Persistent read offsets of the tailed files, so that after restart we can
+continue where we stopped instead of skipping everything written meanwhile.
+'''
+
+import json
+from logging import getLogger
+from pathlib import Path
+from time import monotonic as monotime
+
+from .util.files import write_file_atomic
+
+
+logger = getLogger(__name__)
+
+
+class CheckpointStore:
+    '''
+    Keeps checkpoints - lists of (dev, inode, offset) - per access log path
+    and saves them to a JSON state file.
+
+    The state file is written atomically (temporary file, fsync, rename)
+    and at most once per save_interval_s, so frequent offset updates
+    cost just one fsync per interval.
+    '''
+
+    def __init__(self, state_path, save_interval_s=5):
+        self.state_path = Path(state_path)
+        self.save_interval_s = save_interval_s
+        self._checkpoints = {} # str(path) -> [(dev, inode, offset)]
+        self._last_save_mt = None
+        self._dirty = False
+
+    def load(self):
+        try:
+            state = json.loads(self.state_path.read_text())
+        except FileNotFoundError:
+            logger.debug('Checkpoint file %s does not exist', self.state_path)
+            return
+        except Exception as e:
+            logger.warning('Failed to load checkpoint file %s: %r', self.state_path, e)
+            return
+        for path, items in (state.get('files') or {}).items():
+            self._checkpoints[path] = [(item['dev'], item['inode'], item['offset']) for item in items]
+        logger.debug('Loaded checkpoints: %r', self._checkpoints)
+
+    def get(self, path):
+        return self._checkpoints.get(str(path)) or []
+
+    def update(self, path, checkpoints):
+        checkpoints = list(checkpoints)
+        if self._checkpoints.get(str(path)) != checkpoints:
+            self._checkpoints[str(path)] = checkpoints
+            self._dirty = True
+
+    def save_due(self):
+        return self._last_save_mt is None or monotime() - self._last_save_mt >= self.save_interval_s
+
+    def save(self):
+        self._last_save_mt = monotime()
+        if not self._dirty:
+            return
+        state = {
+            'files': {
+                path: [{'dev': dev, 'inode': inode, 'offset': offset} for dev, inode, offset in items]
+                for path, items in self._checkpoints.items()
+            },
+        }
+        write_file_atomic(self.state_path, json.dumps(state).encode())
+        self._dirty = False
+        logger.debug('Saved checkpoints to %s', self.state_path)
+
@@ -1,4 +1,6 @@
 from aiohttp import ClientSession
+import gzip
+import json
 from logging import getLogger
 from reprlib import repr as smart_repr
 
@@ -16,27 +18,47 @@ class OverwatchClientReportError (Exception):
     pass
 
 
+def encode_report(report_data, compress=False):
+    '''
+    Returns request body - JSON, gzip-compressed if compress is true
+    '''
+    assert isinstance(report_data, dict)
+    body = json.dumps(report_data, separators=(',', ':')).encode()
+    if compress:
+        body = gzip.compress(body, compresslevel=6)
+    return body
+
+
 class OverwatchClient:
 
-    def __init__(self, client_session, report_url, report_token):
+    def __init__(self, client_session, report_url, report_token, compress=False):
         self._session = client_session
         self._report_url = report_url
         self._report_token = report_token
+        self.compress = compress
 
     async def send_report(self, report_data):
         assert isinstance(report_data, dict)
+        logger.debug('Sending Overwatch report with payload: %s', smart_repr(report_data))
+        await self.send_encoded_report(encode_report(report_data, compress=self.compress), compressed=self.compress)
+
+    async def send_encoded_report(self, body, compressed=False):
+        '''
+        Send report already encoded by encode_report()
+        '''
         if not self._report_url:
             raise OverwatchClientNotConfiguredError('No report_url')
         if self._session is None:
             raise Exception('Not in context block')
-        post_kwargs = dict(
-            json=report_data,
-            headers={
-                'Accept': 'application/json',
-                'Authorization': 'token ' + self._report_token,
-            },
-            timeout=post_timeout_s)
-        logger.debug('Sending Overwatch report - POST %s with payload: %s', self._report_url, smart_repr(report_data))
+        headers = {
+            'Accept': 'application/json',
+            'Authorization': 'token ' + self._report_token,
+            'Content-Type': 'application/json',
+        }
+        if compressed:
+            headers['Content-Encoding'] = 'gzip'
+        post_kwargs = dict(data=body, headers=headers, timeout=post_timeout_s)
+        logger.debug('Sending Overwatch report - POST %s (%d bytes)', self._report_url, len(body))
         try:
             async with self._session.post(self._report_url, **post_kwargs) as resp:
                 logger.debug('Response: %r', resp)
@@ -1,3 +1,5 @@
+from asyncio import get_event_loop, wait_for, TimeoutError
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
 
 try:
@@ -8,11 +10,18 @@ except ImportError:
 
 logger = getLogger(__name__)
 
+close_timeout_s = 5
+
 
 class SentryClient:
+    '''
+    sentry_sdk sends the events synchronously, so they are captured
+    in a worker thread to not block the event loop.
+    '''
 
     def __init__(self):
         self._clients_by_dsn = {}
+        self._executor = ThreadPoolExecutor(max_workers=1)
 
     def _get_client(self, dsn):
         client = self._clients_by_dsn.get(dsn)
@@ -24,11 +33,30 @@ class SentryClient:
             self._clients_by_dsn[dsn] = client
         return client
 
+    async def close(self):
+        clients = list(self._clients_by_dsn.values())
+        self._clients_by_dsn = {}
+        try:
+            # closing the clients flushes the pending events, so it is done
+            # in the worker thread too, after the events being captured
+            await wait_for(
+                get_event_loop().run_in_executor(self._executor, _close_clients, clients),
+                close_timeout_s)
+        except TimeoutError:
+            logger.warning('Timeout closing Sentry clients')
+        finally:
+            self._executor.shutdown(wait=False)
+
     async def report(self, dsn, event):
         client = self._get_client(dsn)
         if client:
-            event_id = client.capture_event(event)
+            event_id = await get_event_loop().run_in_executor(self._executor, client.capture_event, event)
             if event_id:
                 logger.info('Sentry event id: %s', event_id)
             else:
                 logger.warning('Event discarded')
+
+
+def _close_clients(clients):
+    for client in clients:
+        client.close()
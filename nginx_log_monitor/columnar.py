@@ -0,0 +1,187 @@
+'''
+Columnar batch parsing.
+
+A chunk of lines is parsed directly into compact columns (array module)
+instead of an AccessLogRecord per line, and the stats are updated from
+whole columns at once (see update_batch() of StatusStats, PathStats and
+LatencyStats). The counting uses NumPy if it is installed.
+'''
+
+from array import array
+from collections import Counter
+from logging import getLogger
+from math import isnan
+from sys import intern
+
+from .access_log_parser import handle_parse_error
+from .latency_stats import latency_bucket, latency_metrics
+from .path_stats import unify_path
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+logger = getLogger(__name__)
+
+column_groups = ('status', 'host', 'path', 'body_bytes_sent', 'request_time', 'upstream_response_time')
+
+nan = float('nan')
+
+
+class RecordBatch:
+    '''
+    Parsed lines as columns; every index is one successfully parsed line.
+    '''
+
+    def __init__(self):
+        self.status = array('H')
+        self.path_ids = array('I') # index to self.paths
+        self.body_bytes_sent = array('Q')
+        self.request_time = array('d') # NaN if missing
+        self.upstream_response_time = array('d') # NaN if missing
+        self.paths = [] # [(host, path)]
+        self.path_index = {} # (host, path) as bytes -> index to self.paths
+        self._unified_paths = None
+
+    def __len__(self):
+        return len(self.status)
+
+    # the stats objects call these in their update_batch()
+
+    def count_statuses(self):
+        return count_statuses_columnar(self)
+
+    def count_path_statuses(self):
+        return count_path_statuses_columnar(self)
+
+    def count_latencies(self):
+        return count_latencies_columnar(self)
+
+    def get_unified_paths(self):
+        '''
+        Returns list of unified paths prefixed with host (see get_record_path()),
+        indexed by path id
+        '''
+        if self._unified_paths is None:
+            self._unified_paths = [(host or '') + unify_path(path) for host, path in self.paths]
+        return self._unified_paths
+
+
+def _to_float(value):
+    if value is None or value == b'-':
+        return nan
+    return float(value)
+
+
+_column_indexes_cache = {} # regex -> indexes of column_groups in match.groups()
+
+
+def _get_column_indexes(regex):
+    indexes = _column_indexes_cache.get(regex)
+    if indexes is None:
+        # missing group -> -1, which points to the None appended to groups
+        indexes = _column_indexes_cache[regex] = tuple(regex.groupindex.get(name, 0) - 1 for name in column_groups)
+    return indexes
+
+
+def parse_batch(parser, lines, error_count=None):
+    '''
+    Parse lines (bytes, without newlines) using AccessLogParser into RecordBatch.
+    Failures are logged and counted in error_count (see handle_parse_error()).
+    Only host and path are decoded, once per distinct value.
+    '''
+    batch = RecordBatch()
+    status_append = batch.status.append
+    path_id_append = batch.path_ids.append
+    body_bytes_sent_append = batch.body_bytes_sent.append
+    request_time_append = batch.request_time.append
+    upstream_response_time_append = batch.upstream_response_time.append
+    path_index = batch.path_index
+    paths = batch.paths
+    match = parser.match
+    for line in lines:
+        try:
+            m = match(line)
+            status_i, host_i, path_i, body_bytes_sent_i, request_time_i, upstream_response_time_i = _get_column_indexes(m.re)
+            groups = m.groups() + (None, )
+            status = int(groups[status_i])
+            path_key = (groups[host_i], groups[path_i])
+            body_bytes_sent = int(groups[body_bytes_sent_i] or 0)
+            request_time = _to_float(groups[request_time_i])
+            upstream_response_time = _to_float(groups[upstream_response_time_i])
+        except Exception as e:
+            handle_parse_error(e, error_count)
+            continue
+        path_id = path_index.get(path_key)
+        if path_id is None:
+            path_id = path_index[path_key] = len(paths)
+            paths.append(tuple(None if s is None else s.decode('utf-8', 'replace') for s in path_key))
+        status_append(status)
+        path_id_append(path_id)
+        body_bytes_sent_append(body_bytes_sent)
+        request_time_append(request_time)
+        upstream_response_time_append(upstream_response_time)
+    return batch
+
+
+_status_strings = {} # status int -> interned str
+
+
+def _status_str(status):
+    s = _status_strings.get(status)
+    if s is None:
+        s = _status_strings[status] = intern(str(status))
+    return s
+
+
+def count_statuses_columnar(batch):
+    '''
+    Same result as count_statuses() of the records in the batch
+    '''
+    if numpy is not None and len(batch):
+        counts = numpy.bincount(numpy.frombuffer(batch.status, dtype=numpy.uint16))
+        return Counter({_status_str(int(status)): int(counts[status]) for status in numpy.flatnonzero(counts)})
+    return Counter({_status_str(status): count for status, count in Counter(batch.status).items()})
+
+
+def count_path_statuses_columnar(batch):
+    '''
+    Same result as count_path_statuses() of the records in the batch
+    '''
+    unified_paths = batch.get_unified_paths()
+    path_status_count = {}
+    if numpy is not None and len(batch):
+        path_count = len(batch.paths)
+        keys = numpy.frombuffer(batch.status, dtype=numpy.uint16).astype(numpy.int64) * path_count
+        keys += numpy.frombuffer(batch.path_ids, dtype=numpy.uint32)
+        unique_keys, counts = numpy.unique(keys, return_counts=True)
+        pairs = ((divmod(int(key), path_count), int(count)) for key, count in zip(unique_keys, counts))
+    else:
+        pairs = Counter(zip(batch.status, batch.path_ids)).items()
+    for (status, path_id), count in pairs:
+        status = _status_str(status)
+        counter = path_status_count.get(status)
+        if counter is None:
+            counter = path_status_count[status] = Counter()
+        # different raw paths can have the same unified path
+        counter[unified_paths[path_id]] += count
+    return path_status_count
+
+
+def count_latencies_columnar(batch):
+    '''
+    Same result as count_latencies() of the records in the batch
+    '''
+    unified_paths = batch.get_unified_paths()
+    latency_count = Counter()
+    for metric in latency_metrics:
+        column = getattr(batch, metric)
+        bucket_path_count = Counter(
+            (latency_bucket(value), path_id)
+            for value, path_id in zip(column, batch.path_ids) if not isnan(value))
+        for (bucket, path_id), count in bucket_path_count.items():
+            latency_count[(metric, None, bucket)] += count
+            latency_count[(metric, unified_paths[path_id], bucket)] += count
+    return latency_count
@@ -1,8 +1,13 @@
+from collections import OrderedDict
+from fnmatch import fnmatch
 from logging import getLogger
 from glob import glob
 from pathlib import Path
 import yaml
 
+from .access_log_parser import log_format_to_regex
+from .aggregation import check_dimensions
+
 
 logger = getLogger(__name__)
 
@@ -16,8 +21,31 @@ class Configuration:
         else:
             cfg = {}
         self.access_log_paths = []
-        if cfg.get('access_logs'):
-            self.access_log_paths.extend(cfg['access_logs'])
+        self.access_log_formats = {} # path (glob pattern) -> nginx log_format
+        self.log_format = cfg.get('log_format')
+        if self.log_format:
+            log_format_to_regex(self.log_format) # check that the format is supported
+        for item in cfg.get('access_logs') or []:
+            if isinstance(item, dict):
+                self.access_log_paths.append(item['path'])
+                if item.get('log_format'):
+                    log_format_to_regex(item['log_format'])
+                    self.access_log_formats[item['path']] = item['log_format']
+            else:
+                self.access_log_paths.append(item)
+        # number of worker processes for parsing; 0 means parse in the main process
+        self.workers = int(cfg.get('workers') or 0)
+        self.stats = Stats(cfg.get('stats') or {})
+        # view name -> list of dimensions (see aggregation.dimension_getters)
+        self.aggregations = OrderedDict()
+        for name, dimensions in (cfg.get('aggregations') or {}).items():
+            check_dimensions(dimensions)
+            self.aggregations[name] = list(dimensions)
+        # dimension -> max. number of distinct values
+        self.aggregation_max_cardinality = {k: int(v) for k, v in (cfg.get('aggregation_max_cardinality') or {}).items()}
+        check_dimensions(self.aggregation_max_cardinality.keys())
+        self.checkpoint = Checkpoint(cfg.get('checkpoint') or {})
+        self.metrics = Metrics(cfg.get('metrics') or {})
         self.overwatch = Overwatch(cfg.get('overwatch') or {})
         self.sentry = Sentry(cfg.get('sentry') or {})
 
@@ -29,10 +57,72 @@ class Configuration:
             paths.extend(Path(p) for p in glob(str(x)))
         return paths
 
+    def get_log_format(self, path):
+        '''
+        Returns nginx log_format configured for given access log path,
+        or None if the format should be auto-detected.
+        '''
+        for pattern, log_format in self.access_log_formats.items():
+            if fnmatch(str(path), str(pattern)):
+                return log_format
+        return self.log_format
+
+
+class Stats:
+
+    default_rolling_granularity_s = 1
+    default_windows_s = [60, 300, 900, 3600]
+    default_rate_time_constants_s = [60, 300, 900]
+    default_allowed_lateness_s = 5
+
+    def __init__(self, cfg):
+        # the rolling windows are counted in buckets of this length
+        self.rolling_granularity_s = float(cfg.get('rolling_granularity_s') or self.default_rolling_granularity_s)
+        # windows of the status counts (the last 5 minutes are always counted)
+        self.windows_s = [float(w) for w in cfg.get('windows_s') or self.default_windows_s]
+        # time constants of the exponentially weighted request rates
+        self.rate_time_constants_s = [float(t) for t in cfg.get('rate_time_constants_s') or self.default_rate_time_constants_s]
+        # drive the rolling windows by $time_local instead of by the processing time (see event_time)
+        self.event_time = bool(cfg.get('event_time', False))
+        self.allowed_lateness_s = float(cfg.get('allowed_lateness_s') or self.default_allowed_lateness_s)
+        # above this many records per second the path stats are computed from a sample
+        self.path_sampling_threshold_per_s = int(cfg.get('path_sampling_threshold_per_s') or 0) or None
+
+
+class Checkpoint:
+
+    default_save_interval_s = 5
+    default_max_backlog_bytes = 100 * 2**20
+
+    def __init__(self, cfg):
+        self.state_path = cfg.get('state_path')
+        self.enabled = bool(self.state_path) and cfg.get('enabled', True)
+        self.save_interval_s = float(cfg.get('save_interval_s') or self.default_save_interval_s)
+        # how much of the log written while we were not running will be processed
+        self.max_backlog_bytes = int(cfg.get('max_backlog_bytes') or self.default_max_backlog_bytes)
+
+
+class Metrics:
+    '''
+    Prometheus /metrics HTTP endpoint
+    '''
+
+    default_listen_host = '127.0.0.1'
+    default_top_paths = 100
+
+    def __init__(self, cfg):
+        self.listen_host = cfg.get('listen_host') or self.default_listen_host
+        self.listen_port = int(cfg['listen_port']) if cfg.get('listen_port') else None
+        self.enabled = bool(self.listen_port) and cfg.get('enabled', True)
+        # how many most frequent paths per status are exported
+        self.top_paths = int(cfg.get('top_paths') or self.default_top_paths)
+
 
 class Overwatch:
 
     default_report_interval_s = 30
+    default_max_backoff_s = 600
+    default_max_spool_bytes = 10 * 2**20
 
     def __init__(self, cfg):
         self.report_url = None
@@ -43,10 +133,31 @@ class Overwatch:
             self.report_token = cfg['report_token']
             self.enabled = cfg.get('enabled', True)
         self.report_interval_s = float(cfg.get('report_interval_s') or self.default_report_interval_s)
+        # failed reports are retried after report_interval_s, 2 * report_interval_s, ... up to max_backoff_s
+        self.max_backoff_s = float(cfg.get('max_backoff_s') or self.default_max_backoff_s)
+        # gzip the reports (Content-Encoding: gzip) - only if the Overwatch server accepts it
+        self.compress = bool(cfg.get('compress', False))
+        # unsent report is saved here, so that it is not lost on restart
+        self.spool_path = cfg.get('spool_path')
+        self.max_spool_bytes = int(cfg.get('max_spool_bytes') or self.default_max_spool_bytes)
 
 
 class Sentry:
 
+    default_aggregate_window_s = 10
+    default_max_samples = 5
+    default_max_aggregates = 100
+    default_rate_limit_per_minute = 10
+    default_rate_limit_burst = 10
+
     def __init__(self, cfg):
         self.dsn = cfg.get('dsn')
         self.enabled = bool(self.dsn) and cfg.get('enabled', True)
+        # server errors are aggregated by (status, host, path) over this interval
+        self.aggregate_window_s = float(cfg.get('aggregate_window_s') or self.default_aggregate_window_s)
+        self.max_samples = int(cfg.get('max_samples') or self.default_max_samples)
+        # more distinct (status, host, path) per interval are counted together as <other> path
+        self.max_aggregates = int(cfg.get('max_aggregates') or self.default_max_aggregates)
+        # token bucket - at most rate_limit_burst events at once, rate_limit_per_minute on average
+        self.rate_limit_per_minute = float(cfg.get('rate_limit_per_minute') or self.default_rate_limit_per_minute)
+        self.rate_limit_burst = int(cfg.get('rate_limit_burst') or self.default_rate_limit_burst)
@@ -0,0 +1,111 @@
+'''
+Event-time windowing - the rolling windows of the stats are driven by the
+$time_local of the access log records instead of by the time the records
+happen to be processed.
+
+Records are buffered until the watermark (the newest event time seen minus
+allowed_lateness_s) passes their timestamp and then they are fed to the
+stats in the order of their timestamps, with now=timestamp. Records that
+come later than that (or have no timestamp) are counted at the watermark,
+so the totals are the same as in processing-time mode.
+
+The stats objects are created with clock=EventTimeWindowing.get_watermark,
+so the reports are computed at the watermark too. When tailing and no
+lines have come for allowed_lateness_s, the watermark follows the wall
+clock, so that the windows roll even without traffic - but not during a
+catch-up after a stall. A backfill does not follow the wall clock and ends
+with flush(), so it produces the same numbers as live tailing did.
+'''
+
+from collections import defaultdict
+from logging import getLogger
+from time import time
+
+from .access_log_parser import parse_timestamp
+
+
+logger = getLogger(__name__)
+
+
+class EventTimeWindowing:
+    '''
+    Has update_many() like the stats objects, so it can be used in their
+    place - it forwards the records to self.stats_objs.
+    '''
+
+    def __init__(self, allowed_lateness_s=5, follow_wall_clock=True, stats_objs=()):
+        self.allowed_lateness_s = allowed_lateness_s
+        self.follow_wall_clock = follow_wall_clock
+        self.stats_objs = list(stats_objs)
+        self.max_event_ts = None
+        self.watermark = None # all records up to this event time have been fed to the stats
+        self.late_count = 0 # records that came after the watermark passed them
+        self.untimed_count = 0 # records without (valid) $time_local
+        self._pending = defaultdict(list) # timestamp -> [AccessLogRecord]
+        self._last_input_time = None # wall clock time of the last update_many()
+
+    def update_many(self, access_log_records):
+        if self.follow_wall_clock:
+            self._last_input_time = time()
+        pending = self._pending
+        max_event_ts = self.max_event_ts
+        watermark = self.watermark
+        late = []
+        for access_log_record in access_log_records:
+            try:
+                ts = parse_timestamp(access_log_record.date_str)
+            except Exception:
+                self.untimed_count += 1
+                late.append(access_log_record)
+                continue
+            if watermark is not None and ts <= watermark:
+                self.late_count += 1
+                late.append(access_log_record)
+                continue
+            pending[ts].append(access_log_record)
+            if max_event_ts is None or ts > max_event_ts:
+                max_event_ts = ts
+        self.max_event_ts = max_event_ts
+        self._release(late)
+
+    def get_watermark(self):
+        '''
+        Moves the watermark, feeds the records it has passed to the stats
+        and returns it - this is the clock of the stats objects.
+        '''
+        self._release()
+        return 0 if self.watermark is None else self.watermark
+
+    def flush(self):
+        '''
+        Feed all buffered records to the stats (at the end of a backfill)
+        '''
+        if self.max_event_ts is not None:
+            self.watermark = max(self.watermark or self.max_event_ts, self.max_event_ts)
+        self._release()
+
+    def _release(self, late=()):
+        newest = self.max_event_ts
+        if self.follow_wall_clock:
+            now = time()
+            if self._last_input_time is None or now - self._last_input_time > self.allowed_lateness_s:
+                # idle - nothing older than allowed_lateness_s should come anymore
+                newest = now if newest is None else max(newest, now)
+        if newest is not None:
+            candidate = newest - self.allowed_lateness_s
+            if self.watermark is None or candidate > self.watermark:
+                self.watermark = candidate
+        pending = self._pending
+        if pending and self.watermark is not None:
+            for ts in sorted(ts for ts in pending if ts <= self.watermark):
+                self._update_stats(pending.pop(ts), ts)
+        if late:
+            now = self.watermark
+            if now is None:
+                # nothing with a timestamp has come yet
+                now = self.watermark = 0
+            self._update_stats(late, now)
+
+    def _update_stats(self, access_log_records, now):
+        for stats_obj in self.stats_objs:
+            stats_obj.update_many(access_log_records, now=now)
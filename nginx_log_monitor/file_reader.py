@@ -3,20 +3,41 @@ from collections import namedtuple
 from contextlib import ExitStack
 from inspect import iscoroutinefunction
 from logging import getLogger
-from os import stat, SEEK_END
+from os import stat, SEEK_END, SEEK_SET
 from pathlib import Path
 from time import monotonic as monotime
 
+from .file_watcher import create_watcher
+
 
 logger = getLogger(__name__)
 
 
 LogLine = namedtuple('LogLine', 'file line')
 
+default_chunk_size = 256 * 1024
+
+
+async def tail_files(get_paths, process_line=None, sleep_interval=1, process_lines=None,
+                     chunk_size=default_chunk_size, use_inotify=True, inotify_timeout=30,
+                     checkpoint_store=None, max_backlog_bytes=None, monitor_stats=None):
+    '''
+    Either process_line(path, line) is called for every line, or - if
+    process_lines is given - process_lines(path, lines) is called with
+    batches of lines read in chunks (see FileReader.read_line_batches()).
 
-async def tail_files(get_paths, process_line, sleep_interval=1):
+    If inotify is available, files are read as soon as they are modified;
+    all files are checked at least every inotify_timeout seconds anyway.
+    Without inotify the files are polled every sleep_interval seconds.
+
+    If checkpoint_store (CheckpointStore) is given, reading continues from
+    the saved offsets and the offsets are saved periodically.
+
+    If monitor_stats (MonitorStats) is given, it reports the backlog of the open files.
+    '''
     assert callable(get_paths), 'get_paths must be function'
-    assert iscoroutinefunction(process_line), 'process_line must be coroutine function'
+    assert (process_line is None) != (process_lines is None), 'pass either process_line or process_lines'
+    assert iscoroutinefunction(process_line or process_lines), 'process_line(s) must be coroutine function'
     open_files = {} # path -> FileReader
     with ExitStack() as stack:
         paths = get_paths()
@@ -24,17 +45,56 @@ async def tail_files(get_paths, process_line, sleep_interval=1):
         for p in paths:
             logger.debug('Opening %s', p)
             try:
-                open_files[p] = stack.enter_context(FileReader(p))
+                open_files[p] = stack.enter_context(FileReader(
+                    p,
+                    checkpoints=checkpoint_store.get(p) if checkpoint_store else None,
+                    max_backlog_bytes=max_backlog_bytes))
             except Exception as e:
                 logger.warning('Failed to open file %s: %r', p, e)
         if not open_files:
             raise Exception('No file opened')
+        if checkpoint_store:
+            stack.callback(_save_checkpoints, checkpoint_store, open_files)
+        if monitor_stats:
+            monitor_stats.watch_files(open_files)
+            stack.callback(monitor_stats.watch_files, {})
+        watcher = create_watcher(open_files.keys()) if use_inotify else None
+        if watcher:
+            stack.enter_context(watcher)
+        changed = None # path -> rotated; None means check all files
         while True:
             for p, fr in open_files.items():
-                for line in fr.read_lines():
-                    logger.debug('Line: %r', line)
-                    await process_line(p, line)
-            await sleep(sleep_interval)
+                if changed is None:
+                    check_rotation = True
+                elif p in changed:
+                    check_rotation = changed[p]
+                else:
+                    continue
+                if process_lines is not None:
+                    for lines in fr.read_line_batches(chunk_size=chunk_size, check_rotation=check_rotation):
+                        logger.debug('Read %d lines from %s', len(lines), p)
+                        await process_lines(p, lines)
+                else:
+                    for line in fr.read_lines(check_rotation=check_rotation):
+                        logger.debug('Line: %r', line)
+                        await process_line(p, line)
+            if checkpoint_store and checkpoint_store.save_due():
+                _save_checkpoints(checkpoint_store, open_files)
+            if watcher:
+                changed = await watcher.wait(timeout=inotify_timeout)
+            else:
+                await sleep(sleep_interval)
+
+
+def _save_checkpoints(checkpoint_store, open_files):
+    try:
+        for p, fr in open_files.items():
+            checkpoints = fr.get_checkpoints()
+            if checkpoints:
+                checkpoint_store.update(p, checkpoints)
+        checkpoint_store.save()
+    except Exception as e:
+        logger.exception('Failed to save checkpoints: %r', e)
 
 
 def _close_file(f):
@@ -47,15 +107,42 @@ def _close_file(f):
         logger.exception('Failed to close file %r: %r', f, e)
 
 
+def _find_line_start(f, position, size, chunk_size=4096):
+    '''
+    Returns position of the first line that starts at or after position
+    (size if there is none)
+    '''
+    f.seek(position - 1, SEEK_SET)
+    while position < size:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        n = chunk.find(b'\n')
+        if n != -1:
+            return position + n
+        position += len(chunk)
+    return size
+
+
 class FileReader:
 
     expire_interval_s = 60
 
-    def __init__(self, path):
+    default_max_backlog_bytes = 100 * 2**20
+
+    def __init__(self, path, checkpoints=None, max_backlog_bytes=None):
+        '''
+        checkpoints: [(dev, inode, offset)] from get_checkpoints() of previous run;
+        if any of them matches the file (or a rotated file next to it), reading
+        continues from the offset, but at most max_backlog_bytes from the end.
+        '''
         self._path = Path(path)
         self._current_file = None
         self._current_dev_inode = None
         self._rotated_files = [] # [( file, expire_monotime )]
+        self._partial_lines = {} # fileno -> incomplete last line (used by read_line_batches)
+        self._checkpoints = checkpoints
+        self._max_backlog_bytes = self.default_max_backlog_bytes if max_backlog_bytes is None else max_backlog_bytes
 
     def __enter__(self):
         return self
@@ -68,9 +155,11 @@ class FileReader:
             _close_file(f.close())
         self._rotated_files = None
 
-    def read_lines(self):
-        # check if current file is rotated
-        if self._current_file is not None and self._looks_rotated():
+    def read_lines(self, check_rotation=True):
+        if self._current_file is None:
+            self._open_first()
+        elif check_rotation and self._looks_rotated():
+            # current file is rotated
             self._open()
             assert self._current_file
 
@@ -93,8 +182,6 @@ class FileReader:
         self._rotated_files = new_rotated_files
 
         # read from current file
-        if self._current_file is None:
-            self._open(seek_end=True)
         f = self._current_file
         while True:
             line = f.readline()
@@ -103,8 +190,138 @@ class FileReader:
                 break
             yield line
 
+    def read_line_batches(self, chunk_size=default_chunk_size, check_rotation=True):
+        '''
+        Like read_lines(), but reads the files in big chunks and yields lists
+        of lines. The lines do not contain the trailing newline. Incomplete
+        last line is kept until the rest of it is written to the file.
+        '''
+        if self._current_file is None:
+            self._open_first()
+        elif check_rotation and self._looks_rotated():
+            # current file is rotated
+            self._open()
+            assert self._current_file
+
+        # read from rotated files, if there is anything new
+        new_rotated_files = []
+        for f, expire_mt in self._rotated_files:
+            for lines in self._read_chunks(f, chunk_size):
+                yield lines
+                expire_mt = monotime() + self.expire_interval_s
+            if expire_mt > monotime():
+                new_rotated_files.append((f, expire_mt))
+            else:
+                partial = self._partial_lines.pop(f.fileno(), None)
+                if partial:
+                    # nothing will be appended to this line anymore
+                    yield [partial]
+                logger.debug('Closing file %s', f.fileno())
+                f.close()
+            del f
+        self._rotated_files = new_rotated_files
+
+        # read from current file
+        yield from self._read_chunks(self._current_file, chunk_size)
+
+    def _read_chunks(self, f, chunk_size):
+        fileno = f.fileno()
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            logger.debug('Read %d bytes from file %s', len(chunk), fileno)
+            lines = chunk.split(b'\n')
+            partial = self._partial_lines.pop(fileno, None)
+            if partial:
+                lines[0] = partial + lines[0]
+            if lines[-1]:
+                self._partial_lines[fileno] = lines[-1]
+            del lines[-1]
+            if lines:
+                yield lines
+
+    def get_checkpoints(self):
+        '''
+        Returns [(dev, inode, offset)] of the current and rotated files,
+        offset pointing after the last complete line read.
+        '''
+        checkpoints = []
+        files = [f for f, expire_mt in self._rotated_files]
+        if self._current_file is not None:
+            files.append(self._current_file)
+        for f in files:
+            st = stat(f.fileno())
+            offset = f.tell() - len(self._partial_lines.get(f.fileno(), b''))
+            checkpoints.append((st.st_dev, st.st_ino, offset))
+        return checkpoints
+
+    def get_backlog_bytes(self):
+        '''
+        Returns number of bytes written to the current and rotated files
+        that have not been read yet.
+        '''
+        backlog = 0
+        files = [f for f, expire_mt in self._rotated_files]
+        if self._current_file is not None:
+            files.append(self._current_file)
+        for f in files:
+            backlog += max(0, stat(f.fileno()).st_size - f.tell())
+        return backlog
+
+    def _open_first(self):
+        self._open(seek_end=True)
+        checkpoints, self._checkpoints = self._checkpoints, None
+        if self._current_file is None or not checkpoints:
+            return
+        backlog_bytes = self._max_backlog_bytes
+        # the current file has priority, it contains the newest lines
+        for dev, inode, offset in sorted(checkpoints, key=lambda c: (c[0], c[1]) != self._current_dev_inode):
+            if (dev, inode) == self._current_dev_inode:
+                f = self._current_file
+            else:
+                rotated_path = self._find_rotated_file(dev, inode)
+                if rotated_path is None:
+                    continue
+                f = rotated_path.open(mode='rb')
+                self._rotated_files.append((f, monotime() + self.expire_interval_s))
+            size = stat(f.fileno()).st_size
+            if offset > size:
+                # the file was truncated
+                logger.info('Checkpoint offset %s is after the end of file %s', offset, f.name)
+                continue
+            position = max(offset, size - backlog_bytes)
+            if position > offset:
+                # do not start reading in the middle of a line
+                position = _find_line_start(f, position, size)
+                logger.warning('Skipping %s bytes of backlog in %s', position - offset, f.name)
+            f.seek(position, SEEK_SET)
+            backlog_bytes -= size - position
+            logger.debug('Resuming file %s from checkpoint, position %s', f.name, position)
+
+    def _find_rotated_file(self, dev, inode):
+        try:
+            candidates = [p for p in self._path.parent.iterdir() if p.name.startswith(self._path.name + '.')]
+        except OSError as e:
+            logger.debug('Cannot list %s: %r', self._path.parent, e)
+            return None
+        for p in sorted(candidates):
+            if p.name.endswith('.gz'):
+                continue
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            if (st.st_dev, st.st_ino) == (dev, inode):
+                return p
+        return None
+
     def _looks_rotated(self):
-        st = self._path.stat()
+        try:
+            st = self._path.stat()
+        except FileNotFoundError:
+            # the file was moved away, but the new one was not created yet
+            return False
         return (st.st_dev, st.st_ino) != self._current_dev_inode
 
     def _open(self, seek_end=False):
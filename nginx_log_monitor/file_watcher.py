@@ -0,0 +1,192 @@
+'''
+Linux inotify support for tail_files(), implemented via ctypes so that there
+is no extra dependency. When inotify is not available (not Linux, libc not
+found...) create_watcher() returns None and tail_files() falls back to polling.
+'''
+
+from asyncio import get_event_loop, wait_for, TimeoutError
+import ctypes
+import ctypes.util
+from logging import getLogger
+import os
+from pathlib import Path
+import struct
+import sys
+
+
+logger = getLogger(__name__)
+
+
+IN_MODIFY = 0x00000002
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+file_watch_mask = IN_MODIFY | IN_MOVE_SELF | IN_DELETE_SELF
+dir_watch_mask = IN_CREATE | IN_MOVED_TO
+
+event_header = struct.Struct('iIII') # wd, mask, cookie, len
+
+
+class InotifyNotAvailableError (Exception):
+    pass
+
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        if not sys.platform.startswith('linux'):
+            raise InotifyNotAvailableError('inotify is available only on Linux')
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            libc.inotify_init1.argtypes = [ctypes.c_int]
+            libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        except (OSError, AttributeError) as e:
+            raise InotifyNotAvailableError('Failed to load inotify functions from libc: {!r}'.format(e))
+        _libc = libc
+    return _libc
+
+
+def create_watcher(paths):
+    '''
+    Returns InotifyWatcher, or None if inotify is not available.
+    '''
+    try:
+        return InotifyWatcher(paths)
+    except InotifyNotAvailableError as e:
+        logger.info('Using polling instead of inotify: %s', e)
+        return None
+
+
+class InotifyWatcher:
+    '''
+    Watches given files for modification and rotation.
+
+    Every file is watched for IN_MODIFY and IN_MOVE_SELF (the watch follows
+    the inode, so also the rotated file is still watched), and the parent
+    directory is watched for IN_CREATE, so we notice the new file after rotation.
+    '''
+
+    def __init__(self, paths):
+        self._libc = _get_libc()
+        fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise InotifyNotAvailableError('inotify_init1 failed: {}'.format(os.strerror(ctypes.get_errno())))
+        self._fd = fd
+        self._file_wds = {} # wd -> path
+        self._dir_wds = {} # wd -> {file name: path}
+        self._changed = {} # path -> rotated (bool)
+        self._overflow = False
+        self._waiter = None
+        self._reader_loop = None
+        for p in paths:
+            self._watch_file(Path(p))
+            self._watch_dir(Path(p))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._fd is None:
+            return
+        if self._reader_loop is not None:
+            self._reader_loop.remove_reader(self._fd)
+            self._reader_loop = None
+        os.close(self._fd)
+        self._fd = None
+
+    def _add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(str(path)), mask)
+        if wd < 0:
+            logger.debug('inotify_add_watch %s failed: %s', path, os.strerror(ctypes.get_errno()))
+            return None
+        return wd
+
+    def _watch_file(self, path):
+        wd = self._add_watch(path, file_watch_mask)
+        if wd is not None:
+            self._file_wds[wd] = path
+
+    def _watch_dir(self, path):
+        wd = self._add_watch(path.parent, dir_watch_mask)
+        if wd is not None:
+            self._dir_wds.setdefault(wd, {})[path.name] = path
+
+    async def wait(self, timeout):
+        '''
+        Wait until any of the watched files changes.
+        Returns dict path -> rotated (bool), or None if the caller should
+        check all files (timeout, event queue overflow).
+        '''
+        loop = get_event_loop()
+        if self._reader_loop is None:
+            loop.add_reader(self._fd, self._on_readable)
+            self._reader_loop = loop
+        self._read_events()
+        if not self._changed and not self._overflow:
+            self._waiter = loop.create_future()
+            try:
+                await wait_for(self._waiter, timeout)
+            except TimeoutError:
+                return None
+            finally:
+                self._waiter = None
+        changed, self._changed = self._changed, {}
+        if self._overflow:
+            self._overflow = False
+            return None
+        return changed
+
+    def _on_readable(self):
+        self._read_events()
+        if (self._changed or self._overflow) and self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _read_events(self):
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            if not data:
+                return
+            pos = 0
+            while pos < len(data):
+                wd, mask, cookie, name_len = event_header.unpack_from(data, pos)
+                pos += event_header.size
+                name = data[pos:pos + name_len].rstrip(b'\0')
+                pos += name_len
+                self._handle_event(wd, mask, name)
+
+    def _handle_event(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            logger.debug('inotify event queue overflow')
+            self._overflow = True
+            return
+        if wd in self._file_wds:
+            path = self._file_wds[wd]
+            if mask & IN_IGNORED:
+                # the file was deleted (or the watch was otherwise removed)
+                del self._file_wds[wd]
+            elif mask & (IN_MOVE_SELF | IN_DELETE_SELF):
+                self._changed[path] = True
+            elif mask & IN_MODIFY:
+                self._changed.setdefault(path, False)
+        elif wd in self._dir_wds and mask & dir_watch_mask:
+            path = self._dir_wds[wd].get(os.fsdecode(name))
+            if path is not None:
+                logger.debug('New file created: %s', path)
+                self._watch_file(path)
+                self._changed[path] = True
@@ -0,0 +1,228 @@
+'''
+Latency percentiles computed from $request_time and $upstream_response_time.
+
+The latencies are counted in log-scaled histograms (similar to HdrHistogram):
+every power of two (in milliseconds) is divided into sub_bucket_count buckets,
+so the relative error of a reported percentile is at most 1 / (2 * sub_bucket_count)
+(about 3 %). A histogram is just a Counter bucket index -> count, so it has
+bounded size, it can be merged by adding, and it can be kept in RollingCounter.
+'''
+
+from collections import OrderedDict, Counter
+from logging import getLogger
+from math import frexp
+from time import monotonic as monotime
+
+from .path_stats import get_record_path
+from .rolling_counter import RollingCounter
+from .space_saving import SpaceSaving
+
+
+logger = getLogger(__name__)
+
+sub_bucket_count = 16
+
+latency_metrics = ('request_time', 'upstream_response_time')
+
+reported_percentiles = ((50, 0.5), (90, 0.9), (99, 0.99))
+
+
+def latency_bucket(value_s):
+    '''
+    Returns histogram bucket index for latency in seconds.
+    Bucket 0 is for latencies under 1 ms.
+    '''
+    value_ms = value_s * 1000
+    if value_ms < 1:
+        return 0
+    mantissa, exponent = frexp(value_ms) # value_ms = mantissa * 2**exponent, 0.5 <= mantissa < 1
+    return (exponent - 1) * sub_bucket_count + int((mantissa - 0.5) * 2 * sub_bucket_count) + 1
+
+
+def latency_bucket_bounds(bucket):
+    '''
+    Returns (lower, upper) latency bound of given bucket, in seconds.
+    '''
+    if bucket == 0:
+        return 0, 0.001
+    power, sub_bucket = divmod(bucket - 1, sub_bucket_count)
+    lower_ms = 2 ** power * (1 + sub_bucket / sub_bucket_count)
+    upper_ms = 2 ** power * (1 + (sub_bucket + 1) / sub_bucket_count)
+    return lower_ms / 1000, upper_ms / 1000
+
+
+def get_histogram_summary(histogram):
+    '''
+    Returns OrderedDict with count, p50, p90, p99 and max (in seconds).
+    histogram: iterable of (bucket, count)
+    '''
+    items = sorted((bucket, count) for bucket, count in histogram if count > 0)
+    total = sum(count for bucket, count in items)
+    summary = OrderedDict()
+    summary['count'] = total
+    if not total:
+        return summary
+    cumulative = 0
+    pending = list(reported_percentiles)
+    for bucket, count in items:
+        cumulative += count
+        while pending and cumulative >= pending[0][1] * total:
+            lower, upper = latency_bucket_bounds(bucket)
+            summary['p{}'.format(pending.pop(0)[0])] = round((lower + upper) / 2, 4)
+    summary['max'] = round(latency_bucket_bounds(items[-1][0])[1], 4)
+    return summary
+
+
+def count_latencies(access_log_records):
+    '''
+    Returns Counter (metric, path, bucket) -> count. Path None means all paths.
+    '''
+    latency_count = Counter()
+    for access_log_record in access_log_records:
+        path = None
+        for metric in latency_metrics:
+            value = getattr(access_log_record, metric)
+            if value is None:
+                continue
+            if path is None:
+                path = get_record_path(access_log_record)
+            bucket = latency_bucket(value)
+            latency_count[(metric, None, bucket)] += 1
+            latency_count[(metric, path, bucket)] += 1
+    return latency_count
+
+
+class LatencyStats:
+    '''
+    Latency histograms - overall and for the most frequent paths,
+    in total and in the last 5 minutes.
+
+    Per-path histograms are kept for at most max_paths paths. Which paths
+    are admitted is decided by frequency, the same way as in AggregationStats:
+    while there is room, every new path is admitted, and every
+    readmit_interval_s the admitted paths are replaced by the most frequent
+    paths of the last interval. The total histograms of the dropped paths
+    are removed (the last 5 minutes keep them until they expire).
+    '''
+
+    max_paths = 1000
+    top_path_count = 5
+    readmit_interval_s = 300
+
+    def __init__(self, granularity_s=1, clock=monotime):
+        self.clock = clock
+        self.total_latency_count = Counter() # (metric, path, bucket) -> count
+        self.rolling_5min = RollingCounter(window_s=300, granularity_s=granularity_s)
+        self._path_count = Counter() # path -> number of latency samples
+        self._rolling_5min_path_count = RollingCounter(window_s=300, granularity_s=granularity_s)
+        self._admitted_paths = set()
+        self._path_frequency = None # SpaceSaving path -> number of latency samples in the current interval
+        self._readmit_mt = None
+        self._max_bucket = None
+
+    def update(self, access_log_record, now=None):
+        self.update_many([access_log_record], now=now)
+
+    def update_many(self, access_log_records, now=None):
+        self.merge(count_latencies(access_log_records), now=now)
+
+    def update_batch(self, record_batch, now=None):
+        '''
+        Update from columnar RecordBatch (see columnar.parse_batch())
+        '''
+        self.merge(record_batch.count_latencies(), now=now)
+
+    def merge(self, latency_count, now=None):
+        '''
+        Add counts pre-aggregated by count_latencies() (for example in a worker process)
+        '''
+        now = self.clock() if now is None else now
+        if self._readmit_mt is None:
+            self._readmit_mt = now
+            self._path_frequency = self._new_path_frequency_counter()
+        elif now >= self._readmit_mt + self.readmit_interval_s:
+            self._readmit()
+            self._readmit_mt = now
+        path_count = self._path_count
+        path_frequency = self._path_frequency
+        admitted = self._admitted_paths
+        accepted = Counter()
+        accepted_path_count = Counter()
+        max_bucket = self._max_bucket
+        for key, count in latency_count.items():
+            metric, path, bucket = key
+            if path is not None:
+                path_frequency[path] += count
+                if path not in admitted:
+                    if len(admitted) >= self.max_paths:
+                        continue
+                    admitted.add(path)
+                path_count[path] += count
+                accepted_path_count[path] += count
+            accepted[key] = count
+            if max_bucket is None or bucket > max_bucket:
+                max_bucket = bucket
+        self._max_bucket = max_bucket
+        if accepted:
+            self.total_latency_count.update(accepted)
+            self.rolling_5min.add_counts(accepted, now)
+            self._rolling_5min_path_count.add_counts(accepted_path_count, now)
+        self.rolling_5min.roll(now)
+        self._rolling_5min_path_count.roll(now)
+
+    def _new_path_frequency_counter(self):
+        # twice the cap, so that the top paths are estimated well
+        return SpaceSaving(2 * self.max_paths)
+
+    def _readmit(self):
+        '''
+        Admit the most frequent paths of the last interval instead of the current ones
+        '''
+        top = set(path for path, count in self._path_frequency.most_common(self.max_paths))
+        dropped = self._admitted_paths - top
+        self._admitted_paths = top
+        self._path_frequency = self._new_path_frequency_counter()
+        if not dropped:
+            return
+        self._path_count = Counter({path: count for path, count in self._path_count.items() if path not in dropped})
+        self.total_latency_count = Counter({
+            key: count for key, count in self.total_latency_count.items()
+            if key[1] not in dropped})
+
+    def get_version(self, now=None):
+        '''
+        Returns number that changes whenever the counts change
+        '''
+        now = self.clock() if now is None else now
+        self.rolling_5min.roll(now)
+        self._rolling_5min_path_count.roll(now)
+        return self.rolling_5min.version + self._rolling_5min_path_count.version
+
+    def get_report(self, now=None):
+        now = self.clock() if now is None else now
+        self.rolling_5min.roll(now)
+        self._rolling_5min_path_count.roll(now)
+        report = OrderedDict()
+        if self._max_bucket is None:
+            # the log format does not contain latencies
+            return report
+        windows = (
+            ('total', self.total_latency_count, self._path_count),
+            ('last_5_min', self.rolling_5min.counts, self._rolling_5min_path_count.counts),
+        )
+        # only the histograms that are reported are looked up, the report
+        # does not have to iterate over all paths
+        buckets = range(self._max_bucket + 1)
+        report['latency'] = OrderedDict()
+        for metric in latency_metrics:
+            metric_report = report['latency'][metric] = OrderedDict()
+            for window, latency_count, path_count in windows:
+                get_histogram = lambda path: [(b, latency_count.get((metric, path, b), 0)) for b in buckets]
+                window_report = metric_report[window] = OrderedDict()
+                window_report['all'] = get_histogram_summary(get_histogram(None))
+                window_report['paths'] = OrderedDict()
+                for path, count in path_count.most_common(self.top_path_count):
+                    summary = get_histogram_summary(get_histogram(path))
+                    if summary['count']:
+                        window_report['paths'][path] = summary
+        return report
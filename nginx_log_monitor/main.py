@@ -1,25 +1,37 @@
 from aiohttp import ClientSession
 from argparse import ArgumentParser
 from asyncio import Queue, wait, FIRST_COMPLETED, CancelledError
+from collections import Counter
+import json
 from logging import getLogger
 import os
 from pathlib import Path
 import sys
+from time import monotonic as monotime
 
 try:
     import sentry_sdk
 except ImportError:
     sentry_sdk = None
 
+from .aggregation import AggregationStats
+from .backfill import backfill, find_backfill_paths
+from .checkpoint import CheckpointStore
 from .clients import OverwatchClient, SentryClient
 from .configuration import Configuration
+from .event_time import EventTimeWindowing
 from .file_reader import tail_files
-from .access_log_parser import parse_access_log_line, BogusLogLineError, InvalidLogLineError
+from .access_log_parser import AccessLogParser, parse_log_line
 from .util import asyncio_run, create_task, PubSub
+from .util.asyncio import drop_oldest
 from .status_stats import StatusStats
 from .path_stats import PathStats
-from .overwatch import report_to_overwatch
+from .latency_stats import LatencyStats
+from .metrics import MetricsRenderer, run_metrics_server
+from .monitor_stats import MonitorStats
+from .overwatch import report_to_overwatch, generate_report
 from .sentry import report_to_sentry
+from .worker_pool import WorkerPool
 
 
 logger = getLogger(__name__)
@@ -33,12 +45,18 @@ def nginx_log_monitor_main():
     p.add_argument('--conf', metavar='FILE', help='path to configuration file')
     p.add_argument('--verbose', '-v', action='store_true')
     p.add_argument('--test-parse', action='store_true', help='only test parse the nginx log')
+    p.add_argument(
+        '--backfill', metavar='FILE', nargs='*',
+        help='process whole log files (default: access logs including rotated ones), print report and exit')
     args = p.parse_args()
     setup_logging(verbose=args.verbose)
     conf = Configuration(cfg_path=args.conf or os.environ.get('CONF_FILE'))
     if args.test_parse:
         test_parse(conf)
         return
+    if args.backfill is not None:
+        run_backfill(conf, args.backfill)
+        return
     if sentry_sdk and conf.sentry.dsn:
         sentry_sdk.init(dsn=conf.sentry.dsn)
     try:
@@ -62,11 +80,11 @@ def test_parse(conf):
     paths = conf.get_access_log_paths()
     for p in paths:
         logger.debug('Reading %s', p)
+        parser = AccessLogParser(conf.get_log_format(p))
         with p.open(mode='rb') as f:
             for line in f:
-                line = line.decode()
                 try:
-                    access_log_record = parse_access_log_line(line)
+                    access_log_record = parser.parse(line)
                 except Exception as e:
                     print('{}: {}'.format(e.__class__.__name__, str(e)))
                 else:
@@ -74,39 +92,185 @@ def test_parse(conf):
 
 
 
+def run_backfill(conf, paths):
+    if paths:
+        paths = [Path(p) for p in paths]
+        log_formats = {p: conf.get_log_format(p) for p in paths}
+    else:
+        paths = []
+        log_formats = {}
+        for access_log_path in conf.get_access_log_paths():
+            for p in find_backfill_paths(access_log_path):
+                paths.append(p)
+                log_formats[p] = conf.get_log_format(access_log_path)
+    event_time = create_event_time_windowing(conf, follow_wall_clock=False)
+    clock = event_time.get_watermark if event_time else monotime
+    status_stats = create_status_stats(conf, clock)
+    path_stats = PathStats(
+        granularity_s=conf.stats.rolling_granularity_s,
+        sampling_threshold_per_s=conf.stats.path_sampling_threshold_per_s,
+        clock=clock)
+    latency_stats = LatencyStats(granularity_s=conf.stats.rolling_granularity_s, clock=clock)
+    aggregation_stats = create_aggregation_stats(conf, clock)
+    stats_objs = [status_stats, path_stats, latency_stats]
+    if aggregation_stats:
+        stats_objs.append(aggregation_stats)
+    if event_time:
+        event_time.stats_objs = stats_objs
+        result = backfill(paths, log_formats.get, [event_time])
+        event_time.flush()
+    else:
+        result = backfill(paths, log_formats.get, stats_objs)
+    print(result, file=sys.stderr)
+    report = generate_report(conf, status_stats, path_stats, latency_stats, aggregation_stats=aggregation_stats)
+    print(json.dumps(report, indent=2))
+    if conf.overwatch.enabled:
+        asyncio_run(send_backfill_report(conf, report))
+
+
+def create_event_time_windowing(conf, follow_wall_clock):
+    if not conf.stats.event_time:
+        return None
+    return EventTimeWindowing(allowed_lateness_s=conf.stats.allowed_lateness_s, follow_wall_clock=follow_wall_clock)
+
+
+def create_status_stats(conf, clock=monotime):
+    return StatusStats(
+        granularity_s=conf.stats.rolling_granularity_s,
+        windows_s=conf.stats.windows_s,
+        rate_time_constants_s=conf.stats.rate_time_constants_s,
+        clock=clock)
+
+
+def create_aggregation_stats(conf, clock=monotime):
+    if not conf.aggregations:
+        return None
+    return AggregationStats(
+        conf.aggregations,
+        granularity_s=conf.stats.rolling_granularity_s,
+        max_cardinality=conf.aggregation_max_cardinality,
+        clock=clock)
+
+
+async def send_backfill_report(conf, report):
+    async with ClientSession() as session:
+        overwatch_client = OverwatchClient(
+            session,
+            report_url=conf.overwatch.report_url,
+            report_token=conf.overwatch.report_token,
+            compress=conf.overwatch.compress)
+        await overwatch_client.send_report(report)
+
+
 async def async_main(conf, overwatch_client=None, sentry_client=None):
     '''
     This is where all the stuff is happening :)
     '''
     access_log_pubsub = PubSub(1000)
+    parsers = {} # path -> AccessLogParser
+    worker_pool = WorkerPool(conf.workers, aggregation_views=list(conf.aggregations.values())) if conf.workers else None
+    monitor_stats = MonitorStats(granularity_s=conf.stats.rolling_granularity_s)
+    monitor_stats.watch_pubsub('access_log', access_log_pubsub)
+    if worker_pool:
+        monitor_stats.watch_queue('worker_pool', worker_pool.pending)
 
-    async def _process_log_line(path, line):
-        await process_log_line(access_log_pubsub, path, line)
+    async def _process_log_lines(path, lines):
+        monitor_stats.lines_read(lines)
+        if worker_pool:
+            await worker_pool.submit(path, conf.get_log_format(path), lines)
+            return
+        parser = parsers.get(path)
+        if parser is None:
+            parser = parsers[path] = AccessLogParser(conf.get_log_format(path))
+        await process_log_lines(access_log_pubsub, parser, lines, monitor_stats=monitor_stats)
 
     tasks = []
+    # the Sentry client created here (not passed in) is closed here
+    own_sentry_client = SentryClient() if conf.sentry.enabled and not sentry_client else None
     run_task = lambda tf: tasks.append(create_task(tf))
 
     async with ClientSession() as session:
         try:
-            run_task(tail_files(conf.get_access_log_paths, _process_log_line))
-            status_stats = StatusStats()
-            path_stats = PathStats()
-            run_task(update_stats(access_log_pubsub.subscribe(), status_stats))
-            run_task(update_stats(access_log_pubsub.subscribe(), path_stats))
+            checkpoint_store = None
+            if conf.checkpoint.enabled:
+                checkpoint_store = CheckpointStore(conf.checkpoint.state_path, save_interval_s=conf.checkpoint.save_interval_s)
+                checkpoint_store.load()
+            run_task(tail_files(
+                conf.get_access_log_paths,
+                process_lines=_process_log_lines,
+                checkpoint_store=checkpoint_store,
+                max_backlog_bytes=conf.checkpoint.max_backlog_bytes,
+                monitor_stats=monitor_stats))
+            run_task(monitor_stats.measure_loop_lag())
+            event_time = None if worker_pool else create_event_time_windowing(conf, follow_wall_clock=True)
+            if worker_pool and conf.stats.event_time:
+                # the workers send counts, not records with timestamps
+                logger.warning('Event time windowing is not supported with workers, using processing time')
+            clock = event_time.get_watermark if event_time else monotime
+            status_stats = create_status_stats(conf, clock)
+            path_stats = PathStats(
+                granularity_s=conf.stats.rolling_granularity_s,
+                sampling_threshold_per_s=conf.stats.path_sampling_threshold_per_s,
+                clock=clock)
+            latency_stats = LatencyStats(granularity_s=conf.stats.rolling_granularity_s, clock=clock)
+            aggregation_stats = create_aggregation_stats(conf, clock)
+            if worker_pool:
+                # records are parsed and counted in worker processes,
+                # only server errors are published for Sentry
+                async def _merge_partial_stats(partial_stats):
+                    monitor_stats.lines_parsed(
+                        partial_stats.line_count - partial_stats.failed_count,
+                        partial_stats.error_count,
+                        partial_stats.parse_duration_s)
+                    t0 = monotime()
+                    status_stats.merge(partial_stats.status_count)
+                    path_stats.merge(partial_stats.path_status_count)
+                    latency_stats.merge(partial_stats.latency_count)
+                    if aggregation_stats:
+                        aggregation_stats.merge(partial_stats.aggregation_count)
+                    monitor_stats.stats_updated(monotime() - t0)
+                    await access_log_pubsub.put_batch(partial_stats.server_error_records)
+
+                logger.debug('Using %d worker processes', worker_pool.workers)
+                run_task(worker_pool.merge_results(_merge_partial_stats))
+            else:
+                # one subscriber updates all the stats, so that every batch is queued just once
+                stats_objs = [status_stats, path_stats, latency_stats]
+                if aggregation_stats:
+                    stats_objs.append(aggregation_stats)
+                if event_time:
+                    # records go through the event time buffer, see event_time
+                    event_time.stats_objs = stats_objs
+                    stats_objs = [event_time]
+                run_task(update_stats(access_log_pubsub.subscribe('stats'), stats_objs, monitor_stats=monitor_stats))
             if conf.overwatch.enabled:
                 logger.debug('Starting Overwatch integration')
                 if not overwatch_client:
                     overwatch_client = OverwatchClient(
                         session,
                         report_url=conf.overwatch.report_url,
-                        report_token=conf.overwatch.report_token)
-                run_task(report_to_overwatch(conf, status_stats, path_stats, overwatch_client=overwatch_client))
+                        report_token=conf.overwatch.report_token,
+                        compress=conf.overwatch.compress)
+                run_task(report_to_overwatch(
+                    conf, status_stats, path_stats,
+                    overwatch_client=overwatch_client,
+                    latency_stats=latency_stats,
+                    monitor_stats=monitor_stats,
+                    aggregation_stats=aggregation_stats))
+            if conf.metrics.enabled:
+                logger.debug('Starting metrics server')
+                run_task(run_metrics_server(conf, MetricsRenderer(
+                    status_stats, path_stats, latency_stats, monitor_stats,
+                    top_paths=conf.metrics.top_paths,
+                    aggregation_stats=aggregation_stats,
+                    clock=clock)))
             if conf.sentry.enabled:
                 logger.debug('Starting Sentry integration')
                 run_task(report_to_sentry(
                     conf,
-                    access_log_pubsub.subscribe(),
-                    sentry_client=sentry_client or SentryClient()))
+                    # best effort - Sentry must not slow down the log processing
+                    access_log_pubsub.subscribe('sentry', policy=drop_oldest),
+                    sentry_client=sentry_client or own_sentry_client))
             done, pending = await wait(tasks, return_when=FIRST_COMPLETED)
             for t in done:
                 logger.warning('Task has finished unexpectedly: %r (%s)', t.exception() or t.get_task_result(), t)
@@ -114,27 +278,37 @@ async def async_main(conf, overwatch_client=None, sentry_client=None):
             logger.exception('async_main failed: %r', e)
         finally:
             await stop_tasks(tasks)
+            if worker_pool:
+                worker_pool.close()
+            if own_sentry_client:
+                await own_sentry_client.close()
 
 
-async def process_log_line(access_log_pubsub, path, line):
-    assert isinstance(line, bytes)
-    line = line.decode()
-    try:
-        access_log_record = parse_access_log_line(line)
-    except BogusLogLineError as e:
-        logger.debug('Failed to parse line: %s', e)
-    except InvalidLogLineError as e:
-        logger.info('Failed to parse line: %s', e)
-    except Exception as e:
-        logger.warning('Failed to parse line: %s', e)
-    else:
-        await access_log_pubsub.put(access_log_record)
+async def process_log_line(access_log_pubsub, parser, line):
+    await process_log_lines(access_log_pubsub, parser, [line])
+
+
+async def process_log_lines(access_log_pubsub, parser, lines, monitor_stats=None):
+    t0 = monotime()
+    access_log_records = []
+    error_count = Counter()
+    for line in lines:
+        access_log_record = parse_log_line(parser, line, error_count)
+        if access_log_record is not None:
+            access_log_records.append(access_log_record)
+    if monitor_stats:
+        monitor_stats.lines_parsed(len(access_log_records), error_count, monotime() - t0)
+    await access_log_pubsub.put_batch(access_log_records)
 
 
-async def update_stats(access_log_queue, stats_obj):
+async def update_stats(access_log_queue, stats_objs, monitor_stats=None):
     while True:
-        access_log_record = await access_log_queue.get()
-        stats_obj.update(access_log_record)
+        access_log_records = await access_log_queue.get()
+        t0 = monotime()
+        for stats_obj in stats_objs:
+            stats_obj.update_many(access_log_records)
+        if monitor_stats:
+            monitor_stats.stats_updated(monotime() - t0)
 
 
 async def stop_tasks(tasks):
@@ -0,0 +1,205 @@
+'''
+Prometheus /metrics endpoint (text exposition format).
+
+Rendering the path counters means walking big SpaceSaving counters, so the
+rendered stats are cached and rebuilt only when the counts have changed
+(see get_version() of the stats objects). The monitor's own counters are
+cheap and are rendered on every scrape.
+'''
+
+from aiohttp import web
+from asyncio import sleep
+from logging import getLogger
+from time import monotonic as monotime
+
+
+logger = getLogger(__name__)
+
+content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+prefix = 'nginx_log_monitor_'
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, escape_label_value(v)) for k, v in labels) + '}'
+
+
+class MetricsWriter:
+
+    def __init__(self):
+        self.lines = []
+
+    def metric(self, name, metric_type, help_text, samples):
+        '''
+        samples: iterable of (labels, value), labels being list of (name, value)
+        '''
+        self.lines.append('# HELP {}{} {}'.format(prefix, name, help_text))
+        self.lines.append('# TYPE {}{} {}'.format(prefix, name, metric_type))
+        for labels, value in samples:
+            self.lines.append('{}{}{} {}'.format(prefix, name, format_labels(labels), value))
+
+    def summary(self, name, help_text, latency_summary):
+        '''
+        latency_summary: dict with count, p50, p90, p99, max (see get_histogram_summary())
+        '''
+        samples = []
+        for q, key in (('0.5', 'p50'), ('0.9', 'p90'), ('0.99', 'p99'), ('1', 'max')):
+            if key in latency_summary:
+                samples.append(([('quantile', q)], latency_summary[key]))
+        self.metric(name, 'summary', help_text, samples)
+        self.lines.append('{}{}_count {}'.format(prefix, name, latency_summary.get('count', 0)))
+
+    def get_text(self):
+        return ''.join(line + '\n' for line in self.lines)
+
+
+def render_stats(status_stats, path_stats, latency_stats=None, top_paths=100, now=None):
+    now = monotime() if now is None else now
+    w = MetricsWriter()
+    status_report = status_stats.get_report(now=now)['status_count']
+    w.metric(
+        'requests_total', 'counter', 'Number of requests by status',
+        [([('status', status)], count) for status, count in status_report['total'].items()])
+    w.metric(
+        'requests_last_5min', 'gauge', 'Number of requests by status in the last 5 minutes',
+        [([('status', status)], count) for status, count in sorted(status_stats.rolling_5min_status_count.items())])
+    w.metric(
+        'path_requests_total', 'counter', 'Number of requests of the most frequent paths by status',
+        [([('status', status), ('path', path)], count)
+         for status, path_count in sorted(path_stats.total_path_status_count.items())
+         for path, count in path_count.most_common(top_paths)])
+    w.metric(
+        'path_requests_last_5min', 'gauge', 'Number of requests of the most frequent paths by status in the last 5 minutes',
+        [([('status', status), ('path', path)], count)
+         for status, rolling_counter in sorted(path_stats.rolling_5min_path_status_count.items())
+         for path, count in rolling_counter.counts.most_common(top_paths)])
+    latency_report = latency_stats.get_report(now=now).get('latency') if latency_stats else None
+    if latency_report:
+        for metric, metric_report in latency_report.items():
+            w.summary(
+                '{}_seconds'.format(metric), 'Latency ({})'.format(metric),
+                metric_report['total']['all'])
+            w.summary(
+                '{}_last_5min_seconds'.format(metric), 'Latency ({}) in the last 5 minutes'.format(metric),
+                metric_report['last_5_min']['all'])
+    return w.get_text()
+
+
+def render_aggregation_stats(aggregation_stats, now=None):
+    w = MetricsWriter()
+    aggregations = aggregation_stats.get_report(now=now)['aggregations']
+    for metric in 'requests', 'body_bytes_sent':
+        w.metric(
+            'aggregated_{}_total'.format(metric), 'counter', 'Aggregated {} by configured dimensions'.format(metric),
+            [([('view', name)] + [(d, row[d]) for d in view_report['dimensions']], row[metric])
+             for name, view_report in aggregations.items()
+             for row in view_report['total']])
+    return w.get_text()
+
+
+def render_monitor_stats(monitor_stats, now=None):
+    report = monitor_stats.get_report(now=now)['monitor']
+    total = monitor_stats.total_count
+    w = MetricsWriter()
+    w.metric('uptime_seconds', 'gauge', 'Time since the monitor started', [([], report['uptime_s'])])
+    w.metric('lines_read_total', 'counter', 'Lines read from the access logs', [([], total['lines_read'])])
+    w.metric('bytes_read_total', 'counter', 'Bytes read from the access logs', [([], total['bytes_read'])])
+    w.metric('lines_parsed_total', 'counter', 'Lines parsed successfully', [([], total['lines_parsed'])])
+    w.metric(
+        'lines_failed_total', 'counter', 'Lines that could not be parsed',
+        [([('error', name)], count) for name, count in report['total']['lines_failed'].items()])
+    w.metric('parse_seconds_total', 'counter', 'Time spent parsing', [([], round(total['parse_s'], 6))])
+    w.metric('stats_update_seconds_total', 'counter', 'Time spent updating stats', [([], round(total['stats_update_s'], 6))])
+    w.metric(
+        'file_backlog_bytes', 'gauge', 'Bytes written to the access log and not read yet',
+        [([('path', path)], size) for path, size in report['file_backlog_bytes'].items()])
+    w.metric(
+        'queue_depth', 'gauge', 'Items waiting in the internal queues',
+        [([('queue', name)], size) for name, size in report['queue_depth'].items()])
+    w.metric(
+        'queue_high_water_mark', 'gauge', 'Highest number of items waiting in the subscriber queues',
+        [([('queue', name)], size) for name, size in report['queue_high_water_mark'].items()])
+    w.metric(
+        'queue_dropped_items_total', 'counter', 'Items dropped because the subscriber queue was full',
+        [([('queue', name)], count) for name, count in report['queue_dropped_items'].items()])
+    if report['event_loop_lag_s']['last'] is not None:
+        w.metric(
+            'event_loop_lag_seconds', 'gauge', 'How late the event loop wakes up sleeping tasks',
+            [([], report['event_loop_lag_s']['last'])])
+    w.metric(
+        'unify_path_cache_requests_total', 'counter', 'Lookups in the unify_path cache',
+        [([('result', 'hit')], report['unify_path_cache']['hits']),
+         ([('result', 'miss')], report['unify_path_cache']['misses'])])
+    w.metric('unify_path_cache_size', 'gauge', 'Paths in the unify_path cache', [([], report['unify_path_cache']['size'])])
+    return w.get_text()
+
+
+class MetricsRenderer:
+    '''
+    Renders the metrics; the stats part is cached until the stats change.
+
+    The stats are rendered at the time given by clock - the same clock the
+    stats use (monotime, or the event time watermark). The monitor stats
+    always use monotime.
+    '''
+
+    def __init__(self, status_stats, path_stats, latency_stats=None, monitor_stats=None, top_paths=100,
+                 aggregation_stats=None, clock=monotime):
+        self.status_stats = status_stats
+        self.path_stats = path_stats
+        self.latency_stats = latency_stats
+        self.monitor_stats = monitor_stats
+        self.aggregation_stats = aggregation_stats
+        self.top_paths = top_paths
+        self.clock = clock
+        self._cached_version = None
+        self._cached_text = None
+        self.render_count = 0
+
+    def _get_version(self, now):
+        stats_objs = [self.status_stats, self.path_stats, self.latency_stats, self.aggregation_stats]
+        return tuple(s.get_version(now=now) for s in stats_objs if s is not None)
+
+    def render(self, now=None):
+        now = self.clock() if now is None else now
+        version = self._get_version(now)
+        if version != self._cached_version:
+            self._cached_text = render_stats(
+                self.status_stats, self.path_stats, self.latency_stats,
+                top_paths=self.top_paths, now=now)
+            if self.aggregation_stats is not None:
+                self._cached_text += render_aggregation_stats(self.aggregation_stats, now=now)
+            self._cached_version = version
+            self.render_count += 1
+        text = self._cached_text
+        if self.monitor_stats is not None:
+            text += render_monitor_stats(self.monitor_stats)
+        return text
+
+
+def create_metrics_app(renderer):
+    async def handle_metrics(request):
+        return web.Response(body=renderer.render().encode(), headers={'Content-Type': content_type})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    return app
+
+
+async def run_metrics_server(conf, renderer):
+    runner = web.AppRunner(create_metrics_app(renderer))
+    await runner.setup()
+    try:
+        site = web.TCPSite(runner, conf.metrics.listen_host, conf.metrics.listen_port)
+        await site.start()
+        logger.info('Serving metrics on http://%s:%s/metrics', conf.metrics.listen_host, conf.metrics.listen_port)
+        while True:
+            await sleep(3600)
+    finally:
+        await runner.cleanup()
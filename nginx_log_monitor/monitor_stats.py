@@ -0,0 +1,134 @@
+'''
+Self-instrumentation of the monitor - is it keeping up with the logs?
+
+Everything is counted per batch of lines (not per line), so the
+instrumentation is cheap enough to be always on.
+'''
+
+from asyncio import sleep
+from collections import OrderedDict, Counter, deque
+from logging import getLogger
+from time import monotonic as monotime
+
+from .path_stats import get_unify_path_cache_info
+from .rolling_counter import RollingCounter
+
+
+logger = getLogger(__name__)
+
+parse_error_names = ('BogusLogLineError', 'InvalidLogLineError', 'other')
+
+
+class MonitorStats:
+    '''
+    Pipeline throughput, parse failures, backlog of the tailed files,
+    queue depths, event loop lag and time spent in parsing and stats updates.
+
+    Rates are computed over the last minute (rate_window_s).
+    '''
+
+    rate_window_s = 60
+
+    def __init__(self, granularity_s=1):
+        self.start_mt = monotime()
+        self.total_count = Counter() # name -> count (or seconds)
+        self.rolling_count = RollingCounter(window_s=self.rate_window_s, granularity_s=granularity_s)
+        self.loop_lags = deque(maxlen=60) # event loop lag samples [s]
+        self._open_files = {} # path -> FileReader
+        self._pubsubs = {} # name -> PubSub
+        self._queues = {} # name -> Queue
+
+    def add_counts(self, counts, now=None):
+        now = monotime() if now is None else now
+        self.total_count.update(counts)
+        self.rolling_count.add_counts(counts, now)
+
+    def lines_read(self, lines, now=None):
+        self.add_counts({
+            'lines_read': len(lines),
+            'bytes_read': sum(map(len, lines)) + len(lines),
+        }, now=now)
+
+    def lines_parsed(self, parsed_count, error_count, duration_s, now=None):
+        '''
+        error_count: Counter error name -> count (see parse_log_line())
+        '''
+        counts = {'lines_parsed': parsed_count, 'parse_s': duration_s}
+        for error_name, count in error_count.items():
+            counts['failed_' + error_name] = count
+        self.add_counts(counts, now=now)
+
+    def stats_updated(self, duration_s, now=None):
+        self.add_counts({'stats_update_s': duration_s}, now=now)
+
+    def watch_files(self, open_files):
+        '''
+        open_files: dict path -> FileReader (from tail_files())
+        '''
+        self._open_files = open_files
+
+    def watch_pubsub(self, name, pubsub):
+        self._pubsubs[name] = pubsub
+
+    def watch_queue(self, name, queue):
+        self._queues[name] = queue
+
+    async def measure_loop_lag(self, interval_s=1):
+        '''
+        Run as a task - measures how late the event loop wakes up a sleeping task
+        '''
+        while True:
+            t0 = monotime()
+            await sleep(interval_s)
+            self.loop_lags.append(max(0, monotime() - t0 - interval_s))
+
+    def get_report(self, now=None):
+        now = monotime() if now is None else now
+        self.rolling_count.roll(now)
+        rolling = self.rolling_count.counts
+        total = self.total_count
+        elapsed_s = max(min(now - self.start_mt, self.rate_window_s), 1e-3)
+        per_s = lambda name: round(rolling.get(name, 0) / elapsed_s, 3)
+        report = OrderedDict()
+        report['uptime_s'] = round(now - self.start_mt, 3)
+        report['per_second'] = OrderedDict()
+        report['per_second']['lines_read'] = per_s('lines_read')
+        report['per_second']['bytes_read'] = per_s('bytes_read')
+        report['per_second']['lines_parsed'] = per_s('lines_parsed')
+        report['per_second']['lines_failed'] = OrderedDict((n, per_s('failed_' + n)) for n in parse_error_names)
+        report['total'] = OrderedDict()
+        report['total']['lines_read'] = total['lines_read']
+        report['total']['bytes_read'] = total['bytes_read']
+        report['total']['lines_parsed'] = total['lines_parsed']
+        report['total']['lines_failed'] = OrderedDict((n, total['failed_' + n]) for n in parse_error_names)
+        # fraction of the wall clock time spent in parsing and in stats updates
+        report['busy_ratio'] = OrderedDict()
+        report['busy_ratio']['parse'] = per_s('parse_s')
+        report['busy_ratio']['stats_update'] = per_s('stats_update_s')
+        report['file_backlog_bytes'] = OrderedDict()
+        for path, fr in sorted(self._open_files.items()):
+            try:
+                report['file_backlog_bytes'][str(path)] = fr.get_backlog_bytes()
+            except Exception as e:
+                logger.debug('Failed to get backlog of %s: %r', path, e)
+        report['queue_depth'] = OrderedDict()
+        report['queue_high_water_mark'] = OrderedDict()
+        report['queue_dropped_items'] = OrderedDict()
+        for name, pubsub in sorted(self._pubsubs.items()):
+            for subscriber, stats in sorted(pubsub.get_subscriber_stats().items()):
+                queue_name = '{}.{}'.format(name, subscriber)
+                report['queue_depth'][queue_name] = stats['size']
+                report['queue_high_water_mark'][queue_name] = stats['high_water_mark']
+                report['queue_dropped_items'][queue_name] = stats['dropped']
+        for name, queue in sorted(self._queues.items()):
+            report['queue_depth'][name] = queue.qsize()
+        report['event_loop_lag_s'] = OrderedDict()
+        report['event_loop_lag_s']['last'] = round(self.loop_lags[-1], 6) if self.loop_lags else None
+        report['event_loop_lag_s']['max'] = round(max(self.loop_lags), 6) if self.loop_lags else None
+        # of this process - the worker processes have their own caches
+        cache_info = get_unify_path_cache_info()
+        report['unify_path_cache'] = OrderedDict()
+        report['unify_path_cache']['hits'] = cache_info.hits
+        report['unify_path_cache']['misses'] = cache_info.misses
+        report['unify_path_cache']['size'] = cache_info.currsize
+        return {'monitor': report}
@@ -4,24 +4,39 @@ from datetime import datetime
 from logging import getLogger
 import os
 from os import getpid
+from pathlib import Path
+from random import random
 from socket import getfqdn
 from time import time
 
-from .clients.overwatch_client import OverwatchClientNotConfiguredError, OverwatchClientReportError
+from .clients.overwatch_client import OverwatchClientNotConfiguredError, OverwatchClientReportError, encode_report
+from .util.files import write_file_atomic
 
 
 logger = getLogger(__name__)
 
 
-async def report_to_overwatch(conf, status_stats, path_stats, overwatch_client):
+async def report_to_overwatch(conf, status_stats, path_stats, overwatch_client,
+                             latency_stats=None, monitor_stats=None, aggregation_stats=None):
+    spool = ReportSpool(conf.overwatch.spool_path, max_bytes=conf.overwatch.max_spool_bytes)
+    spool.load()
+    backoff = Backoff(conf.overwatch.report_interval_s, conf.overwatch.max_backoff_s)
+    # any object with send_encoded_report() will do, it does not have to be OverwatchClient
+    compress = getattr(overwatch_client, 'compress', False)
     while True:
-        report = generate_report(conf, status_stats, path_stats)
+        report = generate_report(conf, status_stats, path_stats, latency_stats, monitor_stats, aggregation_stats)
+        report['state']['overwatch_delivery'] = spool.get_report()
+        spool.put(encode_report(report, compress=compress), compressed=compress)
         try:
-            await overwatch_client.send_report(report)
+            await spool.flush(overwatch_client)
+            backoff.reset()
         except OverwatchClientNotConfiguredError:
             logger.info('Overwatch not configured')
         except OverwatchClientReportError as e:
-            logger.warning('Overwatch report failed: %r', e)
+            delay = backoff.next_delay()
+            logger.warning('Overwatch report failed: %r; retrying in %.1f s', e, delay)
+            await sleep(delay)
+            continue
         if not status_stats.have_5xx.is_set():
             try:
                 await wait_for(status_stats.have_5xx.wait(), conf.overwatch.report_interval_s)
@@ -31,7 +46,115 @@ async def report_to_overwatch(conf, status_stats, path_stats, overwatch_client):
             await sleep(conf.overwatch.report_interval_s)
 
 
-def generate_report(conf, status_stats, path_stats):
+class Backoff:
+    '''
+    Exponential backoff with jitter: the delay doubles with every failure
+    (starting at initial_s, up to max_s) and is randomized to 50-100 %,
+    so that many monitors do not retry all at the same moment.
+    '''
+
+    def __init__(self, initial_s, max_s):
+        self.initial_s = initial_s
+        self.max_s = max_s
+        self.failure_count = 0
+
+    def reset(self):
+        self.failure_count = 0
+
+    def next_delay(self):
+        delay = min(self.max_s, self.initial_s * 2 ** self.failure_count)
+        self.failure_count += 1
+        return delay * (0.5 + random() / 2)
+
+
+class ReportSpool:
+    '''
+    Unsent Overwatch reports (encoded request bodies).
+
+    Every report contains the whole current state, so a new report replaces
+    the unsent one (coalescing) - after an outage only the latest state is
+    sent, not all the reports generated meanwhile. Only the number of
+    replaced reports and failed attempts is kept (see get_report()).
+
+    If path is given, the report that failed to be sent is saved there (if not
+    bigger than max_bytes) and after restart it is sent before the first new report.
+    '''
+
+    def __init__(self, path=None, max_bytes=10 * 2**20):
+        self.path = Path(path) if path else None
+        self.max_bytes = max_bytes
+        self._previous_run_body = None # (body, compressed) loaded from path
+        self._body = None # (body, compressed)
+        self.coalesced_count = 0
+        self.failed_count = 0
+        self.sent_count = 0
+
+    def __len__(self):
+        return (self._previous_run_body is not None) + (self._body is not None)
+
+    def load(self):
+        if not self.path:
+            return
+        try:
+            body = self.path.read_bytes()
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning('Failed to load Overwatch report spool %s: %r', self.path, e)
+            return
+        if body:
+            logger.info('Loaded unsent Overwatch report from %s', self.path)
+            self._previous_run_body = (body, body.startswith(b'\x1f\x8b'))
+
+    def put(self, body, compressed=False):
+        if self._body is not None:
+            self.coalesced_count += 1
+        self._body = (body, compressed)
+
+    async def flush(self, overwatch_client):
+        '''
+        Send the unsent reports; raises OverwatchClientReportError if that fails
+        '''
+        for attr in '_previous_run_body', '_body':
+            item = getattr(self, attr)
+            if item is None:
+                continue
+            body, compressed = item
+            try:
+                await overwatch_client.send_encoded_report(body, compressed=compressed)
+            except OverwatchClientReportError:
+                self.failed_count += 1
+                self._save()
+                raise
+            setattr(self, attr, None)
+            self.sent_count += 1
+        self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        item = self._body or self._previous_run_body
+        body = item[0] if item else b''
+        if len(body) > self.max_bytes:
+            logger.warning('Overwatch report is too big to be spooled (%d bytes)', len(body))
+            body = b''
+        try:
+            if body:
+                write_file_atomic(self.path, body)
+            elif self.path.exists():
+                self.path.unlink()
+        except Exception as e:
+            logger.warning('Failed to write Overwatch report spool %s: %r', self.path, e)
+
+    def get_report(self):
+        report = OrderedDict()
+        report['sent_reports'] = self.sent_count
+        report['coalesced_reports'] = self.coalesced_count
+        report['failed_attempts'] = self.failed_count
+        return report
+
+
+def generate_report(conf, status_stats, path_stats, latency_stats=None, monitor_stats=None, aggregation_stats=None):
     watchdog_interval_s = conf.overwatch.report_interval_s * 2 + 60
     report = {
         'date': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
@@ -49,4 +172,10 @@ def generate_report(conf, status_stats, path_stats):
     }
     report['state'].update(status_stats.get_report())
     report['state'].update(path_stats.get_report())
+    if latency_stats is not None:
+        report['state'].update(latency_stats.get_report())
+    if aggregation_stats is not None:
+        report['state'].update(aggregation_stats.get_report())
+    if monitor_stats is not None:
+        report['state'].update(monitor_stats.get_report())
     return report
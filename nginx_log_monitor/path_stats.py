@@ -1,47 +1,140 @@
-from collections import OrderedDict, Counter, defaultdict, deque
+from collections import OrderedDict, Counter, defaultdict
+from functools import lru_cache
 from logging import getLogger
-import re
 from sys import intern
 from time import monotonic as monotime
 
+from .rolling_counter import RollingCounter
+from .space_saving import SpaceSaving
+
 
 logger = getLogger(__name__)
 
+other_path = '<other_path>'
+
 
 class PathStats:
 
-    def __init__(self):
-        self.total_path_status_count = defaultdict(Counter)
-        self.rolling_5min_path_status_count = defaultdict(Counter)
-        self.rolling_5min_deque = deque()
+    # Paths are counted per status in SpaceSaving counters, so the memory
+    # stays bounded even when somebody scans us with random URLs.
+    # The window buckets hold at most bucket_path_count_capacity paths each
+    # (the most frequent ones of every batch); the other paths are counted
+    # as <other_path>, so the window has at most 300 / granularity_s *
+    # (bucket_path_count_capacity + 1) bucket entries per status.
+    # Error bound of a last_5_min count: lower by at most the requests that
+    # came in the buckets where the path did not fit (those are in
+    # <other_path>), higher by at most the SpaceSaving error of the window
+    # counter (<= requests in the window / path_count_capacity).
+    path_count_capacity = 10000
+    bucket_path_count_capacity = 100
+
+    def __init__(self, granularity_s=1, sampling_threshold_per_s=None, clock=monotime):
+        '''
+        If sampling_threshold_per_s is set and more records per second come
+        to update_many(), only every n-th record is processed and counted n
+        times, so that about sampling_threshold_per_s records per second are
+        processed. The counts are then estimates and the report says so.
+
+        clock returns the current time when now is not given (see event_time).
+        '''
+        self.clock = clock
+        self.granularity_s = granularity_s
+        self.total_path_status_count = defaultdict(self._new_path_counter) # status -> SpaceSaving
+        self.rolling_5min_path_status_count = defaultdict(self._new_rolling_counter) # status -> RollingCounter
+        self.sampling_threshold_per_s = sampling_threshold_per_s
+        self.sample_step = 1 # every sample_step-th record is processed
+        self.sampled_count = 0 # records processed while sampling
+        self.skipped_count = 0 # records skipped by sampling
+        self._rolling_5min_skipped = RollingCounter(window_s=300, granularity_s=granularity_s)
+        self._sample_offset = 0
+        self._rate_second = None
+        self._rate_count = 0
+        self._last_rate = 0
+
+    def _new_path_counter(self):
+        return SpaceSaving(self.path_count_capacity)
+
+    def _new_rolling_counter(self):
+        return RollingCounter(
+            window_s=300,
+            granularity_s=self.granularity_s,
+            counter_factory=self._new_path_counter,
+            bucket_counter_factory=Counter,
+            bucket_capacity=self.bucket_path_count_capacity,
+            other_key=other_path)
 
     def update(self, access_log_record, now=None):
-        status = intern(str(access_log_record.status))
-        path = unify_path(access_log_record.path)
-        if access_log_record.host:
-            path = access_log_record.host + path
-        now = monotime() if now is None else now
-        self.total_path_status_count[status][path] += 1
-        self.rolling_5min_path_status_count[status][path] += 1
-        self.rolling_5min_deque.append((now, status, path))
+        self.update_many([access_log_record], now=now)
+
+    def update_many(self, access_log_records, now=None):
+        if not self.sampling_threshold_per_s:
+            self.merge(count_path_statuses(access_log_records), now=now)
+            return
+        now = self.clock() if now is None else now
+        step = self._update_sample_step(len(access_log_records), now)
+        if step == 1:
+            self.merge(count_path_statuses(access_log_records), now=now)
+            return
+        # systematic sampling that continues across batches;
+        # the offset is from the previous batch, which may have had a bigger step
+        offset = self._sample_offset % step
+        sampled = access_log_records[offset::step]
+        self._sample_offset = (offset - len(access_log_records)) % step
+        self.sampled_count += len(sampled)
+        skipped = len(access_log_records) - len(sampled)
+        self.skipped_count += skipped
+        self._rolling_5min_skipped.add('skipped', now, skipped)
+        self.merge(count_path_statuses(sampled, weight=step), now=now)
+
+    def update_batch(self, record_batch, now=None):
+        '''
+        Update from columnar RecordBatch (see columnar.parse_batch());
+        the batch is cheap to count, so it is never sampled.
+        '''
+        self.merge(record_batch.count_path_statuses(), now=now)
+
+    def _update_sample_step(self, record_count, now):
+        second = int(now)
+        if second != self._rate_second:
+            self._last_rate = self._rate_count if self._rate_second == second - 1 else 0
+            self._rate_second = second
+            self._rate_count = 0
+        self._rate_count += record_count
+        # the current second counts too, so that sampling starts as soon as a flood comes
+        rate = max(self._last_rate, self._rate_count)
+        threshold = self.sampling_threshold_per_s
+        step = 1 if rate <= threshold else int(-(-rate // threshold))
+        if step != self.sample_step:
+            logger.debug('Path stats sample step: %s (%s records/s)', step, rate)
+            self.sample_step = step
+        return step
+
+    def merge(self, path_status_count, now=None):
+        '''
+        Add counts pre-aggregated by count_path_statuses() (for example in a worker process)
+        '''
+        now = self.clock() if now is None else now
+        # expire old buckets first, so that new paths do not take over counts of expired ones
         self._roll(now)
-        self._compact(status=status)
+        for status, path_count in path_status_count.items():
+            self.total_path_status_count[status].update(path_count)
+            self.rolling_5min_path_status_count[status].add_counts(path_count, now)
 
     def _roll(self, now):
-        while self.rolling_5min_deque:
-            t, status, unified_path = self.rolling_5min_deque[0]
-            if t >= now - 300:
-                break
-            if self.rolling_5min_path_status_count[status][unified_path] > 0:
-                self.rolling_5min_path_status_count[status][unified_path] -= 1
-            self.rolling_5min_deque.popleft()
-
-    def _compact(self, status):
-        self.total_path_status_count[status] = cleanup_counter(self.total_path_status_count[status], 10000)
-        self.rolling_5min_path_status_count[status] = cleanup_counter(self.rolling_5min_path_status_count[status], 10000)
+        for rolling_counter in self.rolling_5min_path_status_count.values():
+            rolling_counter.roll(now)
+        self._rolling_5min_skipped.roll(now)
+
+    def get_version(self, now=None):
+        '''
+        Returns number that changes whenever the counts change
+        '''
+        now = self.clock() if now is None else now
+        self._roll(now)
+        return sum(c.version for c in self.rolling_5min_path_status_count.values())
 
     def get_report(self, now=None):
-        now = monotime() if now is None else now
+        now = self.clock() if now is None else now
         self._roll(now)
         report = OrderedDict()
         report['path_status_count'] = OrderedDict()
@@ -54,30 +147,87 @@ class PathStats:
             for path, count in path_count.most_common(5):
                 report['path_status_count']['total'][status][path] = count
 
-        for status, path_count in sorted(self.rolling_5min_path_status_count.items()):
+        for status, rolling_counter in sorted(self.rolling_5min_path_status_count.items()):
             assert status not in report['path_status_count']['last_5_min']
             report['path_status_count']['last_5_min'][status] = OrderedDict()
-            for path, count in path_count.most_common(5):
+            for path, count in rolling_counter.counts.most_common(5):
                 report['path_status_count']['last_5_min'][status][path] = count
 
+        if self.sampling_threshold_per_s:
+            report['path_status_count_sampling'] = OrderedDict()
+            # whether the path counts above are estimates
+            report['path_status_count_sampling']['estimated'] = OrderedDict()
+            report['path_status_count_sampling']['estimated']['total'] = self.skipped_count > 0
+            report['path_status_count_sampling']['estimated']['last_5_min'] = self._rolling_5min_skipped.counts['skipped'] > 0
+            report['path_status_count_sampling']['sample_step'] = self.sample_step
+            report['path_status_count_sampling']['sampled_records'] = self.sampled_count
+            report['path_status_count_sampling']['skipped_records'] = self.skipped_count
+
         return report
 
 
-def cleanup_counter(counter, size):
-    assert isinstance(counter, Counter)
-    if len(counter) < size * 1.5:
-        return counter
-    return Counter(dict(counter.most_common(size)))
+def count_path_statuses(access_log_records, weight=1):
+    '''
+    Returns dict status -> Counter(unified path -> count);
+    every record is counted weight times.
+    '''
+    path_status_count = defaultdict(Counter)
+    for access_log_record in access_log_records:
+        status = intern(str(access_log_record.status))
+        path_status_count[status][get_record_path(access_log_record)] += weight
+    return path_status_count
+
+
+def get_record_path(access_log_record):
+    '''
+    Returns unified path prefixed with host (if the log contains it)
+    '''
+    path = unify_path(access_log_record.path)
+    if access_log_record.host:
+        path = access_log_record.host + path
+    return path
+
+
+unify_path_cache_size = 8192
+
+lower_hex_chars = '0123456789abcdef'
+upper_hex_chars = '0123456789ABCDEF'
+digit_chars = '0123456789'
 
 
 def unify_path(path):
+    '''
+    Replace path segments that look like IDs with placeholders:
+    /campaigns/1234/templates -> /campaigns/<n>/templates
+    '''
     assert isinstance(path, str)
-    orig_path = path
-    path = path.split('?')[0]
-    path = re.sub(r'(/)[0-9a-f]{32}(/|$)', r'\1<uuid>\2', path)
-    path = re.sub(r'(/)[0-9A-F]{32}(/|$)', r'\1<UUID>\2', path)
-    path = re.sub(r'(/)[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}(/|$)', r'\1<uuid>\2', path)
-    path = re.sub(r'(/)[0-9A-F]{8}-[0-9A-F]{4}-[0-9A-F]{4}-[0-9A-F]{4}-[0-9A-F]{12}(/|$)', r'\1<UUID>\2', path)
-    path = re.sub(r'(/)[0-9]+(/|$)', r'\1<n>\2', path)
-    logger.debug('unify_path %r -> %r', orig_path, path)
-    return path
+    return _unify_path(path.partition('?')[0])
+
+
+def get_unify_path_cache_info():
+    '''
+    Returns named tuple (hits, misses, maxsize, currsize)
+    '''
+    return _unify_path.cache_info()
+
+
+@lru_cache(maxsize=unify_path_cache_size)
+def _unify_path(path):
+    return '/'.join(_unify_path_segment(segment) for segment in path.split('/'))
+
+
+def _unify_path_segment(segment):
+    length = len(segment)
+    if length == 32:
+        if not segment.strip(lower_hex_chars):
+            return '<uuid>'
+        if not segment.strip(upper_hex_chars):
+            return '<UUID>'
+    elif length == 36 and segment[8] == segment[13] == segment[18] == segment[23] == '-' and segment.count('-') == 4:
+        if not segment.strip(lower_hex_chars + '-'):
+            return '<uuid>'
+        if not segment.strip(upper_hex_chars + '-'):
+            return '<UUID>'
+    if segment and not segment.strip(digit_chars):
+        return '<n>'
+    return segment
@@ -0,0 +1,273 @@
+from collections import Counter, OrderedDict, deque
+from logging import getLogger
+from math import exp
+
+
+logger = getLogger(__name__)
+
+
+class RollingCounter:
+    '''
+    Counter of events in the last window_s seconds.
+
+    Events are counted in buckets of granularity_s seconds, so the memory
+    depends on the window length and the number of distinct keys, not on
+    the number of events. When the window rolls, the whole oldest bucket
+    is subtracted from the counts.
+
+    By default the counts and buckets are collections.Counter objects;
+    counter_factory and bucket_counter_factory can provide any Counter-like
+    objects, for example bounded SpaceSaving counters.
+
+    If bucket_capacity is set, a bucket holds at most bucket_capacity keys
+    (plus other_key): keys that do not fit are counted as other_key, in the
+    bucket and in the counts alike, so that they are subtracted correctly
+    when the bucket expires. The most frequent keys of add_counts() get the
+    free room first.
+    '''
+
+    def __init__(self, window_s=300, granularity_s=1, counter_factory=Counter, bucket_counter_factory=None,
+                 bucket_capacity=None, other_key=None):
+        assert window_s > 0 and granularity_s > 0
+        self.window_s = window_s
+        self.granularity_s = granularity_s
+        self.bucket_capacity = bucket_capacity
+        self.other_key = other_key
+        self.counts = counter_factory() # key -> count in the current window
+        self._bucket_counter_factory = bucket_counter_factory or counter_factory
+        self._buckets = deque() # [( bucket start time, Counter )]
+        # incremented whenever the counts change, so that users can cache
+        # anything computed from them
+        self.version = 0
+
+    def add(self, key, now, count=1):
+        bucket = self._get_bucket(now)
+        if self.bucket_capacity is not None and key not in bucket and len(bucket) >= self.bucket_capacity:
+            key = self.other_key
+        bucket[key] += count
+        self.counts[key] += count
+        self.version += 1
+
+    def add_counts(self, counts, now):
+        '''
+        Add counts from a Counter (or dict key -> count)
+        '''
+        bucket = self._get_bucket(now)
+        if self.bucket_capacity is not None and len(bucket) + len(counts) > self.bucket_capacity:
+            counts = self._cap_counts(bucket, counts)
+        for key, count in counts.items():
+            bucket[key] += count
+            self.counts[key] += count
+        self.version += 1
+
+    def _cap_counts(self, bucket, counts):
+        room = self.bucket_capacity - len(bucket)
+        capped = Counter()
+        for key, count in sorted(counts.items(), key=lambda item: -item[1]):
+            if key in bucket:
+                capped[key] += count
+            elif room > 0:
+                capped[key] += count
+                room -= 1
+            else:
+                capped[self.other_key] += count
+        return capped
+
+    def _get_bucket(self, now):
+        if self._buckets and now < self._buckets[-1][0] + self.granularity_s:
+            # current bucket (or time went back a little - count it into the latest bucket)
+            return self._buckets[-1][1]
+        bucket = self._bucket_counter_factory()
+        self._buckets.append((now - now % self.granularity_s, bucket))
+        return bucket
+
+    def roll(self, now):
+        counts = self.counts
+        # bounded counters (SpaceSaving) may overestimate a key by error(key) -
+        # a remainder within the error need not be any real events in the window
+        get_error = getattr(counts, 'error', None)
+        buckets = self._buckets
+        while buckets and buckets[0][0] < now - self.window_s:
+            bucket_start, bucket = buckets.popleft()
+            self.version += 1
+            for key, count in bucket.items():
+                remaining = counts[key] - count
+                if remaining > (get_error(key) if get_error else 0):
+                    counts[key] = remaining
+                else:
+                    del counts[key]
+
+
+def window_name(window_s):
+    '''
+    60 -> 'last_1_min', 3600 -> 'last_1_hour', 90 -> 'last_90_s'
+    '''
+    return 'last_' + _duration_name(window_s)
+
+
+def rate_name(time_constant_s):
+    '''
+    300 -> 'ewma_5_min'
+    '''
+    return 'ewma_' + _duration_name(time_constant_s)
+
+
+def _duration_name(duration_s):
+    if duration_s % 3600 == 0:
+        return '{}_hour'.format(int(duration_s // 3600))
+    if duration_s % 60 == 0:
+        return '{}_min'.format(int(duration_s // 60))
+    return '{:g}_s'.format(duration_s)
+
+
+class MultiWindowCounter:
+    '''
+    Counter of events in several windows (for example the last 1, 5, 15 and
+    60 minutes) and exponentially weighted moving rates of the events.
+
+    All of them are computed from a single deque of buckets of granularity_s
+    seconds covering the longest window, like in RollingCounter. Events are
+    counted only in the current bucket; a completed bucket is added to the
+    window counts and folded into the rates (the same way as the Unix load
+    average), so the work per event does not depend on the number of windows.
+    Every window remembers how many of the oldest buckets it has already
+    subtracted from its counts.
+    '''
+
+    def __init__(self, windows_s=(60, 300, 900, 3600), granularity_s=1, rate_time_constants_s=()):
+        assert windows_s and all(w > 0 for w in windows_s) and granularity_s > 0
+        self.granularity_s = granularity_s
+        self.max_window_s = max(windows_s)
+        # window_s -> key -> count in the completed buckets of the window (see get_counts())
+        self.window_counts = OrderedDict((w, Counter()) for w in sorted(set(windows_s)))
+        self.rates = OrderedDict((t, Counter()) for t in sorted(set(rate_time_constants_s))) # time constant -> key -> events/s
+        self._decays = {t: exp(-granularity_s / t) for t in self.rates}
+        self._buckets = deque() # [( bucket start time, Counter )]
+        self._current_bucket = None # the last bucket, if it is not completed yet
+        self._popped_count = 0 # number of buckets popped from self._buckets so far
+        self._window_starts = {w: 0 for w in self.window_counts} # window_s -> number of the oldest bucket counted
+        self._rates_mt = None # the rates are computed up to this time
+        # incremented whenever the counts change, so that users can cache
+        # anything computed from them
+        self.version = 0
+
+    def add(self, key, now, count=1):
+        bucket = self._get_bucket(now)
+        if bucket is not None:
+            bucket[key] += count
+        else:
+            self._add_late({key: count})
+        self.version += 1
+
+    def add_counts(self, counts, now):
+        '''
+        Add counts from a Counter (or dict key -> count)
+        '''
+        bucket = self._get_bucket(now)
+        if bucket is not None:
+            bucket.update(counts)
+        else:
+            self._add_late(counts)
+        self.version += 1
+
+    def get_counts(self, window_s):
+        '''
+        Returns Counter key -> count in the last window_s seconds (as of the last roll())
+        '''
+        counts = self.window_counts[window_s].copy()
+        if self._current_bucket:
+            counts.update(self._current_bucket)
+        return counts
+
+    def get_count(self, window_s, key):
+        '''
+        Same as get_counts(window_s)[key], without copying the counts
+        '''
+        count = self.window_counts[window_s].get(key, 0)
+        if self._current_bucket:
+            count += self._current_bucket.get(key, 0)
+        return count
+
+    def _get_bucket(self, now):
+        '''
+        Returns the current bucket, or None if the events belong to the latest
+        bucket and it has been completed already (see _add_late())
+        '''
+        if self._buckets and now < self._buckets[-1][0] + self.granularity_s:
+            # current bucket (or time went back a little - count it into the latest bucket)
+            return self._current_bucket
+        self._complete_bucket()
+        bucket = self._current_bucket = Counter()
+        self._buckets.append((now - now % self.granularity_s, bucket))
+        return bucket
+
+    def _add_late(self, counts):
+        '''
+        Count events into the latest bucket after it has been completed -
+        into the bucket itself (so that they are subtracted when it expires),
+        into the windows that have not subtracted it yet and into the rates.
+        '''
+        bucket_number = self._popped_count + len(self._buckets) - 1
+        self._buckets[-1][1].update(counts)
+        for window_s, window_counts in self.window_counts.items():
+            if self._window_starts[window_s] <= bucket_number:
+                window_counts.update(counts)
+        # the latest bucket is the last one folded into the rates
+        for time_constant_s, rates in self.rates.items():
+            decay = self._decays[time_constant_s]
+            for key, count in counts.items():
+                rates[key] += (1 - decay) * count / self.granularity_s
+
+    def _complete_bucket(self):
+        bucket = self._current_bucket
+        if bucket is None:
+            return
+        self._current_bucket = None
+        for window_counts in self.window_counts.values():
+            window_counts.update(bucket)
+        if self.rates:
+            bucket_start = self._buckets[-1][0]
+            # intervals between the previous bucket and this one had no events
+            empty_count = 0 if self._rates_mt is None else round((bucket_start - self._rates_mt) / self.granularity_s)
+            for time_constant_s, rates in self.rates.items():
+                decay = self._decays[time_constant_s]
+                factor = decay ** (empty_count + 1)
+                for key in rates:
+                    rates[key] *= factor
+                for key, count in bucket.items():
+                    rates[key] += (1 - decay) * count / self.granularity_s
+            self._rates_mt = bucket_start + self.granularity_s
+
+    def roll(self, now):
+        buckets = self._buckets
+        if self._current_bucket is not None and now >= buckets[-1][0] + self.granularity_s:
+            self._complete_bucket()
+        for window_s, counts in self.window_counts.items():
+            i = self._window_starts[window_s] - self._popped_count
+            while i < len(buckets) and buckets[i][0] < now - window_s and buckets[i][1] is not self._current_bucket:
+                self.version += 1
+                for key, count in buckets[i][1].items():
+                    remaining = counts[key] - count
+                    if remaining > 0:
+                        counts[key] = remaining
+                    else:
+                        del counts[key]
+                i += 1
+            self._window_starts[window_s] = i + self._popped_count
+        # the longest window has subtracted these buckets, so all the windows did
+        while buckets and buckets[0][0] < now - self.max_window_s and buckets[0][1] is not self._current_bucket:
+            buckets.popleft()
+            self._popped_count += 1
+
+    def get_rates(self, now):
+        '''
+        Returns dict time constant -> Counter key -> events per second
+        '''
+        self.roll(now)
+        if self._rates_mt is None:
+            return OrderedDict((t, Counter()) for t in self.rates)
+        # decay by the complete intervals without events since the last completed bucket
+        empty_count = max(0, int((now - self._rates_mt) // self.granularity_s))
+        return OrderedDict(
+            (t, Counter({key: rate * self._decays[t] ** empty_count for key, rate in rates.items()}))
+            for t, rates in self.rates.items())
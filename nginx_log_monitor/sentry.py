@@ -1,13 +1,152 @@
+'''
+Reporting of server errors (5xx) to Sentry.
+
+Records are aggregated by (status, host, unified path) over
+conf.sentry.aggregate_window_s and every aggregate is sent as a single
+event with the count and a few sample records. The events are limited
+by a token bucket, so a storm of 502s results in a few events, not in
+thousands of them.
+'''
+
+from asyncio import gather, sleep
+from collections import OrderedDict
 from logging import getLogger
+from time import monotonic as monotime
+
+from .path_stats import unify_path
 
 
 logger = getLogger(__name__)
 
+other_path = '<other>'
+
 
 async def report_to_sentry(conf, access_log_queue, sentry_client):
-    while True:
-        access_log_record = await access_log_queue.get()
-        if access_log_record.status >= 500:
-            await sentry_client.report(
-                dsn=conf.sentry.dsn,
-                event=str(access_log_record))
+    aggregator = ServerErrorAggregator(max_samples=conf.sentry.max_samples, max_aggregates=conf.sentry.max_aggregates)
+    rate_limiter = TokenBucket(rate_per_s=conf.sentry.rate_limit_per_minute / 60, burst=conf.sentry.rate_limit_burst)
+
+    async def collect():
+        # must be fast, so that the queue does not block log processing
+        while True:
+            access_log_records = await access_log_queue.get()
+            aggregator.add_many(access_log_records)
+
+    async def send():
+        while True:
+            await sleep(conf.sentry.aggregate_window_s)
+            await send_aggregated_events(conf, aggregator, rate_limiter, sentry_client)
+
+    await gather(collect(), send())
+
+
+async def send_aggregated_events(conf, aggregator, rate_limiter, sentry_client):
+    for aggregate in aggregator.pop_all():
+        if not rate_limiter.take():
+            aggregator.suppressed_count += 1
+            logger.debug('Sentry event suppressed by rate limit: %s', aggregate.get_message())
+            continue
+        event = aggregate.get_event(window_s=conf.sentry.aggregate_window_s, suppressed_count=aggregator.suppressed_count)
+        aggregator.suppressed_count = 0
+        await sentry_client.report(dsn=conf.sentry.dsn, event=event)
+
+
+class ServerErrorAggregate:
+
+    def __init__(self, status, host, path):
+        self.status = status
+        self.host = host
+        self.path = path
+        self.count = 0
+        self.samples = []
+
+    def get_message(self):
+        return '{count}x {status} {host}{path}'.format(
+            count=self.count, status=self.status, host=self.host or '', path=self.path)
+
+    def get_event(self, window_s, suppressed_count=0):
+        return {
+            'message': self.get_message(),
+            'level': 'error',
+            'logger': __name__,
+            'fingerprint': ['nginx-server-error', str(self.status), self.host or '', self.path],
+            'tags': {
+                'status': str(self.status),
+                'host': self.host or '',
+                'path': self.path,
+            },
+            'extra': {
+                'count': self.count,
+                'window_s': window_s,
+                'samples': self.samples,
+                'suppressed_events': suppressed_count,
+            },
+        }
+
+
+class ServerErrorAggregator:
+    '''
+    Counts records with status >= 500 by (status, host, unified path)
+    and keeps the first max_samples of them.
+
+    Only the first max_aggregates keys get their own aggregate; records of
+    any further keys are counted under (status, None, '<other>'), so that
+    a storm of errors on random paths does not take unbounded memory.
+    '''
+
+    def __init__(self, max_samples=5, max_aggregates=100):
+        self.max_samples = max_samples
+        self.max_aggregates = max_aggregates
+        self.aggregates = OrderedDict() # (status, host, path) -> ServerErrorAggregate
+        # events not sent because of the rate limit since the last sent event
+        self.suppressed_count = 0
+
+    def add_many(self, access_log_records):
+        for access_log_record in access_log_records:
+            if access_log_record.status is None or access_log_record.status < 500:
+                continue
+            key = (access_log_record.status, access_log_record.host, unify_path(access_log_record.path))
+            aggregate = self.aggregates.get(key)
+            if aggregate is None and len(self.aggregates) >= self.max_aggregates:
+                key = (access_log_record.status, None, other_path)
+                aggregate = self.aggregates.get(key)
+            if aggregate is None:
+                aggregate = self.aggregates[key] = ServerErrorAggregate(*key)
+            aggregate.count += 1
+            if len(aggregate.samples) < self.max_samples:
+                aggregate.samples.append(_record_sample(access_log_record))
+
+    def pop_all(self):
+        '''
+        Returns aggregates collected so far, the most frequent first, and starts anew
+        '''
+        aggregates = sorted(self.aggregates.values(), key=lambda a: -a.count)
+        self.aggregates = OrderedDict()
+        return aggregates
+
+
+def _record_sample(access_log_record):
+    return OrderedDict(
+        (name, value if value is None or isinstance(value, (int, float)) else str(value))
+        for name, value in access_log_record.as_dict().items())
+
+
+class TokenBucket:
+    '''
+    Allows burst events at once and rate_per_s events per second on average.
+    '''
+
+    def __init__(self, rate_per_s, burst):
+        self.rate_per_s = rate_per_s
+        self.burst = burst
+        self.tokens = burst
+        self._last_mt = None
+
+    def take(self, now=None):
+        now = monotime() if now is None else now
+        if self._last_mt is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self._last_mt) * self.rate_per_s)
+        self._last_mt = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
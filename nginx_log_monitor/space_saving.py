@@ -0,0 +1,150 @@
+'''
+Bounded counter for finding the most frequent keys (heavy hitters),
+using the Space-Saving algorithm:
+
+    Metwally, Agrawal, El Abbadi: Efficient Computation of Frequent and
+    Top-k Elements in Data Streams (2005)
+
+At most `capacity` keys are monitored. When a new key arrives and there is
+no free room, the key with the smallest count is evicted and the new key
+takes over its count. Error bounds, with N being the sum of all counts added:
+
+- a reported count is never lower than the true count, and it is higher
+  by at most error(key) <= min count <= N / capacity
+- every key whose true count is greater than N / capacity is monitored,
+  so most_common(n) does not miss any such key
+'''
+
+from heapq import nlargest
+from operator import itemgetter
+
+
+class SpaceSaving:
+    '''
+    Counter-like object with bounded memory.
+
+    Use it like collections.Counter: c[key] += 1, c[key], del c[key],
+    c.update(mapping), c.most_common(n). Assigning to a key that is not
+    monitored means incrementing it from zero (the Space-Saving insert).
+
+    Counts are kept also grouped by value, so that the key with the
+    smallest count is found in O(1) and adding 1 is O(1).
+    '''
+
+    # when the minimum count is removed, look for the next one at most
+    # this far before falling back to recomputing it from scratch
+    min_count_scan_limit = 16
+
+    def __init__(self, capacity):
+        assert capacity > 0
+        self.capacity = capacity
+        self._counts = {} # key -> count
+        self._errors = {} # key -> possible overestimation of the count
+        self._keys_by_count = {} # count -> set of keys
+        self._min_count = None # None if not known (needs to be recomputed)
+
+    def __repr__(self):
+        return '<{cls} capacity={s.capacity} len={n}>'.format(cls=self.__class__.__name__, s=self, n=len(self))
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __iter__(self):
+        return iter(self._counts)
+
+    def __contains__(self, key):
+        return key in self._counts
+
+    def __getitem__(self, key):
+        return self._counts.get(key, 0)
+
+    def __setitem__(self, key, count):
+        counts = self._counts
+        old_count = counts.get(key)
+        if old_count is None:
+            if len(counts) >= self.capacity:
+                min_count = self._get_min_count()
+                self._evict(min_count)
+                count += min_count
+                self._errors[key] = min_count
+        else:
+            self._unlink(key, old_count)
+        if count <= 0:
+            if old_count is not None:
+                del counts[key]
+                self._errors.pop(key, None)
+                if old_count == self._min_count and old_count not in self._keys_by_count:
+                    self._min_count = None
+            return
+        counts[key] = count
+        keys = self._keys_by_count.get(count)
+        if keys is None:
+            keys = self._keys_by_count[count] = set()
+        keys.add(key)
+        min_count = self._min_count
+        if min_count is None:
+            if old_count is None and len(counts) == 1:
+                self._min_count = count
+        elif count < min_count:
+            self._min_count = count
+        elif min_count not in self._keys_by_count:
+            # the key was the last one with the minimum count
+            self._min_count = self._find_min_count(min_count + 1, count)
+
+    def __delitem__(self, key):
+        # like Counter, does not raise KeyError for missing keys
+        count = self._counts.pop(key, None)
+        if count is not None:
+            self._errors.pop(key, None)
+            self._unlink(key, count)
+            if count == self._min_count and count not in self._keys_by_count:
+                self._min_count = None
+
+    def _unlink(self, key, count):
+        keys = self._keys_by_count[count]
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_count[count]
+
+    def _evict(self, min_count):
+        keys = self._keys_by_count[min_count]
+        key = keys.pop()
+        if not keys:
+            # self._min_count is updated in __setitem__
+            del self._keys_by_count[min_count]
+        del self._counts[key]
+        self._errors.pop(key, None)
+
+    def _find_min_count(self, start, stop):
+        if stop - start < self.min_count_scan_limit:
+            for c in range(start, stop + 1):
+                if c in self._keys_by_count:
+                    return c
+        return None
+
+    def _get_min_count(self):
+        if self._min_count is None:
+            self._min_count = min(self._keys_by_count)
+        return self._min_count
+
+    def error(self, key):
+        '''
+        How much the count of given key may be overestimated
+        '''
+        return self._errors.get(key, 0)
+
+    def keys(self):
+        return self._counts.keys()
+
+    def values(self):
+        return self._counts.values()
+
+    def items(self):
+        return self._counts.items()
+
+    def update(self, counts):
+        for key, count in counts.items():
+            self[key] += count
+
+    def most_common(self, n):
+        return nlargest(n, self._counts.items(), key=itemgetter(1))
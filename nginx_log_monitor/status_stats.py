@@ -1,9 +1,11 @@
 from asyncio import Event
-from collections import OrderedDict, Counter, deque
+from collections import OrderedDict, Counter
 from logging import getLogger
 from sys import intern
 from time import monotonic as monotime
 
+from .rolling_counter import MultiWindowCounter, window_name, rate_name
+
 
 logger = getLogger(__name__)
 
@@ -13,50 +15,85 @@ server_error_status_codes = '500 502 503 504'.split()
 
 assert set(basic_status_codes) >= set(server_error_status_codes)
 
+status_classes = '1xx 2xx 3xx 4xx 5xx'.split()
+
+default_windows_s = (60, 300, 900, 3600)
+
+default_rate_time_constants_s = (60, 300, 900)
+
 
 class StatusStats:
+    '''
+    Counts of the statuses in total and in the last windows_s seconds
+    (the last 5 minutes are always counted) and exponentially weighted
+    moving rates of requests per status class.
+    '''
 
-    def __init__(self):
+    def __init__(self, granularity_s=1, windows_s=default_windows_s, rate_time_constants_s=default_rate_time_constants_s,
+                 clock=monotime):
+        self.clock = clock
         self.total_status_count = Counter()
-        self.rolling_5min_status_count = Counter()
-        self.rolling_5min_deque = deque()
+        self.rolling = MultiWindowCounter(
+            windows_s=set(windows_s) | {300},
+            granularity_s=granularity_s,
+            rate_time_constants_s=rate_time_constants_s)
         self.have_5xx = Event()
         for status in sorted(basic_status_codes):
             status = intern(str(status))
             self.total_status_count[status] = 0
-            self.rolling_5min_status_count[status] = 0
 
     def update(self, access_log_record, now=None):
-        status = intern(str(access_log_record.status))
-        now = monotime() if now is None else now
-        self.total_status_count[status] += 1
-        self.rolling_5min_status_count[status] += 1
-        self.rolling_5min_deque.append((now, status))
+        self.update_many([access_log_record], now=now)
+
+    def update_many(self, access_log_records, now=None):
+        self.merge(count_statuses(access_log_records), now=now)
+
+    def update_batch(self, record_batch, now=None):
+        '''
+        Update from columnar RecordBatch (see columnar.parse_batch())
+        '''
+        self.merge(record_batch.count_statuses(), now=now)
+
+    def merge(self, status_count, now=None):
+        '''
+        Add counts pre-aggregated by count_statuses() (for example in a worker process)
+        '''
+        now = self.clock() if now is None else now
+        self.total_status_count.update(status_count)
+        self.rolling.add_counts(status_count, now)
         self._roll(now)
 
+    @property
+    def rolling_5min_status_count(self):
+        return self.rolling.get_counts(300)
+
     def _roll(self, now):
-        while self.rolling_5min_deque:
-            t, status = self.rolling_5min_deque[0]
-            if t >= now - 300:
-                break
-            self.rolling_5min_status_count[status] -= 1
-            assert self.rolling_5min_status_count[status] >= 0
-            self.rolling_5min_deque.popleft()
-        if any(self.rolling_5min_status_count[status] > 0 for status in server_error_status_codes):
+        self.rolling.roll(now)
+        if any(self.rolling.get_count(300, status) > 0 for status in server_error_status_codes):
             self.have_5xx.set()
         else:
             self.have_5xx.clear()
 
+    def get_version(self, now=None):
+        '''
+        Returns number that changes whenever the counts change
+        '''
+        now = self.clock() if now is None else now
+        self._roll(now)
+        return self.rolling.version
+
     def get_report(self, now=None):
-        now = monotime() if now is None else now
+        now = self.clock() if now is None else now
         self._roll(now)
         report = OrderedDict()
         report['status_count'] = OrderedDict()
         report['status_count']['total'] = OrderedDict()
         report['status_count']['last_5_min'] = OrderedDict()
+        rolling_5min_status_count = self.rolling_5min_status_count
         for status, count in sorted(self.total_status_count.items()):
             report['status_count']['total'][status] = count
-        for status, count in sorted(self.rolling_5min_status_count.items()):
+        for status in sorted(self.total_status_count.keys()):
+            count = rolling_5min_status_count[status]
             if status in server_error_status_codes:
                 report['status_count']['last_5_min'][status] = {
                     '__value': count,
@@ -66,4 +103,23 @@ class StatusStats:
                 }
             else:
                 report['status_count']['last_5_min'][status] = count
+        for window_s in self.rolling.window_counts:
+            if window_s != 300:
+                window_counts = self.rolling.get_counts(window_s)
+                report['status_count'][window_name(window_s)] = OrderedDict(
+                    (status, window_counts[status]) for status in sorted(self.total_status_count.keys()))
+        if self.rolling.rates:
+            report['request_rate_per_s'] = OrderedDict()
+            for time_constant_s, rates in self.rolling.get_rates(now).items():
+                class_rates = Counter()
+                for status, rate in rates.items():
+                    class_rates[status[:1] + 'xx'] += rate
+                rate_report = report['request_rate_per_s'][rate_name(time_constant_s)] = OrderedDict()
+                rate_report['all'] = round(sum(class_rates.values()), 3)
+                for status_class in status_classes:
+                    rate_report[status_class] = round(class_rates[status_class], 3)
         return report
+
+
+def count_statuses(access_log_records):
+    return Counter(intern(str(access_log_record.status)) for access_log_record in access_log_records)
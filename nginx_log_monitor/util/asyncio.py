@@ -11,18 +11,106 @@ def run_polyfill(f):
     loop.run_until_complete(f)
 
 
+# overflow policies of PubSub subscribers
+block = 'block' # wait until there is space in the queue - no data is lost
+drop_oldest = 'drop_oldest' # remove the oldest item to make space for the new one
+drop_newest = 'drop_newest' # do not add the new item
+sample = 'sample' # when the queue is more than half full, add only every sample_every-th item
+
+overflow_policies = (block, drop_oldest, drop_newest, sample)
+
+
+class SubscriberQueue (Queue):
+    '''
+    Queue returned by PubSub.subscribe(); counts the dropped items
+    and the highest queue size seen (high water mark).
+    '''
+
+    def __init__(self, maxsize=0, name=None, policy=block, sample_every=10):
+        assert policy in overflow_policies, policy
+        super().__init__(maxsize)
+        self.name = name
+        self.policy = policy
+        self.sample_every = sample_every
+        self.dropped_count = 0 # number of dropped items (records for batches)
+        self.high_water_mark = 0
+        self._sample_counter = 0
+
+    async def publish(self, item, weight=1):
+        '''
+        Add item according to the policy; only the block policy can wait.
+        weight is the number of items the item represents (for dropped_count).
+        '''
+        if self.policy == block:
+            await self.put(item)
+        elif self.policy == sample and self.maxsize > 0 and self.qsize() * 2 >= self.maxsize:
+            self._sample_counter += 1
+            if self._sample_counter % self.sample_every == 0 and not self.full():
+                self.put_nowait(item)
+            else:
+                self.dropped_count += weight
+        elif self.full():
+            if self.policy == drop_oldest:
+                dropped = self.get_nowait()
+                self.dropped_count += len(dropped) if isinstance(dropped, list) else 1
+                self.put_nowait(item)
+            else:
+                self.dropped_count += weight
+        else:
+            self.put_nowait(item)
+        if self.qsize() > self.high_water_mark:
+            self.high_water_mark = self.qsize()
+
+
 class PubSub:
+    '''
+    Every item put is delivered to all subscriber queues.
+
+    Each subscriber chooses what happens when its queue is full: critical
+    consumers use the block policy (the publisher waits, nothing is lost),
+    best-effort ones drop or sample items, so they never slow down the publisher.
+    '''
 
     def __init__(self, maxsize=0):
-        self.queues = WeakSet()
+        self.queues = WeakSet() # SubscriberQueue
         self.maxsize = maxsize
 
-    def subscribe(self):
-        q = Queue(self.maxsize)
+    def subscribe(self, name=None, policy=block, sample_every=10):
+        q = SubscriberQueue(
+            self.maxsize,
+            name=name or 'subscriber{}'.format(len(self.queues)),
+            policy=policy,
+            sample_every=sample_every)
         self.queues.add(q)
         return q
 
-    async def put(self, item):
-        for q in self.queues:
-            await q.put(item)
+    def get_queue_sizes(self):
+        '''
+        Returns dict subscriber name -> number of items waiting in its queue
+        '''
+        return {q.name: q.qsize() for q in list(self.queues)}
+
+    def get_subscriber_stats(self):
+        '''
+        Returns dict subscriber name -> dict with policy, size, high_water_mark, dropped
+        '''
+        return {
+            q.name: {
+                'policy': q.policy,
+                'size': q.qsize(),
+                'high_water_mark': q.high_water_mark,
+                'dropped': q.dropped_count,
+            } for q in list(self.queues)}
+
+    async def put(self, item, weight=1):
+        for q in list(self.queues):
+            await q.publish(item, weight)
 
+    async def put_batch(self, items):
+        '''
+        Publish a list of items as a single queue item, so that subscribers
+        can process the whole batch at once. All subscribers receive the same
+        list object - it must not be modified.
+        '''
+        if items:
+            await self.put(items, weight=len(items))
@@ -0,0 +1,33 @@
+from logging import getLogger
+import os
+
+
+logger = getLogger(__name__)
+
+
+def write_file_atomic(path, data):
+    '''
+    Write data (bytes) to a temporary file, fsync it and rename it to path,
+    so that the file contains either the old or the new data even after a crash.
+    '''
+    tmp_path = path.with_name(path.name + '.tmp')
+    with tmp_path.open('wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(str(tmp_path), str(path))
+    fsync_dir(path.parent)
+
+
+def fsync_dir(path):
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError as e:
+        logger.debug('Cannot open directory %s for fsync: %r', path, e)
+        return
+    try:
+        os.fsync(fd)
+    except OSError as e:
+        logger.debug('Cannot fsync directory %s: %r', path, e)
+    finally:
+        os.close(fd)
@@ -0,0 +1,115 @@
+'''
+Opt-in multi-process ingestion (configuration option `workers`).
+
+Chunks of lines are sent to worker processes that parse them and
+pre-aggregate the records into partial stats (see PartialStats).
+The main process only merges the partial results into StatusStats,
+PathStats and LatencyStats, so parsing is not limited to a single CPU core.
+'''
+
+from asyncio import Queue, get_event_loop
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from logging import getLogger
+from time import monotonic as monotime
+
+from .access_log_parser import AccessLogParser, parse_log_line
+from .aggregation import count_aggregations
+from .latency_stats import count_latencies
+from .path_stats import count_path_statuses
+from .status_stats import count_statuses
+
+
+logger = getLogger(__name__)
+
+
+class PartialStats:
+    '''
+    Result of parse_lines() - must be picklable.
+    '''
+
+    def __init__(self, status_count, path_status_count, server_error_records, line_count, failed_count,
+                 latency_count=None, error_count=None, parse_duration_s=0, aggregation_count=None):
+        self.status_count = status_count
+        self.path_status_count = path_status_count
+        self.latency_count = latency_count or {}
+        self.aggregation_count = aggregation_count or [] # see count_aggregations()
+        # records with status >= 500 go to Sentry
+        self.server_error_records = server_error_records
+        self.line_count = line_count
+        self.failed_count = failed_count
+        self.error_count = error_count or Counter() # error name -> count
+        self.parse_duration_s = parse_duration_s
+
+
+_parsers = {} # (path, log_format) -> AccessLogParser; lives in the worker process
+
+
+def parse_lines(path, log_format, data, aggregation_views=()):
+    '''
+    Runs in the worker process.
+    Parses lines (bytes joined by newlines) and aggregates them to PartialStats.
+    '''
+    parser = _parsers.get((path, log_format))
+    if parser is None:
+        parser = _parsers[(path, log_format)] = AccessLogParser(log_format)
+    t0 = monotime()
+    lines = data.split(b'\n')
+    access_log_records = []
+    error_count = Counter()
+    for line in lines:
+        access_log_record = parse_log_line(parser, line, error_count)
+        if access_log_record is not None:
+            access_log_records.append(access_log_record)
+    parse_duration_s = monotime() - t0
+    return PartialStats(
+        status_count=count_statuses(access_log_records),
+        path_status_count=dict(count_path_statuses(access_log_records)),
+        latency_count=count_latencies(access_log_records),
+        aggregation_count=count_aggregations(access_log_records, aggregation_views) if aggregation_views else None,
+        server_error_records=[r for r in access_log_records if r.status and r.status >= 500],
+        line_count=len(lines),
+        failed_count=len(lines) - len(access_log_records),
+        error_count=error_count,
+        parse_duration_s=parse_duration_s)
+
+
+class WorkerPool:
+    '''
+    Call submit() with lines as they are read and run merge_results()
+    as a task; the partial results are passed to merge_partial_stats
+    (a coroutine function) in the same order as the lines were submitted.
+    '''
+
+    chunk_lines = 10000
+
+    def __init__(self, workers, aggregation_views=()):
+        assert workers > 0
+        self.workers = workers
+        self.aggregation_views = [tuple(view) for view in aggregation_views]
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+        # limits how many chunks can be in flight
+        self.pending = Queue(workers * 2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    async def submit(self, path, log_format, lines):
+        loop = get_event_loop()
+        for i in range(0, len(lines), self.chunk_lines):
+            data = b'\n'.join(lines[i:i + self.chunk_lines])
+            future = loop.run_in_executor(
+                self._executor, parse_lines, str(path), log_format, data, self.aggregation_views)
+            await self.pending.put(future)
+
+    async def merge_results(self, merge_partial_stats):
+        while True:
+            future = await self.pending.get()
+            partial_stats = await future
+            await merge_partial_stats(partial_stats)
@@ -1,3 +1,33 @@
-from pytest import mark
+from aiohttp import ClientSession
+from pytest import mark, raises
 
 from nginx_log_monitor.clients import OverwatchClient
+from nginx_log_monitor.clients.overwatch_client import OverwatchClientReportError
+
+
+sample_report = {
+    'label': {'agent': 'nginx_log_monitor'},
+    'state': {'path_status_count': {'total': {'200': {'/api/items/{}'.format(i): 10 for i in range(100)}}}},
+}
+
+
+@mark.asyncio
+async def test_send_report_compressed(overwatch_server):
+    async with overwatch_server, ClientSession() as session:
+        client = OverwatchClient(session, report_url=overwatch_server.url, report_token='t0ken', compress=True)
+        await client.send_report(sample_report)
+        compressed_bytes = overwatch_server.payload_bytes
+        client.compress = False
+        await client.send_report(sample_report)
+    assert overwatch_server.request_count == 2
+    assert overwatch_server.reports == [sample_report, sample_report]
+    assert compressed_bytes * 2 < overwatch_server.payload_bytes - compressed_bytes
+
+
+@mark.asyncio
+async def test_send_report_failure(overwatch_server):
+    overwatch_server.fail = True
+    async with overwatch_server, ClientSession() as session:
+        client = OverwatchClient(session, report_url=overwatch_server.url, report_token='t0ken')
+        with raises(OverwatchClientReportError):
+            await client.send_report(sample_report)
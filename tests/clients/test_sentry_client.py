@@ -0,0 +1,37 @@
+from pytest import mark, raises
+from time import sleep
+
+from nginx_log_monitor.clients import SentryClient
+from nginx_log_monitor.clients import sentry_client
+
+
+class FakeSentrySdkClient:
+
+    def __init__(self, close_duration_s=0):
+        self.close_duration_s = close_duration_s
+        self.closed = False
+
+    def close(self):
+        sleep(self.close_duration_s)
+        self.closed = True
+
+
+@mark.asyncio
+async def test_sentry_client_close_shuts_down_executor():
+    client = SentryClient()
+    sdk_client = client._clients_by_dsn['https://key@sentry.example.com/1'] = FakeSentrySdkClient()
+    await client.close()
+    assert sdk_client.closed
+    with raises(RuntimeError):
+        client._executor.submit(print)
+
+
+@mark.asyncio
+async def test_sentry_client_close_does_not_wait_too_long(monkeypatch):
+    monkeypatch.setattr(sentry_client, 'close_timeout_s', 0.05)
+    client = SentryClient()
+    sdk_client = client._clients_by_dsn['https://key@sentry.example.com/1'] = FakeSentrySdkClient(close_duration_s=0.5)
+    await client.close()
+    assert not sdk_client.closed
+    with raises(RuntimeError):
+        client._executor.submit(print)
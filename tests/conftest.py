@@ -9,3 +9,47 @@ getLogger('').setLevel(DEBUG)
 @fixture
 def temp_dir(tmpdir):
     return Path(str(tmpdir))
+
+
+class OverwatchServerStandIn:
+    '''
+    Stand-in for the Overwatch report endpoint; measures the number of
+    requests and the payload size. Use as async context manager.
+    '''
+
+    def __init__(self):
+        self.request_count = 0
+        self.payload_bytes = 0
+        self.reports = []
+        self.fail = False
+        self.url = None
+        self._runner = None
+
+    async def __aenter__(self):
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_post('/report', self._handle_report)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.url = 'http://127.0.0.1:{}/report'.format(self._runner.addresses[0][1])
+        return self
+
+    async def __aexit__(self, *args):
+        await self._runner.cleanup()
+
+    async def _handle_report(self, request):
+        from aiohttp import web
+        # aiohttp decompresses the body, so the payload size is taken from the header
+        self.request_count += 1
+        self.payload_bytes += int(request.headers['Content-Length'])
+        if self.fail:
+            return web.json_response({'error': 'unavailable'}, status=503)
+        self.reports.append(await request.json())
+        return web.json_response({'ok': True})
+
+
+@fixture
+def overwatch_server():
+    return OverwatchServerStandIn()
@@ -0,0 +1,92 @@
+from pytest import raises
+
+from nginx_log_monitor.access_log_parser import AccessLogParser, AccessLogRecord
+from nginx_log_monitor.aggregation import AggregationStats, count_aggregations
+from nginx_log_monitor.configuration import Configuration
+from nginx_log_monitor.worker_pool import parse_lines
+
+
+mk_rec = lambda data: AccessLogRecord(data.get)
+
+records = [
+    mk_rec({'host': 'example.com', 'method': 'GET', 'path': '/item/1', 'status': '200', 'body_bytes_sent': '100', 'upstream_addr': '10.0.0.1:8080'}),
+    mk_rec({'host': 'example.com', 'method': 'GET', 'path': '/item/2', 'status': '200', 'body_bytes_sent': '50', 'upstream_addr': '10.0.0.1:8080'}),
+    mk_rec({'host': 'example.com', 'method': 'POST', 'path': '/login', 'status': '502', 'body_bytes_sent': '10', 'upstream_addr': '10.0.0.2:8080'}),
+    mk_rec({'host': 'example.net', 'method': 'GET', 'path': '/', 'status': '404', 'body_bytes_sent': '0', 'upstream_addr': '-'}),
+]
+
+
+def test_aggregation_stats():
+    s = AggregationStats({
+        'host_status': ['host', 'status_class'],
+        'upstream': ['upstream', 'status_class'],
+        'path': ['method', 'path'],
+    })
+    s.update_many(records, now=100)
+    report = s.get_report(now=100)['aggregations']
+    assert report['host_status']['dimensions'] == ['host', 'status_class']
+    assert report['host_status']['total'] == [
+        {'host': 'example.com', 'status_class': '2xx', 'requests': 2, 'body_bytes_sent': 150},
+        {'host': 'example.com', 'status_class': '5xx', 'requests': 1, 'body_bytes_sent': 10},
+        {'host': 'example.net', 'status_class': '4xx', 'requests': 1, 'body_bytes_sent': 0},
+    ]
+    assert report['upstream']['total'][0] == {'upstream': '10.0.0.1:8080', 'status_class': '2xx', 'requests': 2, 'body_bytes_sent': 150}
+    assert report['path']['total'][0] == {'method': 'GET', 'path': '/item/<n>', 'requests': 2, 'body_bytes_sent': 150}
+    assert report['path']['last_5_min'] == report['path']['total']
+    report = s.get_report(now=500)['aggregations']
+    assert report['path']['last_5_min'] == []
+    assert len(report['path']['total']) == 3
+
+
+def test_aggregation_cardinality_cap():
+    s = AggregationStats({'host': ['host', 'method']}, max_cardinality={'host': 2})
+    s.update_many([mk_rec({'host': 'h{}'.format(i), 'method': 'GET', 'status': '200'}) for i in range(10)], now=100)
+    s.update_many([mk_rec({'host': 'h1', 'method': 'GET', 'status': '200'})], now=100)
+    rows = s.get_report(now=100)['aggregations']['host']['total']
+    assert [(row['host'], row['requests']) for row in rows] == [('<other>', 8), ('h1', 2), ('h0', 1)]
+
+
+def test_aggregation_readmits_frequent_values_after_scan():
+    s = AggregationStats({'host': ['host']}, max_cardinality={'host': 1})
+    # a scan at startup takes the only slot
+    s.update_many([mk_rec({'host': 'scan{}'.format(i), 'status': '200'}) for i in range(10)], now=100)
+    for t in range(100, 400, 10):
+        s.update_many([mk_rec({'host': 'example.com', 'status': '200'})] * 5, now=t)
+    rows = s.get_report(now=400)['aggregations']['host']['total']
+    assert [(row['host'], row['requests']) for row in rows] == [('<other>', 159), ('scan0', 1)]
+    # after readmit_interval_s the frequent value gets its own row
+    s.update_many([mk_rec({'host': 'example.com', 'status': '200'})] * 5, now=400)
+    rows = s.get_report(now=400)['aggregations']['host']['total']
+    assert [(row['host'], row['requests']) for row in rows] == [('<other>', 160), ('example.com', 5)]
+
+
+def test_aggregation_merge_same_as_update_many():
+    views = {'a': ['host', 'status'], 'b': ['path']}
+    s1, s2 = AggregationStats(views), AggregationStats(views)
+    s1.update_many(records, now=100)
+    s2.merge(count_aggregations(records[:2], s2.views), now=100)
+    s2.merge(count_aggregations(records[2:], s2.views), now=100)
+    assert s1.get_report(now=100) == s2.get_report(now=100)
+
+
+def test_upstream_addr_parsing_and_worker_aggregation():
+    log_format = '$remote_addr - $remote_user [$time_local] "$request" $status $body_bytes_sent $upstream_addr'
+    line = b'1.2.3.4 - - [04/Feb/2020:11:02:10 +0000] "GET /foo HTTP/1.1" 200 396 127.0.0.1:8000'
+    assert AccessLogParser(log_format).parse(line.decode()).upstream_addr == '127.0.0.1:8000'
+    partial = parse_lines('access.log', log_format, line, aggregation_views=[('upstream',)])
+    assert partial.aggregation_count == [{('requests', ('127.0.0.1:8000',)): 1, ('body_bytes_sent', ('127.0.0.1:8000',)): 396}]
+
+
+def test_aggregation_configuration(temp_dir):
+    cfg_path = temp_dir / 'conf.yaml'
+    cfg_path.write_text(
+        'aggregations:\n'
+        '  host_status: [host, status_class]\n'
+        'aggregation_max_cardinality:\n'
+        '  host: 10\n')
+    conf = Configuration(cfg_path=cfg_path)
+    assert conf.aggregations == {'host_status': ['host', 'status_class']}
+    assert conf.aggregation_max_cardinality == {'host': 10}
+    cfg_path.write_text('aggregations:\n  x: [foo]\n')
+    with raises(ValueError):
+        Configuration(cfg_path=cfg_path)
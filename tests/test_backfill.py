@@ -0,0 +1,50 @@
+import gzip
+from os import utime
+
+from nginx_log_monitor.backfill import backfill, find_backfill_paths, read_line_batches
+from nginx_log_monitor.path_stats import PathStats
+from nginx_log_monitor.status_stats import StatusStats
+
+
+sample_line = '1.2.3.4 - - [04/Feb/2020:11:02:10 +0000] "GET /{i} HTTP/1.1" {status} 396 "-" "Mozilla/5.0"\n'
+
+
+def test_read_line_batches(temp_dir):
+    (temp_dir / 'empty.log').write_bytes(b'')
+    (temp_dir / 'plain.log').write_bytes(b'line1\nline2\nlast')
+    with gzip.open(str(temp_dir / 'compressed.log.gz'), 'wb') as f:
+        f.write(b'line1\nline2\n')
+    assert list(read_line_batches(temp_dir / 'empty.log')) == []
+    assert list(read_line_batches(temp_dir / 'plain.log')) == [[b'line1', b'line2'], [b'last']]
+    assert [line for lines in read_line_batches(temp_dir / 'plain.log', chunk_size=3) for line in lines] == [b'line1', b'line2', b'last']
+    assert list(read_line_batches(temp_dir / 'compressed.log.gz')) == [[b'line1', b'line2']]
+
+
+def test_find_backfill_paths(temp_dir):
+    names = [
+        'access.log-20200203.gz', 'access.log.2.gz', 'access.log.1', 'access.log',
+        'other.log', 'access.log.tmp', 'access.log.bak', 'access.log.1.json', 'access.logs.1']
+    for n, name in enumerate(names):
+        (temp_dir / name).write_text('')
+        utime(str(temp_dir / name), (1000 + n, 1000 + n))
+    assert [p.name for p in find_backfill_paths(temp_dir / 'access.log')] == [
+        'access.log-20200203.gz', 'access.log.2.gz', 'access.log.1', 'access.log']
+
+
+def test_backfill(temp_dir):
+    with gzip.open(str(temp_dir / 'access.log.2.gz'), 'wt') as f:
+        f.write(''.join(sample_line.format(i=i, status=200) for i in range(1000)))
+    (temp_dir / 'access.log.1').write_text(''.join(sample_line.format(i=i, status=404) for i in range(500)))
+    (temp_dir / 'access.log').write_text(sample_line.format(i=1, status=502) + 'garbage\n')
+    status_stats = StatusStats()
+    path_stats = PathStats()
+    paths = [temp_dir / 'access.log.2.gz', temp_dir / 'access.log.1', temp_dir / 'access.log']
+    result = backfill(paths, lambda p: None, [status_stats, path_stats])
+    assert result.file_count == 3
+    assert result.line_count == 1502
+    assert result.record_count == 1501
+    assert 'lines/s' in str(result)
+    assert status_stats.total_status_count['200'] == 1000
+    assert status_stats.total_status_count['404'] == 500
+    assert status_stats.total_status_count['502'] == 1
+    assert path_stats.total_path_status_count['404']['/<n>'] == 500
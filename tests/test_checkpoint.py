@@ -0,0 +1,79 @@
+from os import stat
+
+from nginx_log_monitor.checkpoint import CheckpointStore
+from nginx_log_monitor.file_reader import FileReader
+
+
+def test_checkpoint_store_save_and_load(temp_dir):
+    store = CheckpointStore(temp_dir / 'state.json')
+    store.load()
+    assert store.get('/var/log/nginx/access.log') == []
+    store.update('/var/log/nginx/access.log', [(1, 2, 3)])
+    store.save()
+    assert not (temp_dir / 'state.json.tmp').exists()
+    store2 = CheckpointStore(temp_dir / 'state.json')
+    store2.load()
+    assert store2.get('/var/log/nginx/access.log') == [(1, 2, 3)]
+
+
+def test_file_reader_resumes_from_checkpoint(temp_dir):
+    log_path = temp_dir / 'sample.log'
+    log_path.write_text('before1\n')
+    with FileReader(log_path) as fr:
+        assert list(fr.read_line_batches()) == []
+        with log_path.open(mode='a') as f:
+            f.write('line1\nincompl')
+        assert list(fr.read_line_batches()) == [[b'line1']]
+        checkpoints = fr.get_checkpoints()
+    st = stat(str(log_path))
+    assert checkpoints == [(st.st_dev, st.st_ino, len('before1\nline1\n'))]
+    with log_path.open(mode='a') as f:
+        f.write('ete\nline2\n')
+    with FileReader(log_path, checkpoints=checkpoints) as fr:
+        assert list(fr.read_line_batches()) == [[b'incomplete', b'line2']]
+
+
+def test_file_reader_ignores_checkpoint_of_other_file(temp_dir):
+    log_path = temp_dir / 'sample.log'
+    log_path.write_text('line1\n')
+    st = stat(str(log_path))
+    checkpoints = [(st.st_dev, st.st_ino + 1, 0)]
+    with FileReader(log_path, checkpoints=checkpoints) as fr:
+        assert list(fr.read_lines()) == []
+
+
+def test_file_reader_limits_backlog(temp_dir):
+    log_path = temp_dir / 'sample.log'
+    log_path.write_text('')
+    st = stat(str(log_path))
+    log_path.write_text('line1\nline2\nline3\n')
+    with FileReader(log_path, checkpoints=[(st.st_dev, st.st_ino, 0)], max_backlog_bytes=12) as fr:
+        assert list(fr.read_lines()) == [b'line2\n', b'line3\n']
+
+
+def test_file_reader_limited_backlog_starts_at_line_boundary(temp_dir):
+    log_path = temp_dir / 'sample.log'
+    log_path.write_text('')
+    st = stat(str(log_path))
+    log_path.write_text('line1\nline2\nline3\n')
+    # 10 bytes back from the end is in the middle of line2
+    with FileReader(log_path, checkpoints=[(st.st_dev, st.st_ino, 0)], max_backlog_bytes=10) as fr:
+        assert list(fr.read_lines()) == [b'line3\n']
+    with FileReader(log_path, checkpoints=[(st.st_dev, st.st_ino, 0)], max_backlog_bytes=3) as fr:
+        assert list(fr.read_lines()) == []
+
+
+def test_file_reader_resumes_rotated_file(temp_dir):
+    log_path = temp_dir / 'sample.log'
+    log_path.write_text('line1\n')
+    st = stat(str(log_path))
+    checkpoints = [(st.st_dev, st.st_ino, len('line1\n'))]
+    with log_path.open(mode='a') as f:
+        f.write('line2\n')
+    log_path.rename(temp_dir / 'sample.log.1')
+    log_path.write_text('new1\n')
+    st_new = stat(str(log_path))
+    checkpoints.append((st_new.st_dev, st_new.st_ino, 0))
+    with FileReader(log_path, checkpoints=checkpoints) as fr:
+        assert list(fr.read_line_batches()) == [[b'line2'], [b'new1']]
+        assert [offset for dev, inode, offset in fr.get_checkpoints()] == [12, 5]
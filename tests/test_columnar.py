@@ -0,0 +1,51 @@
+from collections import Counter
+
+from nginx_log_monitor.access_log_parser import AccessLogParser, parse_log_line
+from nginx_log_monitor.columnar import parse_batch
+from nginx_log_monitor.latency_stats import LatencyStats, count_latencies
+from nginx_log_monitor.path_stats import PathStats, count_path_statuses
+from nginx_log_monitor.status_stats import StatusStats, count_statuses
+
+
+lines = [
+    '{host} 1.2.3.4 - - [04/Feb/2020:11:02:10 +0100] "GET /{path} HTTP/1.1" {status} {i} "-" "Mozilla/5.0" '
+    '0.{i:03d} {upstream_response_time} .'.format(
+        host=('example.com', 'example.net')[i % 2],
+        path=('item/{}'.format(i), 'login', '')[i % 3],
+        status=(200, 404, 502, 304)[i % 4],
+        upstream_response_time='-' if i % 4 == 3 else '0.{:03d}'.format(i // 2),
+        i=i).encode()
+    for i in range(1000)
+] + [
+    '1.2.3.4 - - [04/Feb/2020:11:02:10 +0000] "GET /x/{i} HTTP/1.1" 200 396 "-" "Mozilla/5.0"'.format(i=i).encode()
+    for i in range(100)
+] + [b'garbage', b'1.2.3.4 - - [04/Feb/2020:11:02:10 +0000] "\\x16\\x03\\x01" 400 157 "-" "-"']
+
+
+def test_parse_batch_counts_same_as_records():
+    parser = AccessLogParser()
+    records = [r for r in (parse_log_line(AccessLogParser(), line) for line in lines) if r is not None]
+    error_count = Counter()
+    batch = parse_batch(parser, lines, error_count)
+    assert len(batch) == len(records)
+    assert sum(error_count.values()) == len(lines) - len(records)
+    assert batch.count_statuses() == count_statuses(records)
+    assert batch.count_path_statuses() == count_path_statuses(records)
+    assert batch.count_latencies() == count_latencies(records)
+
+
+def test_update_batch_same_as_update_many():
+    records = [r for r in (parse_log_line(AccessLogParser(), line) for line in lines) if r is not None]
+    batch = parse_batch(AccessLogParser(), lines)
+    for stats_class in StatusStats, PathStats, LatencyStats:
+        s1, s2 = stats_class(), stats_class()
+        s1.update_many(records, now=100)
+        s2.update_batch(batch, now=100)
+        assert s1.get_report(now=100) == s2.get_report(now=100)
+
+
+def test_parse_batch_empty():
+    batch = parse_batch(AccessLogParser(), [b'garbage'])
+    assert len(batch) == 0
+    assert batch.count_statuses() == {}
+    assert batch.count_path_statuses() == {}
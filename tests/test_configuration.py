@@ -0,0 +1,37 @@
+from pathlib import Path
+from pytest import raises
+
+from nginx_log_monitor.access_log_parser import InvalidLogFormatError
+from nginx_log_monitor.configuration import Configuration
+
+
+def test_default_configuration():
+    conf = Configuration(cfg_path=None)
+    assert conf.get_access_log_paths() == [Path('/var/log/nginx/access.log')]
+    assert conf.get_log_format(Path('/var/log/nginx/access.log')) is None
+    # gzip is opt-in, not every Overwatch server accepts it
+    assert conf.overwatch.compress is False
+
+
+def test_log_format_configuration(temp_dir):
+    (temp_dir / 'access.log').write_text('')
+    (temp_dir / 'custom.log').write_text('')
+    cfg_path = temp_dir / 'conf.yaml'
+    cfg_path.write_text(
+        'log_format: \'$remote_addr - $remote_user [$time_local] "$request" $status $body_bytes_sent\'\n'
+        'access_logs:\n'
+        '  - {temp_dir}/access.log\n'
+        '  - path: {temp_dir}/cust*.log\n'
+        '    log_format: \'$host $remote_addr - $remote_user [$time_local] "$request" $status $body_bytes_sent\'\n'
+        .format(temp_dir=temp_dir))
+    conf = Configuration(cfg_path=cfg_path)
+    assert sorted(conf.get_access_log_paths()) == [temp_dir / 'access.log', temp_dir / 'custom.log']
+    assert conf.get_log_format(temp_dir / 'access.log').startswith('$remote_addr ')
+    assert conf.get_log_format(temp_dir / 'custom.log').startswith('$host ')
+
+
+def test_invalid_log_format_configuration(temp_dir):
+    cfg_path = temp_dir / 'conf.yaml'
+    cfg_path.write_text('log_format: "$remote_addr $unknown_variable"\n')
+    with raises(InvalidLogFormatError):
+        Configuration(cfg_path=cfg_path)
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta, timezone
+
+from nginx_log_monitor.access_log_parser import AccessLogParser
+from nginx_log_monitor.event_time import EventTimeWindowing
+from nginx_log_monitor.path_stats import PathStats
+from nginx_log_monitor.status_stats import StatusStats
+
+
+start = datetime(2020, 2, 4, 11, 0, 0, tzinfo=timezone.utc)
+
+
+def make_records(offsets_and_statuses):
+    parser = AccessLogParser()
+    line = '1.2.3.4 - - [{date}] "GET /{i} HTTP/1.1" {status} 396 "-" "Mozilla/5.0"'
+    return [
+        parser.parse(line.format(
+            date=(start + timedelta(seconds=offset)).strftime('%d/%b/%Y:%H:%M:%S +0000'),
+            i=i, status=status))
+        for i, (offset, status) in enumerate(offsets_and_statuses)]
+
+
+def create_stats(event_time):
+    stats_objs = [
+        StatusStats(windows_s=(60, 900), rate_time_constants_s=(60, ), clock=event_time.get_watermark),
+        PathStats(clock=event_time.get_watermark),
+    ]
+    event_time.stats_objs = stats_objs
+    return stats_objs
+
+
+def test_out_of_order_records_within_lateness_land_in_their_window():
+    event_time = EventTimeWindowing(allowed_lateness_s=5, follow_wall_clock=False)
+    status_stats, path_stats = create_stats(event_time)
+    event_time.update_many(make_records([(0, 500), (100, 200), (97, 404)]))
+    # records are fed to the stats only when the watermark passes them
+    assert status_stats.total_status_count['404'] == 0
+    event_time.flush()
+    assert event_time.late_count == 0
+    report = status_stats.get_report()
+    assert status_stats.rolling.get_counts(60) == {'200': 1, '404': 1}
+    assert report['status_count']['last_1_min']['404'] == 1
+    assert report['status_count']['last_1_min']['500'] == 0
+    assert report['status_count']['last_5_min']['500']['__value'] == 1
+
+
+def test_records_later_than_allowed_are_counted_at_watermark():
+    event_time = EventTimeWindowing(allowed_lateness_s=5, follow_wall_clock=False)
+    status_stats, path_stats = create_stats(event_time)
+    event_time.update_many(make_records([(0, 200), (400, 200)]))
+    event_time.update_many(make_records([(100, 502)]))
+    assert event_time.late_count == 1
+    event_time.flush()
+    assert +status_stats.total_status_count == {'200': 2, '502': 1}
+    assert status_stats.get_report()['status_count']['last_5_min']['502']['__value'] == 1
+
+
+def test_replay_speed_and_batching_do_not_change_the_numbers():
+    # one request per second for an hour, pairs of neighbours logged out of order
+    records = make_records([(i ^ 1, (200, 404, 502)[(i ^ 1) % 3]) for i in range(3600)])
+    reports = []
+    for batch_size in 1, 100, 3000:
+        event_time = EventTimeWindowing(allowed_lateness_s=5, follow_wall_clock=False)
+        status_stats, path_stats = create_stats(event_time)
+        for i in range(0, len(records), batch_size):
+            event_time.update_many(records[i:i + batch_size])
+        event_time.flush()
+        reports.append((status_stats.get_report(), path_stats.get_report()))
+    assert reports[0] == reports[1] == reports[2]
+    status_report = reports[0][0]
+    # the window ends at the last timestamp (3599)
+    assert status_report['status_count']['last_1_min']['200'] == sum(1 for i in range(3539, 3600) if i % 3 == 0)
+    assert status_report['status_count']['last_15_min']['502'] == sum(1 for i in range(2699, 3600) if i % 3 == 2)
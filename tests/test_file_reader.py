@@ -31,3 +31,55 @@ def test_file_reader_rotate_file(temp_dir):
         log_path.write_text('rotated1\nrotated2\n')
         assert list(fr.read_lines()) == [b'rotated1\n', b'rotated2\n']
 
+
+def test_file_reader_line_batches(temp_dir):
+    log_path = temp_dir / 'sample.log'
+    log_path.write_text('before1\nbefore2\n')
+    with FileReader(log_path) as fr:
+        assert list(fr.read_line_batches()) == []
+        with log_path.open(mode='a') as f:
+            f.write('after1\nafter2\nincompl')
+        assert list(fr.read_line_batches()) == [[b'after1', b'after2']]
+        with log_path.open(mode='a') as f:
+            f.write('ete\nafter3\n')
+        assert list(fr.read_line_batches()) == [[b'incomplete', b'after3']]
+
+
+def test_file_reader_line_batches_small_chunks(temp_dir):
+    log_path = temp_dir / 'sample.log'
+    log_path.write_text('')
+    with FileReader(log_path) as fr:
+        assert list(fr.read_line_batches()) == []
+        with log_path.open(mode='a') as f:
+            f.write('line1\nline2\nline3\n')
+        batches = list(fr.read_line_batches(chunk_size=4))
+        assert [line for lines in batches for line in lines] == [b'line1', b'line2', b'line3']
+
+
+def test_file_reader_line_batches_rotate_file(temp_dir):
+    log_path = temp_dir / 'sample.log'
+    log_path.write_text('before1\n')
+    with FileReader(log_path) as fr:
+        assert list(fr.read_line_batches()) == []
+        with log_path.open(mode='a') as f:
+            f.write('after1\n')
+        log_path.rename(temp_dir / 'sample.log.1')
+        log_path.write_text('rotated1\nrotated2\n')
+        assert list(fr.read_line_batches()) == [[b'after1'], [b'rotated1', b'rotated2']]
+
+
+def test_file_reader_line_batches_read_whole_chunks(temp_dir):
+    count = 20000
+    line = '84.22.97.60 - - [04/Feb/2020:11:02:10 +0000] "GET / HTTP/1.1" 200 396 "-" "Mozilla/5.0 zgrab/0.x"\n'
+    chunk_size = 64 * 1024
+    log_path = temp_dir / 'sample.log'
+    log_path.write_text('')
+    with FileReader(log_path) as fr:
+        assert list(fr.read_line_batches(chunk_size=chunk_size)) == []
+        with log_path.open(mode='a') as f:
+            f.write(line * count)
+        batches = list(fr.read_line_batches(chunk_size=chunk_size))
+    # one batch per chunk read, not per line
+    assert len(batches) == -(-len(line) * count // chunk_size)
+    assert sum(len(lines) for lines in batches) == count
+    assert all(l == line.rstrip('\n').encode() for lines in batches for l in lines)
@@ -0,0 +1,74 @@
+from asyncio import CancelledError, sleep, wait_for
+from pytest import fixture, mark, skip
+from time import monotonic as monotime
+
+from nginx_log_monitor.file_reader import tail_files
+from nginx_log_monitor.file_watcher import create_watcher
+from nginx_log_monitor.util import create_task
+
+
+@fixture
+def log_path(temp_dir):
+    p = temp_dir / 'sample.log'
+    p.write_text('')
+    return p
+
+
+@fixture
+def watcher(log_path):
+    w = create_watcher([log_path])
+    if w is None:
+        skip('inotify not available')
+    with w:
+        yield w
+
+
+@mark.asyncio
+async def test_watcher_timeout(watcher, log_path):
+    assert await watcher.wait(timeout=0.01) is None
+
+
+@mark.asyncio
+async def test_watcher_modify(watcher, log_path):
+    with log_path.open(mode='a') as f:
+        f.write('line1\n')
+    assert await watcher.wait(timeout=1) == {log_path: False}
+
+
+@mark.asyncio
+async def test_watcher_rotate(watcher, log_path):
+    log_path.rename(log_path.with_name('sample.log.1'))
+    log_path.write_text('rotated1\n')
+    assert await watcher.wait(timeout=1) == {log_path: True}
+    with log_path.open(mode='a') as f:
+        f.write('rotated2\n')
+    assert await watcher.wait(timeout=1) == {log_path: False}
+
+
+@mark.asyncio
+async def test_tail_files_with_inotify(watcher, log_path):
+    received = []
+
+    async def process_lines(path, lines):
+        received.extend(lines)
+
+    async def write_lines():
+        await sleep(0.05)
+        with log_path.open(mode='a') as f:
+            f.write('line1\nline2\n')
+        t0 = monotime()
+        while not received:
+            await sleep(0.001)
+        return monotime() - t0
+
+    tail_task = create_task(tail_files(lambda: [log_path], process_lines=process_lines, sleep_interval=10))
+    try:
+        delay = await wait_for(write_lines(), 1)
+    finally:
+        tail_task.cancel()
+        try:
+            await tail_task
+        except CancelledError:
+            pass
+    assert received == [b'line1', b'line2']
+    assert delay < 0.5
@@ -0,0 +1,90 @@
+from random import Random
+from nginx_log_monitor.access_log_parser import AccessLogRecord
+from nginx_log_monitor.latency_stats import LatencyStats, count_latencies, latency_bucket, latency_bucket_bounds
+
+
+mk_rec = lambda data: AccessLogRecord(data.get)
+
+
+def test_latency_bucket_bounds():
+    for value in [0, 0.0005, 0.001, 0.0015, 0.042, 0.999, 1, 1.5, 30, 3600]:
+        lower, upper = latency_bucket_bounds(latency_bucket(value))
+        assert lower <= value < upper
+        if value >= 0.001:
+            assert (upper - lower) / lower <= 1 / 16 + 1e-9
+
+
+def test_latency_stats_percentiles():
+    rnd = Random(0)
+    values = [rnd.expovariate(10) for i in range(10000)]
+    s = LatencyStats()
+    s.update_many([mk_rec({'path': '/foo', 'status': 200, 'request_time': str(v)}) for v in values])
+    report = s.get_report()['latency']['request_time']
+    values.sort()
+    for name, q in [('p50', 0.5), ('p90', 0.9), ('p99', 0.99)]:
+        exact = values[int(q * len(values)) - 1]
+        assert abs(report['total']['all'][name] - exact) / exact < 0.04
+    assert report['total']['all']['count'] == 10000
+    assert report['total']['all']['max'] >= values[-1]
+    assert report['total']['paths']['/foo'] == report['total']['all']
+    assert report['last_5_min'] == report['total']
+    assert report == s.get_report()['latency']['request_time']
+
+
+def test_latency_stats_upstream_response_time_and_rolling():
+    s = LatencyStats()
+    s.update(mk_rec({'path': '/foo', 'status': 200, 'request_time': '0.100', 'upstream_response_time': '0.090'}), now=1000)
+    s.update(mk_rec({'path': '/bar/1', 'status': 304, 'request_time': '2.000', 'upstream_response_time': '-'}), now=1200)
+    report = s.get_report(now=1200)['latency']
+    assert report['upstream_response_time']['total']['all']['count'] == 1
+    assert report['request_time']['last_5_min']['all']['count'] == 2
+    assert list(report['request_time']['total']['paths']) == ['/foo', '/bar/<n>']
+    report = s.get_report(now=1400)['latency']
+    assert report['request_time']['total']['all']['count'] == 2
+    assert report['request_time']['last_5_min']['all']['count'] == 1
+    assert list(report['request_time']['last_5_min']['paths']) == ['/bar/<n>']
+    assert report['upstream_response_time']['last_5_min']['all'] == {'count': 0}
+
+
+def test_latency_stats_without_latencies():
+    s = LatencyStats()
+    s.update(mk_rec({'path': '/foo', 'status': 200}))
+    assert s.get_report() == {}
+
+
+def test_latency_stats_merge_same_as_update_many():
+    records = [
+        mk_rec({'path': '/item/{}'.format(i % 7), 'host': 'h{}'.format(i % 3), 'status': 200, 'request_time': '0.{:03d}'.format(i)})
+        for i in range(500)]
+    s1, s2 = LatencyStats(), LatencyStats()
+    s1.update_many(records, now=100)
+    s2.merge(count_latencies(records[:200]), now=100)
+    s2.merge(count_latencies(records[200:]), now=100)
+    assert s1.get_report(now=100) == s2.get_report(now=100)
+
+
+def test_latency_stats_memory_is_bounded():
+    s = LatencyStats()
+    s.max_paths = 20
+    for i in range(1000):
+        s.update(mk_rec({'host': 'host{}'.format(i), 'path': '/', 'status': 200, 'request_time': '0.010'}), now=100)
+    assert len(s._path_count) <= 20
+    report = s.get_report(now=100)['latency']['request_time']
+    assert report['total']['all']['count'] == 1000
+    assert len(s._path_count) <= 20
+
+
+def test_latency_stats_admits_paths_by_frequency():
+    s = LatencyStats()
+    s.max_paths = 20
+    s.readmit_interval_s = 60
+    # a scan at startup takes all the room
+    s.update_many([mk_rec({'path': '/scan{}'.format(i), 'status': 404, 'request_time': '0.001'}) for i in range(100)], now=0)
+    for t in range(1, 120):
+        s.update_many([mk_rec({'path': '/api', 'status': 200, 'request_time': '0.100'})] * 3, now=t)
+    assert len(s._path_count) <= 20
+    report = s.get_report(now=120)['latency']['request_time']
+    assert list(report['last_5_min']['paths'].keys())[0] == '/api'
+    assert list(report['total']['paths'].keys())[0] == '/api'
+    assert report['total']['all']['count'] == 100 + 3 * 119
+    assert not any(path.startswith('/scan') for path in s._path_count)
@@ -1,10 +1,12 @@
 from asyncio import Queue, gather
 from datetime import datetime
-from pytest import mark
+from pytest import mark, raises
 import pytz
 from time import monotonic as monotime
 
-from nginx_log_monitor import parse_access_log_line
+from nginx_log_monitor import parse_access_log_line, AccessLogParser
+from nginx_log_monitor.access_log_parser import InvalidLogFormatError, InvalidLogLineError
+from nginx_log_monitor.access_log_parser import parse_date, parse_date_utc
 
 
 def test_default_nginx_access_log():
@@ -62,6 +64,112 @@ def test_custom_nginx_access_log_20200204():
     assert rec.pipelined == False
 
 
+def test_access_log_record_is_lazy():
+    line = '84.22.97.60 - - [04/Feb/2020:11:02:10 +0000] "GET / HTTP/1.1" 200 396 "-" "Mozilla/5.0 zgrab/0.x"'
+    rec = parse_access_log_line(line)
+    assert not hasattr(rec, '__dict__')
+    assert not hasattr(rec, '_date_utc')
+    assert rec.status == 200
+    assert not hasattr(rec, '_date_utc')
+    assert rec.date_utc == pytz.utc.localize(datetime(2020, 2, 4, 11, 2, 10))
+    assert rec.as_dict()['status'] == 200
+    assert rec.as_dict()['user_agent_str'] == 'Mozilla/5.0 zgrab/0.x'
+    rec.status = 404
+    assert rec.status == 404
+    assert repr(rec) == "<AccessLogRecord method='GET' path='/' status=404>"
+
+
+def test_line_with_invalid_date_is_rejected():
+    for date_str in ['not a date', '04/Foo/2020:11:02:10 +0000', '2020-02-04T11:02:10+00:00']:
+        line = '84.22.97.60 - - [{}] "GET / HTTP/1.1" 200 396 "-" "Mozilla/5.0 zgrab/0.x"'.format(date_str)
+        with raises(InvalidLogLineError):
+            parse_access_log_line(line)
+        with raises(InvalidLogLineError):
+            AccessLogParser().parse(line.encode())
+
+
+def test_parse_date():
+    assert parse_date('04/Feb/2020:13:14:33 +0100').utcoffset().total_seconds() == 3600
+    assert parse_date('04/Feb/2020:13:14:33 -0130').utcoffset().total_seconds() == -5400
+    assert parse_date_utc('04/Feb/2020:13:14:33 +0100') == pytz.utc.localize(datetime(2020, 2, 4, 12, 14, 33))
+    assert parse_date_utc('04/Feb/2020:13:14:33 -0130') == pytz.utc.localize(datetime(2020, 2, 4, 14, 44, 33))
+    assert parse_date_utc('04/Feb/2020:13:14:33 -0130').utcoffset().total_seconds() == 0
+    with raises(InvalidLogLineError):
+        parse_date('2020-02-04T13:14:33+01:00')
+
+
+def test_parse_date_is_cached():
+    # lines logged in the same second share the same $time_local
+    date_strs = ['04/Feb/2020:13:{:02d}:{:02d} +0100'.format(i // 60, i % 60) for i in range(100)]
+    parse_date.cache_clear()
+    parse_date_utc.cache_clear()
+    for date_str in date_strs:
+        for i in range(100):
+            parse_date_utc(date_str)
+    assert parse_date_utc.cache_info().misses == 100
+    assert parse_date_utc.cache_info().hits == 9900
+    # the date is parsed only once per distinct string
+    assert parse_date.cache_info().misses == 100
+
+
+custom_log_format = (
+    '$host $remote_addr - $remote_user [$time_local] "$request" $status $body_bytes_sent '
+    '"$http_referer" "$http_user_agent" $request_time $upstream_response_time $pipe')
+
+
+def test_parser_with_configured_log_format():
+    parser = AccessLogParser(custom_log_format)
+    assert parser.log_format == custom_log_format
+    line = (
+        'example.com 1.23.45.67 - - [20/Feb/2020:11:15:26 +0100] '
+        '"GET /foo HTTP/1.1" 404 197 "-" "Mozilla/5.0 ..." 0.000 - .\n'
+    )
+    rec = parser.parse(line)
+    assert rec.host == 'example.com'
+    assert rec.status == 404
+    # configured format is never auto-detected
+    with raises(InvalidLogLineError):
+        parser.parse('84.22.97.60 - - [04/Feb/2020:11:02:10 +0000] "GET / HTTP/1.1" 200 396 "-" "Mozilla/5.0 zgrab/0.x"')
+
+
+def test_parser_with_invalid_log_format():
+    with raises(InvalidLogFormatError):
+        AccessLogParser('$remote_addr $something_unknown')
+
+
+def test_parser_auto_detection_pins_detected_format():
+    parser = AccessLogParser()
+    line = (
+        'example.com 1.23.45.67 - - [20/Feb/2020:11:15:26 +0100] '
+        '"GET /foo HTTP/1.1" 404 197 "-" "Mozilla/5.0 ..." 0.000 - .'
+    )
+    assert parser.log_format != custom_log_format
+    assert parser.parse(line).host == 'example.com'
+    assert parser.log_format == custom_log_format
+    rec = parser.parse('84.22.97.60 - - [04/Feb/2020:11:02:10 +0000] "GET / HTTP/1.1" 200 396 "-" "Mozilla/5.0 zgrab/0.x"')
+    assert rec.remote_addr == '84.22.97.60'
+
+
+def test_parser_parses_bytes_same_as_str():
+    parser = AccessLogParser()
+    line = (
+        'example.com 1.23.45.67 - - [20/Feb/2020:11:15:26 +0100] '
+        '"GET /foo HTTP/1.1" 404 197 "-" "Mozilla/5.0 ..." 0.000 - .'
+    )
+    assert parser.parse(line.encode() + b'\n').as_dict() == parser.parse(line).as_dict()
+
+
+def test_parser_replaces_invalid_utf8_in_bytes_line():
+    parser = AccessLogParser()
+    line = b'84.22.97.60 - - [04/Feb/2020:11:02:10 +0000] "GET /foo\xff HTTP/1.1" 200 396 "-" "Mozilla/5.0 \xc3("'
+    rec = parser.parse(line)
+    assert rec.status == 200
+    assert rec.path == '/foo\ufffd'
+    assert rec.user_agent_str == 'Mozilla/5.0 \ufffd('
+    with raises(InvalidLogLineError):
+        parser.parse(b'\x16\x03\x01\x02\x00\xff garbage')
+
+
 def test_default_nginx_access_log_benchmark():
     count = 1000
     t0 = monotime()
@@ -0,0 +1,82 @@
+from aiohttp import ClientSession, web
+from pytest import mark
+
+from nginx_log_monitor.access_log_parser import AccessLogRecord
+from nginx_log_monitor.configuration import Configuration
+from nginx_log_monitor.latency_stats import LatencyStats
+from nginx_log_monitor.metrics import MetricsRenderer, create_metrics_app
+from nginx_log_monitor.monitor_stats import MonitorStats
+from nginx_log_monitor.path_stats import PathStats
+from nginx_log_monitor.status_stats import StatusStats
+
+
+mk_rec = lambda data: AccessLogRecord(data.get)
+
+
+def test_metrics_rendering_is_cached():
+    status_stats, path_stats, latency_stats = StatusStats(), PathStats(), LatencyStats()
+    renderer = MetricsRenderer(status_stats, path_stats, latency_stats)
+    records = [
+        mk_rec({'path': '/foo', 'status': 200, 'request_time': '0.100'}),
+        mk_rec({'path': '/bar"\\', 'status': 500, 'request_time': '0.200'}),
+    ]
+    for s in status_stats, path_stats, latency_stats:
+        s.update_many(records, now=1000)
+    text = renderer.render(now=1000)
+    assert 'nginx_log_monitor_requests_total{status="200"} 1\n' in text
+    assert 'nginx_log_monitor_requests_last_5min{status="500"} 1\n' in text
+    assert 'nginx_log_monitor_path_requests_total{status="500",path="/bar\\"\\\\"} 1\n' in text
+    assert 'nginx_log_monitor_request_time_seconds_count 2\n' in text
+    assert '# TYPE nginx_log_monitor_request_time_seconds summary\n' in text
+    assert renderer.render_count == 1
+    assert renderer.render(now=1001) == text
+    assert renderer.render_count == 1
+    status_stats.update(records[0], now=1002)
+    assert 'nginx_log_monitor_requests_total{status="200"} 2\n' in renderer.render(now=1002)
+    assert renderer.render_count == 2
+    # the last 5 minutes window has rolled
+    assert 'nginx_log_monitor_requests_last_5min{status="500"}' not in renderer.render(now=1400)
+    assert renderer.render_count == 3
+
+
+def test_metrics_rendering_uses_stats_clock():
+    event_now = 1000
+    clock = lambda: event_now
+    status_stats = StatusStats(clock=clock)
+    renderer = MetricsRenderer(status_stats, PathStats(clock=clock), monitor_stats=MonitorStats(), clock=clock)
+    status_stats.update(mk_rec({'path': '/foo', 'status': 500}))
+    assert 'nginx_log_monitor_requests_last_5min{status="500"} 1\n' in renderer.render()
+    event_now = 1400
+    assert 'nginx_log_monitor_requests_last_5min{status="500"}' not in renderer.render()
+    assert 'nginx_log_monitor_uptime_seconds ' in renderer.render()
+
+
+@mark.asyncio
+async def test_metrics_endpoint():
+    renderer = MetricsRenderer(StatusStats(), PathStats(), monitor_stats=MonitorStats())
+    runner = web.AppRunner(create_metrics_app(renderer))
+    await runner.setup()
+    try:
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        async with ClientSession() as session:
+            async with session.get('http://127.0.0.1:{}/metrics'.format(port)) as resp:
+                assert resp.status == 200
+                assert resp.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+                text = await resp.text()
+    finally:
+        await runner.cleanup()
+    assert 'nginx_log_monitor_requests_total{status="200"} 0\n' in text
+    assert 'nginx_log_monitor_lines_read_total 0\n' in text
+    assert 'nginx_log_monitor_unify_path_cache_requests_total{result="hit"} ' in text
+
+
+def test_metrics_configuration(temp_dir):
+    cfg_path = temp_dir / 'conf.yaml'
+    cfg_path.write_text('metrics:\n  listen_port: 9145\n')
+    conf = Configuration(cfg_path=cfg_path)
+    assert conf.metrics.enabled
+    assert conf.metrics.listen_host == '127.0.0.1'
+    assert conf.metrics.listen_port == 9145
+    assert not Configuration(cfg_path=None).metrics.enabled
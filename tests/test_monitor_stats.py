@@ -0,0 +1,76 @@
+from collections import Counter
+from pytest import mark
+
+from nginx_log_monitor.access_log_parser import AccessLogParser
+from nginx_log_monitor.file_reader import FileReader
+from nginx_log_monitor.main import process_log_lines
+from nginx_log_monitor.monitor_stats import MonitorStats
+from nginx_log_monitor.path_stats import unify_path
+from nginx_log_monitor.util import PubSub
+
+
+sample_line = (
+    b'1.2.3.4 - - [20/Feb/2020:12:39:17 +0100] "GET /foo HTTP/1.1" 200 5 "-" "curl/7.64.0"')
+
+
+@mark.asyncio
+async def test_monitor_stats_counts_lines_and_errors():
+    pubsub = PubSub()
+    q = pubsub.subscribe('status_stats')
+    monitor_stats = MonitorStats()
+    monitor_stats.watch_pubsub('access_log', pubsub)
+    lines = [
+        sample_line,
+        sample_line,
+        b'1.2.3.4 - - [20/Feb/2020:12:39:17 +0100] "\\x16\\x03\\x01\\x00\\xCA\\x01" 400 157 "-" "-"',
+        b'garbage',
+    ]
+    monitor_stats.lines_read(lines)
+    await process_log_lines(pubsub, AccessLogParser(), lines, monitor_stats=monitor_stats)
+    report = monitor_stats.get_report()['monitor']
+    assert report['total']['lines_read'] == 4
+    assert report['total']['bytes_read'] == sum(len(line) + 1 for line in lines)
+    assert report['total']['lines_parsed'] == 2
+    assert report['total']['lines_failed'] == {'BogusLogLineError': 1, 'InvalidLogLineError': 1, 'other': 0}
+    assert report['per_second']['lines_read'] > 0
+    assert q.qsize() == 1
+    assert report['queue_depth'] == {'access_log.status_stats': q.qsize()}
+    assert report['event_loop_lag_s'] == {'last': None, 'max': None}
+
+
+def test_monitor_stats_rates_roll():
+    monitor_stats = MonitorStats()
+    monitor_stats.start_mt = 1000
+    monitor_stats.lines_parsed(600, Counter({'other': 60}), duration_s=3, now=1000)
+    report = monitor_stats.get_report(now=1060)['monitor']
+    assert report['per_second']['lines_parsed'] == 10
+    assert report['per_second']['lines_failed']['other'] == 1
+    assert report['busy_ratio']['parse'] == 0.05
+    report = monitor_stats.get_report(now=1200)['monitor']
+    assert report['per_second']['lines_parsed'] == 0
+    assert report['total']['lines_parsed'] == 600
+
+
+def test_monitor_stats_file_backlog(temp_dir):
+    p = temp_dir / 'access.log'
+    p.write_bytes(b'line1\n')
+    with FileReader(p) as fr:
+        assert list(fr.read_line_batches()) == []
+        with p.open('ab') as f:
+            f.write(b'line2\nline3\n')
+        monitor_stats = MonitorStats()
+        monitor_stats.watch_files({p: fr})
+        assert monitor_stats.get_report()['monitor']['file_backlog_bytes'] == {str(p): 12}
+        assert list(fr.read_line_batches()) == [[b'line2', b'line3']]
+        assert monitor_stats.get_report()['monitor']['file_backlog_bytes'] == {str(p): 0}
+
+
+def test_monitor_stats_unify_path_cache():
+    monitor_stats = MonitorStats()
+    before = monitor_stats.get_report()['monitor']['unify_path_cache']
+    unify_path('/monitor-stats-test/1234')
+    unify_path('/monitor-stats-test/1234')
+    after = monitor_stats.get_report()['monitor']['unify_path_cache']
+    assert after['misses'] == before['misses'] + 1
+    assert after['hits'] == before['hits'] + 1
+    assert after['size'] >= 1
@@ -0,0 +1,113 @@
+from aiohttp import ClientSession
+from asyncio import sleep
+import json
+from pytest import mark, raises
+
+from nginx_log_monitor.clients import OverwatchClient
+from nginx_log_monitor.clients.overwatch_client import OverwatchClientReportError, encode_report
+from nginx_log_monitor.configuration import Configuration
+from nginx_log_monitor.overwatch import Backoff, ReportSpool, report_to_overwatch
+from nginx_log_monitor.path_stats import PathStats
+from nginx_log_monitor.status_stats import StatusStats
+from nginx_log_monitor.util import create_task
+
+
+def test_backoff():
+    b = Backoff(1, 10)
+    delays = [b.next_delay() for i in range(6)]
+    for delay, expected in zip(delays, [1, 2, 4, 8, 10, 10]):
+        assert expected / 2 <= delay <= expected
+    b.reset()
+    assert b.next_delay() <= 1
+
+
+@mark.asyncio
+async def test_report_to_overwatch_outage(temp_dir, overwatch_server):
+    cfg_path = temp_dir / 'conf.yaml'
+    cfg_path.write_text(
+        'overwatch:\n'
+        '  report_url: http://localhost/report\n'
+        '  report_token: t0ken\n'
+        '  report_interval_s: 0.01\n'
+        '  max_backoff_s: 0.05\n')
+    conf = Configuration(cfg_path=cfg_path)
+    overwatch_server.fail = True
+    async with overwatch_server, ClientSession() as session:
+        client = OverwatchClient(session, report_url=overwatch_server.url, report_token='t0ken')
+        t = create_task(report_to_overwatch(conf, StatusStats(), PathStats(), overwatch_client=client))
+        try:
+            await sleep(0.5)
+            # without backoff there would be about 50 attempts
+            assert 5 <= overwatch_server.request_count <= 25
+            failed_count = overwatch_server.request_count
+            overwatch_server.fail = False
+            await sleep(0.2)
+        finally:
+            t.cancel()
+    delivery = overwatch_server.reports[0]['state']['overwatch_delivery']
+    assert delivery['sent_reports'] == 0
+    assert delivery['failed_attempts'] == failed_count
+    assert delivery['coalesced_reports'] == failed_count - 1
+    assert overwatch_server.reports[-1]['state']['overwatch_delivery']['sent_reports'] == len(overwatch_server.reports) - 1
+
+
+class FailingClient:
+
+    def __init__(self):
+        self.sent = []
+        self.fail = True
+
+    async def send_encoded_report(self, body, compressed=False):
+        if self.fail:
+            raise OverwatchClientReportError('failed')
+        self.sent.append(body)
+
+
+@mark.asyncio
+async def test_report_to_overwatch_with_client_without_compress_attribute(temp_dir):
+    cfg_path = temp_dir / 'conf.yaml'
+    cfg_path.write_text('overwatch:\n  report_interval_s: 0.01\n')
+    conf = Configuration(cfg_path=cfg_path)
+    client = FailingClient()
+    client.fail = False
+    t = create_task(report_to_overwatch(conf, StatusStats(), PathStats(), overwatch_client=client))
+    try:
+        await sleep(0.1)
+    finally:
+        t.cancel()
+    assert client.sent
+    assert json.loads(client.sent[0].decode())['state']['overwatch_delivery']['sent_reports'] == 0
+
+
+@mark.asyncio
+async def test_report_spool_survives_restart(temp_dir):
+    spool_path = temp_dir / 'overwatch-spool'
+    client = FailingClient()
+    spool = ReportSpool(spool_path)
+    spool.put(encode_report({'n': 1}))
+    spool.put(encode_report({'n': 2}))
+    with raises(OverwatchClientReportError):
+        await spool.flush(client)
+    assert spool.coalesced_count == 1
+    assert len(spool) == 1
+    assert spool_path.read_bytes() == encode_report({'n': 2})
+
+    spool = ReportSpool(spool_path)
+    spool.load()
+    spool.put(encode_report({'n': 3}))
+    client.fail = False
+    await spool.flush(client)
+    assert client.sent == [encode_report({'n': 2}), encode_report({'n': 3})]
+    assert len(spool) == 0
+    assert not spool_path.exists()
+
+
+@mark.asyncio
+async def test_report_spool_max_bytes(temp_dir):
+    spool_path = temp_dir / 'overwatch-spool'
+    spool = ReportSpool(spool_path, max_bytes=10)
+    spool.put(encode_report({'data': 'x' * 1000}, compress=False), compressed=False)
+    with raises(OverwatchClientReportError):
+        await spool.flush(FailingClient())
+    assert not spool_path.exists()
+    assert len(spool) == 1
@@ -1,6 +1,5 @@
-from collections import Counter
 from nginx_log_monitor.access_log_parser import AccessLogRecord
-from nginx_log_monitor.path_stats import PathStats, cleanup_counter, unify_path
+from nginx_log_monitor.path_stats import PathStats, unify_path, get_unify_path_cache_info
 
 
 def test_path_stats():
@@ -77,17 +76,6 @@ def test_path_stats_rolling():
     }
 
 
-def test_cleanup_counter():
-    c = Counter('lorem ipsum dolor sit amet.')
-    assert len(c) == 14
-    assert set(c.most_common(3)) == {(' ', 4), ('o', 3), ('m', 3)}
-    assert set(c.items()) == set(c.most_common(100))
-    assert cleanup_counter(c, 100) == c
-    c2 = cleanup_counter(c, 3)
-    assert len(c2) == 3
-    assert set(c2.items()) == set(c.most_common(3))
-
-
 def test_unify_path():
     assert unify_path('/') == '/'
     assert unify_path('/?foo') == '/'
@@ -101,3 +89,126 @@ def test_unify_path():
     assert unify_path('/campaigns/8de2fa22-36eb-4e0f-b9cd-4766d5614a9f') == '/campaigns/<uuid>'
     assert unify_path('/campaigns/D91B577E-8C29-45EF-80BE-1D7D35EFED6D') == '/campaigns/<UUID>'
     assert unify_path('/campaigns/1234') == '/campaigns/<n>'
+    assert unify_path('/campaigns/1234/5678/f0d219b67cc3409bbd64bc5d5a5286f9/') == '/campaigns/<n>/<n>/<uuid>/'
+    assert unify_path('/campaigns/F0d219b67cc3409bbd64bc5d5a5286f9') == '/campaigns/F0d219b67cc3409bbd64bc5d5a5286f9'
+    assert unify_path('/campaigns/8de2fa22-36eb-4e0f-b9cd-4766d5614a9f?foo=1') == '/campaigns/<uuid>'
+    assert unify_path('/campaigns/8de2fa2236eb-4e0f-b9cd-4766d5614a9f-') == '/campaigns/8de2fa2236eb-4e0f-b9cd-4766d5614a9f-'
+
+
+def test_path_stats_update_many():
+    mk_rec = lambda data: AccessLogRecord(data.get)
+    records = [
+        mk_rec({'path': '/foo', 'status': 200}),
+        mk_rec({'path': '/foo', 'status': 404}),
+        mk_rec({'path': '/bar/1234', 'status': 200}),
+        mk_rec({'host': 'example.com', 'path': '/bar/89', 'status': 500}),
+    ]
+    s1 = PathStats()
+    for rec in records:
+        s1.update(rec, now=10)
+    s2 = PathStats()
+    s2.update_many(records, now=10)
+    assert s2.get_report(now=20) == s1.get_report(now=20)
+    assert s2.get_report(now=20)['path_status_count']['total'] == {
+        '200': {'/foo': 1, '/bar/<n>': 1},
+        '404': {'/foo': 1},
+        '500': {'example.com/bar/<n>': 1},
+    }
+
+
+def test_unify_path_cache():
+    unify_path('/cache-test/1234')
+    info = get_unify_path_cache_info()
+    assert unify_path('/cache-test/1234?foo=bar') == '/cache-test/<n>'
+    info2 = get_unify_path_cache_info()
+    assert info2.hits == info.hits + 1
+    assert info2.misses == info.misses
+
+
+def test_path_stats_memory_is_bounded():
+    s = PathStats()
+    s.path_count_capacity = 100
+    mk_rec = lambda data: AccessLogRecord(data.get)
+    for i in range(1000):
+        s.update(mk_rec({'path': '/scan{}'.format(i), 'status': 404}), now=i / 10)
+        s.update(mk_rec({'path': '/index.html', 'status': 404}), now=i / 10)
+    assert len(s.total_path_status_count['404']) == 100
+    assert len(s.rolling_5min_path_status_count['404'].counts) == 100
+    report = s.get_report(now=100)
+    assert list(report['path_status_count']['total']['404'].items())[0] == ('/index.html', 1000)
+    assert list(report['path_status_count']['last_5_min']['404'].items())[0][0] == '/index.html'
+
+
+def test_path_stats_window_is_empty_after_scan_burst_expires():
+    s = PathStats()
+    s.path_count_capacity = 100
+    mk_rec = lambda data: AccessLogRecord(data.get)
+    for t in range(10):
+        records = [mk_rec({'path': '/scan{}_{}'.format(t, i), 'status': 404}) for i in range(300)]
+        records += [mk_rec({'path': '/medium', 'status': 404})] * 5
+        s.update_many(records, now=t)
+    assert len(s.rolling_5min_path_status_count['404'].counts) == 100
+    s.update(mk_rec({'path': '/other', 'status': 404}), now=1000)
+    assert dict(s.rolling_5min_path_status_count['404'].counts) == {'/other': 1}
+    assert s.get_report(now=1000)['path_status_count']['last_5_min']['404'] == {'/other': 1}
+
+
+def test_path_stats_window_buckets_are_bounded():
+    s = PathStats()
+    s.bucket_path_count_capacity = 10
+    mk_rec = lambda data: AccessLogRecord(data.get)
+    for t in range(5):
+        records = [mk_rec({'path': '/scan{}_{}'.format(t, i), 'status': 404}) for i in range(300)]
+        records += [mk_rec({'path': '/medium', 'status': 404})] * 5
+        s.update_many(records, now=t)
+    rolling = s.rolling_5min_path_status_count['404']
+    assert all(len(bucket) <= 11 for start, bucket in rolling._buckets)
+    assert rolling.counts['/medium'] == 25
+    assert rolling.counts['<other_path>'] == 5 * (300 - 9)
+    s.update(mk_rec({'path': '/other', 'status': 404}), now=1000)
+    assert dict(rolling.counts) == {'/other': 1}
+
+
+def test_path_stats_sampling_offset_when_step_shrinks():
+    mk_rec = lambda data: AccessLogRecord(data.get)
+    s = PathStats(sampling_threshold_per_s=1000)
+    rec = mk_rec({'path': '/foo', 'status': 200})
+    s.update_many([rec] * 100050, now=100.1)
+    assert s.sample_step == 101
+    s.update_many([rec] * 2000, now=102.5)
+    assert s.sample_step == 2
+    # the offset left by the step 101 must not skip records of this batch
+    assert s.sampled_count == len(range(0, 100050, 101)) + 1000
+
+
+def test_path_stats_adaptive_sampling():
+    mk_rec = lambda data: AccessLogRecord(data.get)
+    s = PathStats(sampling_threshold_per_s=1000)
+    batch = [mk_rec({'path': '/foo/{}'.format(i) if i % 4 else '/bar', 'status': 200}) for i in range(500)]
+    # 500 records/s - below the threshold, exact counts
+    s.update_many(batch, now=100.1)
+    report = s.get_report(now=100.2)
+    assert report['path_status_count']['total']['200'] == {'/foo/<n>': 375, '/bar': 125}
+    assert report['path_status_count_sampling']['estimated'] == {'total': False, 'last_5_min': False}
+    # 10000 records/s - only every 10th record is processed
+    for i in range(20):
+        s.update_many(batch, now=101 + i / 20)
+    assert s.sample_step == 10
+    report = s.get_report(now=102)
+    counts = report['path_status_count']['total']['200']
+    # the sample step grows as the rate in the current second grows
+    assert abs(counts['/foo/<n>'] + counts['/bar'] - (500 + 10000)) < 500
+    assert abs(counts['/bar'] - (125 + 2500)) < 500
+    assert report['path_status_count_sampling']['estimated'] == {'total': True, 'last_5_min': True}
+    assert report['path_status_count_sampling']['skipped_records'] > 7000
+    # the flood is over
+    s.update_many(batch, now=500)
+    s.update_many(batch, now=501)
+    assert s.sample_step == 1
+    report = s.get_report(now=501)
+    assert report['path_status_count_sampling']['estimated'] == {'total': True, 'last_5_min': False}
+
+
+def test_path_stats_without_sampling_has_no_sampling_report():
+    s = PathStats()
+    assert 'path_status_count_sampling' not in s.get_report()
@@ -21,3 +21,48 @@ def dump_queue(q):
     while not q.empty():
         items.append(q.get_nowait())
     return items
+
+
+@mark.asyncio
+async def test_pubsub_put_batch():
+    p = PubSub()
+    q1 = p.subscribe()
+    q2 = p.subscribe()
+    await p.put_batch(['item1', 'item2'])
+    await p.put_batch([])
+    await p.put_batch(['item3'])
+
+    assert dump_queue(q1) == [['item1', 'item2'], ['item3']]
+    assert dump_queue(q2) == [['item1', 'item2'], ['item3']]
+
+
+@mark.asyncio
+async def test_pubsub_overflow_policies():
+    p = PubSub(3)
+    q_oldest = p.subscribe('oldest', policy='drop_oldest')
+    q_newest = p.subscribe('newest', policy='drop_newest')
+    q_sample = p.subscribe('sample', policy='sample', sample_every=2)
+    for i in range(6):
+        await p.put(i)
+    assert dump_queue(q_oldest) == [3, 4, 5]
+    assert dump_queue(q_newest) == [0, 1, 2]
+    # from half full (2 items) only every 2nd item is added
+    assert dump_queue(q_sample) == [0, 1, 3]
+    stats = p.get_subscriber_stats()
+    assert stats['oldest'] == {'policy': 'drop_oldest', 'size': 0, 'high_water_mark': 3, 'dropped': 3}
+    assert stats['newest']['dropped'] == 3
+    assert stats['sample']['dropped'] == 3
+
+
+@mark.asyncio
+async def test_pubsub_slow_best_effort_subscriber_does_not_block():
+    p = PubSub(2)
+    q_critical = p.subscribe('critical')
+    q_best_effort = p.subscribe('best_effort', policy='drop_oldest')
+    for i in range(10):
+        await p.put_batch(['a', 'b'])
+        assert q_critical.get_nowait() == ['a', 'b']
+    assert q_critical.dropped_count == 0
+    assert q_best_effort.qsize() == 2
+    assert q_best_effort.dropped_count == 16
+    assert q_best_effort.high_water_mark == 2
@@ -0,0 +1,110 @@
+from math import exp
+from pytest import approx
+
+from nginx_log_monitor.rolling_counter import RollingCounter, MultiWindowCounter, window_name, rate_name
+
+
+def test_rolling_counter():
+    c = RollingCounter(window_s=300)
+    c.add('200', now=10)
+    c.add('200', now=10.5)
+    c.add('404', now=20, count=2)
+    c.add_counts({'200': 3, '500': 1}, now=30)
+    c.roll(now=300)
+    assert c.counts == {'200': 5, '404': 2, '500': 1}
+    c.roll(now=310)
+    assert c.counts == {'200': 5, '404': 2, '500': 1}
+    c.roll(now=311)
+    assert c.counts == {'200': 3, '404': 2, '500': 1}
+    c.roll(now=321)
+    assert c.counts == {'200': 3, '500': 1}
+    c.roll(now=400)
+    assert c.counts == {}
+
+
+def test_rolling_counter_memory_does_not_depend_on_event_count():
+    c = RollingCounter(window_s=60, granularity_s=10)
+    for i in range(10000):
+        c.add(str(i % 3), now=i / 100)
+    assert len(c._buckets) == 10
+    assert sum(c.counts.values()) == 10000
+    c.roll(now=100)
+    assert len(c._buckets) == 6
+    assert sum(c.counts.values()) == 6000
+
+
+def test_rolling_counter_bucket_capacity():
+    c = RollingCounter(window_s=60, granularity_s=10, bucket_capacity=2, other_key='<other>')
+    c.add_counts({'a': 1, 'b': 5, 'c': 3}, now=0)
+    c.add('d', now=1)
+    c.add('b', now=2)
+    assert c._buckets[-1][1] == {'b': 6, 'c': 3, '<other>': 2}
+    assert c.counts == {'b': 6, 'c': 3, '<other>': 2}
+    c.roll(now=100)
+    assert c.counts == {}
+
+
+def test_multi_window_counter_windows_match_rolling_counters():
+    windows_s = (60, 300, 900, 3600)
+    c = MultiWindowCounter(windows_s=windows_s, granularity_s=10)
+    rolling_counters = [RollingCounter(window_s=w, granularity_s=10) for w in windows_s]
+    for i in range(500):
+        now = i * 17.3
+        counts = {str(200 + i % 3): i % 5 + 1}
+        c.add_counts(counts, now)
+        for rc in rolling_counters:
+            rc.add_counts(counts, now)
+        if i % 7 == 0:
+            c.roll(now)
+            for window_s, rc in zip(windows_s, rolling_counters):
+                rc.roll(now)
+                assert +c.get_counts(window_s) == +rc.counts
+    # buckets are kept only for the longest window
+    assert len(c._buckets) <= 3600 / 10 + 1
+    c.roll(now=10**5)
+    assert all(c.get_counts(window_s) == {} for window_s in windows_s)
+    assert len(c._buckets) == 0
+
+
+def test_multi_window_counter_rates():
+    c = MultiWindowCounter(windows_s=(60, ), granularity_s=1, rate_time_constants_s=(60, 300))
+    for t in range(1000):
+        c.add_counts({'200': 10, '500': 1}, now=t)
+    rates = c.get_rates(now=1000)
+    assert rates[60]['200'] == approx(10, rel=1e-3)
+    assert rates[60]['500'] == approx(1, rel=1e-3)
+    assert rates[300]['200'] == approx(10 * (1 - exp(-1000 / 300)), rel=1e-3)
+    # no events for a minute
+    rates = c.get_rates(now=1060)
+    assert rates[60]['200'] == approx(10 * exp(-1), rel=1e-3)
+    c.add('200', now=1070)
+    assert c.get_rates(now=1071)[60]['200'] == approx(10 * exp(-71 / 60) + (1 - exp(-1 / 60)), rel=1e-3)
+
+
+def test_multi_window_counter_time_going_back_after_bucket_completed():
+    c = MultiWindowCounter(windows_s=(60, 300), granularity_s=10, rate_time_constants_s=(60,))
+    expected = MultiWindowCounter(windows_s=(60, 300), granularity_s=10, rate_time_constants_s=(60,))
+    c.add('a', now=5)
+    expected.add('a', now=5, count=2)
+    c.roll(now=15)
+    expected.roll(now=15)
+    # the event of the completed bucket comes late
+    c.add('a', now=8)
+    assert c.get_counts(60) == {'a': 2}
+    assert c.get_counts(300) == {'a': 2}
+    assert c.get_rates(now=15) == expected.get_rates(now=15)
+    c.add_counts({'a': 1}, now=16)
+    c.roll(now=65)
+    assert c.get_counts(60) == {'a': 1}
+    assert c.get_counts(300) == {'a': 3}
+    c.roll(now=400)
+    assert c.get_counts(60) == {}
+    assert c.get_counts(300) == {}
+
+
+def test_window_and_rate_names():
+    assert window_name(60) == 'last_1_min'
+    assert window_name(900.0) == 'last_15_min'
+    assert window_name(3600) == 'last_1_hour'
+    assert window_name(90) == 'last_90_s'
+    assert rate_name(300) == 'ewma_5_min'
@@ -0,0 +1,86 @@
+from asyncio import Queue, sleep
+from pytest import mark
+
+from nginx_log_monitor.access_log_parser import AccessLogRecord
+from nginx_log_monitor.configuration import Configuration
+from nginx_log_monitor.sentry import ServerErrorAggregator, TokenBucket, report_to_sentry
+from nginx_log_monitor.util import create_task
+
+
+mk_rec = lambda data: AccessLogRecord(data.get)
+
+
+def test_server_error_aggregator():
+    a = ServerErrorAggregator(max_samples=2)
+    a.add_many([mk_rec({'host': 'example.com', 'path': '/item/{}'.format(i), 'status': 502}) for i in range(10)])
+    a.add_many([
+        mk_rec({'host': 'example.com', 'path': '/item/1', 'status': 200}),
+        mk_rec({'host': 'example.com', 'path': '/item/1', 'status': 500}),
+    ])
+    aggregates = a.pop_all()
+    assert [(x.status, x.host, x.path, x.count) for x in aggregates] == [
+        (502, 'example.com', '/item/<n>', 10),
+        (500, 'example.com', '/item/<n>', 1),
+    ]
+    assert [s['path'] for s in aggregates[0].samples] == ['/item/0', '/item/1']
+    event = aggregates[0].get_event(window_s=10)
+    assert event['message'] == '10x 502 example.com/item/<n>'
+    assert event['extra']['count'] == 10
+    assert a.pop_all() == []
+
+
+def test_server_error_aggregator_caps_distinct_keys():
+    a = ServerErrorAggregator(max_samples=2, max_aggregates=3)
+    a.add_many([mk_rec({'host': 'example.com', 'path': '/scan{}'.format(i), 'status': 502}) for i in range(1000)])
+    a.add_many([mk_rec({'host': 'example.com', 'path': '/scan1', 'status': 502})])
+    aggregates = a.pop_all()
+    assert [(x.status, x.host, x.path, x.count) for x in aggregates] == [
+        (502, None, '<other>', 997),
+        (502, 'example.com', '/scan1', 2),
+        (502, 'example.com', '/scan0', 1),
+        (502, 'example.com', '/scan2', 1),
+    ]
+    assert len(aggregates[0].samples) == 2
+
+
+def test_token_bucket():
+    b = TokenBucket(rate_per_s=1, burst=3)
+    assert [b.take(now=100) for i in range(5)] == [True, True, True, False, False]
+    assert b.take(now=100.5) is False
+    assert b.take(now=101) is True
+    assert b.take(now=101) is False
+    assert [b.take(now=200) for i in range(4)] == [True, True, True, False]
+
+
+class FakeSentryClient:
+
+    def __init__(self):
+        self.events = []
+
+    async def report(self, dsn, event):
+        self.events.append(event)
+
+
+@mark.asyncio
+async def test_report_to_sentry_storm(temp_dir):
+    cfg_path = temp_dir / 'conf.yaml'
+    cfg_path.write_text(
+        'sentry:\n'
+        '  dsn: https://key@sentry.example.com/1\n'
+        '  aggregate_window_s: 0.05\n'
+        '  rate_limit_per_minute: 1\n'
+        '  rate_limit_burst: 2\n')
+    conf = Configuration(cfg_path=cfg_path)
+    q = Queue()
+    client = FakeSentryClient()
+    t = create_task(report_to_sentry(conf, q, client))
+    try:
+        for i in range(100):
+            await q.put([mk_rec({'path': '/api/{}'.format(i % 3), 'status': 502}) for j in range(100)])
+            await q.put([mk_rec({'path': '/login', 'status': 503})])
+        await sleep(0.1)
+        await q.put([mk_rec({'path': '/other', 'status': 500})])
+        await sleep(0.1)
+    finally:
+        t.cancel()
+    assert [e['message'] for e in client.events] == ['10000x 502 /api/<n>', '100x 503 /login']
@@ -0,0 +1,63 @@
+from collections import Counter
+from random import Random
+
+from nginx_log_monitor.space_saving import SpaceSaving
+
+
+def test_space_saving_like_counter():
+    c = SpaceSaving(20)
+    for ch in 'lorem ipsum dolor':
+        c[ch] += 1
+    assert c['o'] == 3
+    assert c['x'] == 0
+    assert 'x' not in c
+    assert dict(c.items()) == Counter('lorem ipsum dolor')
+    assert c.most_common(1) == [('o', 3)]
+    c.update({'o': 2, 'x': 1})
+    assert c['o'] == 5
+    assert c['x'] == 1
+    del c['o']
+    del c['not there']
+    assert 'o' not in c
+
+
+def test_space_saving_is_bounded():
+    c = SpaceSaving(3)
+    c.update({'a': 10, 'b': 5, 'c': 1})
+    c['d'] += 1
+    assert len(c) == 3
+    assert 'c' not in c
+    # d took over the count of c
+    assert c['d'] == 2
+    assert c.error('d') == 1
+    assert c.error('a') == 0
+
+
+def test_space_saving_error_bounds():
+    rnd = Random(42)
+    capacity = 100
+    c = SpaceSaving(capacity)
+    true_counts = Counter()
+    for i in range(50000):
+        key = int(rnd.paretovariate(1.1)) if rnd.random() < 0.8 else rnd.random()
+        c[key] += 1
+        true_counts[key] += 1
+    total = sum(true_counts.values())
+    assert len(c) == capacity
+    for key, count in true_counts.items():
+        if count > total / capacity:
+            assert key in c
+    for key, count in c.items():
+        assert true_counts[key] <= count <= true_counts[key] + c.error(key)
+        assert c.error(key) <= total / capacity
+    assert [k for k, n in c.most_common(5)] == [k for k, n in true_counts.most_common(5)]
+
+
+def test_space_saving_scan_is_bounded():
+    c = SpaceSaving(10000)
+    for i in range(100000):
+        c['/scan/{}'.format(i)] += 1
+    assert len(c) == 10000
+    assert sum(len(keys) for keys in c._keys_by_count.values()) == 10000
+    assert sum(c[key] for key in c) == 100000
+    assert all(c[key] - c.error(key) == 1 for key in c)
@@ -77,3 +77,41 @@ def test_status_stats_rolling():
             },
         },
     }
+
+
+def test_status_stats_update_many():
+    mk_rec = lambda data: AccessLogRecord(data.get)
+    records = [
+        mk_rec({'path': '/foo', 'status': 200}),
+        mk_rec({'path': '/foo', 'status': 404}),
+        mk_rec({'path': '/bar/1234', 'status': 200}),
+        mk_rec({'path': '/bar/89', 'status': 500}),
+    ]
+    s1 = StatusStats()
+    for rec in records:
+        s1.update(rec, now=10)
+    s2 = StatusStats()
+    s2.update_many(records, now=10)
+    assert s2.get_report(now=20) == s1.get_report(now=20)
+    assert s2.total_status_count['200'] == 2
+    assert s2.total_status_count['404'] == 1
+    assert s2.total_status_count['500'] == 1
+    assert s2.have_5xx.is_set()
+
+
+def test_status_stats_windows_and_rates():
+    mk_rec = lambda data: AccessLogRecord(data.get)
+    s = StatusStats(windows_s=(60, 3600), rate_time_constants_s=(60, ))
+    for t in range(600):
+        s.update_many([mk_rec({'status': 200})] * 9 + [mk_rec({'status': 502})], now=t)
+    report = s.get_report(now=600)
+    assert list(report['status_count'].keys()) == ['total', 'last_5_min', 'last_1_min', 'last_1_hour']
+    assert report['status_count']['last_1_min']['502'] == 60
+    assert report['status_count']['last_5_min']['502']['__value'] == 300
+    assert report['status_count']['last_1_hour']['502'] == 600
+    rates = report['request_rate_per_s']['ewma_1_min']
+    assert list(rates.keys()) == ['all', '1xx', '2xx', '3xx', '4xx', '5xx']
+    assert rates['all'] == 10
+    assert rates['2xx'] == 9
+    assert rates['5xx'] == 1
+    assert rates['4xx'] == 0
@@ -0,0 +1,70 @@
+from asyncio import sleep, wait_for
+from pytest import mark
+
+from nginx_log_monitor.access_log_parser import parse_access_log_line
+from nginx_log_monitor.path_stats import PathStats
+from nginx_log_monitor.status_stats import StatusStats
+from nginx_log_monitor.util import create_task
+from nginx_log_monitor.worker_pool import WorkerPool, parse_lines
+
+
+sample_lines = [
+    '1.2.3.4 - - [04/Feb/2020:11:02:10 +0000] "GET /{i} HTTP/1.1" {status} 396 "-" "Mozilla/5.0"'.format(
+        i=i, status=(200, 404, 502)[i % 3]).encode()
+    for i in range(100)
+] + [b'garbage']
+
+
+def test_parse_lines():
+    partial = parse_lines('access.log', None, b'\n'.join(sample_lines))
+    assert partial.line_count == 101
+    assert partial.failed_count == 1
+    assert partial.status_count == {'200': 34, '404': 33, '502': 33}
+    assert partial.path_status_count['502'] == {'/<n>': 33}
+    assert len(partial.server_error_records) == 33
+    assert partial.server_error_records[0].path == '/2'
+
+
+def test_merge_partial_stats_same_as_update_many():
+    records = [parse_access_log_line(line.decode()) for line in sample_lines[:-1]]
+    status_stats, path_stats = StatusStats(), PathStats()
+    status_stats.update_many(records, now=10)
+    path_stats.update_many(records, now=10)
+
+    merged_status_stats, merged_path_stats = StatusStats(), PathStats()
+    for i in range(0, len(sample_lines), 30):
+        partial = parse_lines('access.log', None, b'\n'.join(sample_lines[i:i + 30]))
+        merged_status_stats.merge(partial.status_count, now=10)
+        merged_path_stats.merge(partial.path_status_count, now=10)
+
+    assert merged_status_stats.get_report(now=20) == status_stats.get_report(now=20)
+    assert merged_path_stats.get_report(now=20) == path_stats.get_report(now=20)
+    assert merged_status_stats.have_5xx.is_set()
+
+
+@mark.asyncio
+async def test_worker_pool():
+    merged = []
+
+    async def merge_partial_stats(partial):
+        merged.append(partial)
+
+    async def wait_for_all_lines():
+        while sum(p.line_count for p in merged) < len(sample_lines):
+            await sleep(0.01)
+
+    with WorkerPool(2) as pool:
+        pool.chunk_lines = 10
+        merge_task = create_task(pool.merge_results(merge_partial_stats))
+        try:
+            await pool.submit('access.log', None, sample_lines)
+            await wait_for(wait_for_all_lines(), 10)
+        finally:
+            merge_task.cancel()
+    assert len(merged) == 11
+    assert sum(p.status_count['200'] for p in merged) == 34
+    assert sum(p.failed_count for p in merged) == 1
+    # results are merged in the order of the submitted lines
+    assert merged[0].server_error_records[0].path == '/2'
+    assert merged[-1].failed_count == 1
+